@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成画像（キャラクター・背景・ロゴ）とジョブJSONを生成する
+
+ネットワークや実データなしで実行できるよう、乱数シード固定で毎回同じ画像を作る。
+解像度は実データに近い大きさ（キャラクター 1800x2400 のRGBA、背景 2400x3200、ロゴ 1000x500）。
+
+- キャラクター: 楕円・円の重なり＋グラデーション＋弱いノイズ。縁はぼかしたαで半透明の発光を再現
+  （白板処理の閾値・収縮がきちんと働くように）
+- 背景: 縦横のグラデーションに模様とノイズ（PNG圧縮が実際のイラストに近い負荷になるように）
+- ロゴ: 透明地に文字風の矩形
+
+生成した画像は出力先ディレクトリに保存し、同じ設定なら再利用する（ファイル名にパラメータを含める）。
+"""
+
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+CHAR_SIZE = (1800, 2400)
+BG_SIZE = (2400, 3200)
+LOGO_SIZE = (1000, 500)
+FIXTURE_VERSION = 1
+
+
+def _noise(rng: np.random.Generator, size: Tuple[int, int], amount: int) -> np.ndarray:
+    w, h = size
+    return rng.integers(-amount, amount + 1, size=(h, w, 1), dtype=np.int16)
+
+
+def _gradient(size: Tuple[int, int], top: Tuple[int, int, int], bottom: Tuple[int, int, int]) -> np.ndarray:
+    w, h = size
+    t = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None, None]
+    return (np.array(top, np.float32) * (1 - t) + np.array(bottom, np.float32) * t).repeat(w, axis=1)
+
+
+def make_char(seed: int, size: Tuple[int, int] = CHAR_SIZE) -> Image.Image:
+    """キャラクター風のRGBA画像（中央の人物シルエット＋半透明の発光）"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    hue = rng.integers(40, 220, size=3)
+    rgb = _gradient(size, tuple(hue), tuple(255 - hue)) + _noise(rng, size, 6)
+
+    alpha = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(alpha)
+    cx = w // 2 + int(rng.integers(-w // 10, w // 10))
+    draw.ellipse((cx - w * 0.16, h * 0.08, cx + w * 0.16, h * 0.32), fill=255)  # 頭
+    draw.rounded_rectangle((cx - w * 0.26, h * 0.30, cx + w * 0.26, h * 0.92), radius=w // 8, fill=255)  # 体
+    for _ in range(6):  # 髪・装飾
+        r = int(rng.integers(w // 20, w // 8))
+        x = cx + int(rng.integers(-w // 3, w // 3))
+        y = int(rng.integers(h // 10, h * 4 // 5))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=int(rng.integers(160, 256)))
+    # 発光: ぼかしたαを弱く重ねて縁を半透明にする
+    glow = alpha.filter(ImageFilter.GaussianBlur(radius=w // 60)).point(lambda v: v * 0.5)
+    a = np.maximum(np.asarray(alpha), np.asarray(glow))
+
+    arr = np.dstack([np.clip(rgb, 0, 255).astype(np.uint8), a])
+    return Image.fromarray(arr, "RGBA")
+
+
+def make_bg(seed: int, size: Tuple[int, int] = BG_SIZE) -> Image.Image:
+    """背景風のRGBA画像（不透明）"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    c1, c2 = rng.integers(0, 256, size=(2, 3))
+    rgb = _gradient(size, tuple(c1), tuple(c2))
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    period = float(rng.integers(80, 240))
+    pattern = (np.sin(xx / period) * np.cos(yy / (period * 1.3)) * 24.0)[:, :, None]
+    rgb = rgb + pattern + _noise(rng, size, 4)
+    arr = np.dstack([np.clip(rgb, 0, 255).astype(np.uint8), np.full((h, w), 255, np.uint8)])
+    return Image.fromarray(arr, "RGBA")
+
+
+def make_logo(seed: int, size: Tuple[int, int] = LOGO_SIZE) -> Image.Image:
+    """ロゴ風のRGBA画像（透明地に文字風の矩形）"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    im = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(im)
+    color = tuple(int(c) for c in rng.integers(0, 256, size=3)) + (255,)
+    x = w // 12
+    while x < w * 11 // 12:
+        cw = int(rng.integers(w // 20, w // 9))
+        top = int(rng.integers(h // 6, h // 3))
+        draw.rounded_rectangle((x, top, x + cw, h - top), radius=cw // 4, fill=color)
+        x += cw + w // 40
+    return im.filter(ImageFilter.GaussianBlur(radius=1))
+
+
+def _save(im: Image.Image, path: str):
+    if not os.path.exists(path):
+        tmp = f"{path}.tmp"
+        im.save(tmp, format="PNG")
+        os.replace(tmp, path)
+
+
+def ensure_fixtures(out_dir: str, n_chars: int = 6, n_bgs: int = 2, n_logos: int = 2) -> Dict[str, List[str]]:
+    """合成画像を out_dir に用意してパスを返す（既にあれば作らない）"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths: Dict[str, List[str]] = {"char": [], "bg": [], "logo": []}
+    makers = {"char": (make_char, n_chars, CHAR_SIZE), "bg": (make_bg, n_bgs, BG_SIZE), "logo": (make_logo, n_logos, LOGO_SIZE)}
+    for kind, (make, count, size) in makers.items():
+        for i in range(count):
+            path = os.path.join(out_dir, f"v{FIXTURE_VERSION}_{kind}{i}_{size[0]}x{size[1]}.png")
+            if not os.path.exists(path):
+                _save(make(1000 * (list(makers).index(kind) + 1) + i), path)
+            paths[kind].append(path)
+    return paths
+
+
+def make_job(paths: Dict[str, List[str]], n_cards: int, cards_per_order: int = 3) -> List[Dict]:
+    """画像情報（--images と同じ形式）を作る。背景・ロゴは一部のカードだけに付け、同じ画像を使い回す
+
+    amountは1〜3枚で、合計がn_cards枚になるようにする。orderIdは cards_per_order 枚ごとに変える。
+    """
+    items = []
+    total = 0
+    i = 0
+    while total < n_cards:
+        amount = min(1 + i % 3, n_cards - total)
+        items.append({
+            "key": f"bench_{i}",
+            "char": paths["char"][i % len(paths["char"])],
+            "bg": paths["bg"][i % len(paths["bg"])] if paths["bg"] and i % 2 == 0 else None,
+            "logo": paths["logo"][i % len(paths["logo"])] if paths["logo"] and i % 4 == 1 else None,
+            "orderId": str(1 + total // max(1, cards_per_order)),
+            "userName": f"ユーザー{i % 7}",
+            "amount": amount,
+        })
+        total += amount
+        i += 1
+    return items
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成画像とジョブJSONを生成")
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"), help="画像の出力先")
+    parser.add_argument("--cards", type=int, default=36, help="ジョブJSONのカード枚数")
+    parser.add_argument("--job", default=None, help="ジョブJSONの出力先（--images-file に渡せる）")
+    args = parser.parse_args()
+
+    fixture_paths = ensure_fixtures(args.output_dir)
+    for kind, kind_paths in fixture_paths.items():
+        print(f"{kind}: {len(kind_paths)} files")
+    if args.job:
+        with open(args.job, "w", encoding="utf-8") as f:
+            json.dump(make_job(fixture_paths, args.cards), f, ensure_ascii=False, indent=2)
+        print(f"Job: {args.job}")
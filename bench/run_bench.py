@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+シート生成の主要な処理の実行時間を測るベンチマーク
+
+fixtures.py の合成画像（ネットワーク・実データ不要）を使い、次の処理を繰り返し実行して
+最小・中央値・平均の秒数をJSONに書き出す。同じマシンで取った前回の結果を --compare に渡すと、
+遅くなった処理を一覧にして終了コード1で終わる（CIなどで本番前に性能の劣化に気づくため）。
+
+グループ（--only で選べる）:
+- resize: resize_char_canvas（キャラクター・ロゴ）、resize_bg_canvas（背景）
+- knockout: 白板スタイルごとの make_knockout_mask（1枚）と make_knockout_masks（1ページ分まとめて）
+- sheet: make_sheet_layers（1ページ分。画像は読み込み済み。合成と、その後のPNG書き出しを分けても記録）
+- pipeline: index.py の process_pages（読み込みから書き出しまで）
+- parallel: index_parallel.py の process_pages_parallel（--workers のワーカー数ごと）
+
+--calibrate を指定すると、計測（metrics）を有効にした1ページ分の処理から --plan-costs 用の
+コスト（デコード・合成・ページ固定費・エンコードの秒数）を求めてJSONに書き出す。
+出力サイズ（output_bytes_*）は合成画像では実データと圧縮率が違うので含めない。
+
+使い方:
+    python3 bench/run_bench.py                       # 全グループ → bench/results/bench_<日時>.json
+    python3 bench/run_bench.py --quick --only resize knockout
+    python3 bench/run_bench.py --compare bench/results/bench_20250801-120000.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+import PIL
+from PIL import Image
+
+import knockout
+import metrics
+from image_cache import ImageCache
+from index import (
+    CARD_PX, ALLOW_UPSCALE_CHAR, ALLOW_UPSCALE_BG, KNOCKOUT_THRESHOLD, KNOCKOUT_SHRINK_PX,
+    mm_to_px, resize_char_canvas, resize_bg_canvas, make_knockout_mask, make_knockout_masks,
+    make_sheet_layers, load_images, plan_job, process_pages,
+)
+from index_parallel import process_pages_parallel
+from layer_writer import LayerWriter, LAYERS_PER_PAGE, DEFAULT_ENCODE_WORKERS
+
+from fixtures import FIXTURE_VERSION, ensure_fixtures, make_job
+
+BENCH_VERSION = 1
+GROUPS = ("resize", "knockout", "sheet", "pipeline", "parallel")
+BENCH_DIR = Path(__file__).parent
+DEFAULT_SHEET = "280x580"
+CARD_STAGES = ("knockout", "composite", "glare", "label")
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    """標準出力をファイル記述子ごと捨てる（ワーカープロセスの出力も含む）"""
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def measure(fn: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    """fnをrepeat回実行した秒数のリスト（setupは毎回の実行前に呼び、時間に含めない）"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+class DeferredWriter(LayerWriter):
+    """start() を呼ぶまで書き出しを始めない LayerWriter（合成と書き出しの時間を分けて測る）"""
+
+    def __init__(self, max_workers: int = DEFAULT_ENCODE_WORKERS):
+        # 1ページ分のレイヤーを全部積めるようにしておく（積んだまま待つとデッドロックするため）
+        super().__init__(max_workers=max_workers, max_pending=LAYERS_PER_PAGE * 2)
+        self._gate = threading.Event()
+        for _ in range(max(1, max_workers)):
+            self._executor.submit(self._gate.wait)
+
+    def start(self):
+        self._gate.set()
+
+
+def result(name: str, group: str, samples: List[float], **params) -> Dict:
+    return {
+        "name": name,
+        "group": group,
+        "params": params,
+        "repeat": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "samples": samples,
+    }
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCH_DIR.parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "git_commit": commit,
+        "fixture_version": FIXTURE_VERSION,
+    }
+
+
+# ---- グループごとのベンチマーク ----------------------------------------------
+
+def bench_resize(paths: Dict[str, List[str]], repeat: int) -> List[Dict]:
+    char = Image.open(paths["char"][0]).convert("RGBA")
+    bg = Image.open(paths["bg"][0]).convert("RGBA")
+    logo = Image.open(paths["logo"][0]).convert("RGBA")
+    return [
+        result("resize_char_canvas", "resize",
+               measure(lambda: resize_char_canvas(char, CARD_PX, ALLOW_UPSCALE_CHAR), repeat), source=list(char.size)),
+        result("resize_bg_canvas", "resize",
+               measure(lambda: resize_bg_canvas(bg, CARD_PX, ALLOW_UPSCALE_BG), repeat), source=list(bg.size)),
+        result("resize_char_canvas[logo]", "resize",
+               measure(lambda: resize_char_canvas(logo, CARD_PX, True), repeat), source=list(logo.size)),
+    ]
+
+
+def bench_knockout(paths: Dict[str, List[str]], repeat: int, batch_cards: int) -> List[Dict]:
+    alphas = [
+        resize_char_canvas(Image.open(p).convert("RGBA"), CARD_PX, ALLOW_UPSCALE_CHAR).getchannel("A")
+        for p in paths["char"]
+    ]
+    page = [alphas[i % len(alphas)] for i in range(batch_cards)]
+    results = []
+    for style in knockout.available_styles():
+        results.append(result(
+            f"make_knockout_mask[{style}]", "knockout",
+            measure(lambda: make_knockout_mask(alphas[0], KNOCKOUT_THRESHOLD, KNOCKOUT_SHRINK_PX, style), repeat),
+            style=style, shrink_px=KNOCKOUT_SHRINK_PX,
+        ))
+        results.append(result(
+            f"make_knockout_masks[{style}]", "knockout",
+            measure(lambda: make_knockout_masks(page, KNOCKOUT_THRESHOLD, KNOCKOUT_SHRINK_PX, style), repeat),
+            style=style, shrink_px=KNOCKOUT_SHRINK_PX, cards=batch_cards,
+        ))
+    return results
+
+
+def first_page(job: List[Dict], sheet_mm) -> List[Dict]:
+    with quiet():
+        page_items, _ = plan_job(job, sheet_mm, pagination="fill")
+    return page_items[0]
+
+
+def bench_sheet(job: List[Dict], sheet_mm, repeat: int, out_dir: str, verbose: bool) -> List[Dict]:
+    items = first_page(job, sheet_mm)
+    with quiet(not verbose):
+        cards = load_images(items, ImageCache())
+    prefix = os.path.join(out_dir, "sheet")
+    compose: List[float] = []
+    encode: List[float] = []
+
+    def run():
+        # 合成（make_sheet_layersが戻るまで）と書き出し（その後の完了待ち）を分けて記録する
+        writer = DeferredWriter()
+        with quiet(not verbose):
+            t0 = time.perf_counter()
+            try:
+                make_sheet_layers(sheet_mm, cards, output_prefix=prefix, writer=writer)
+                t1 = time.perf_counter()
+            finally:
+                writer.start()
+                writer.close()
+        compose.append(t1 - t0)
+        encode.append(time.perf_counter() - t1)
+
+    total = measure(run, repeat)
+    params = {"cards": len(cards), "sheet": DEFAULT_SHEET, "encode_workers": DEFAULT_ENCODE_WORKERS}
+    return [
+        result("make_sheet_layers", "sheet", total, **params),
+        result("make_sheet_layers[compose]", "sheet", compose, **params),
+        result("make_sheet_layers[encode]", "sheet", encode, **params),
+    ]
+
+
+def bench_pipeline(job: List[Dict], sheet_mm, repeat: int, out_dir: str, verbose: bool) -> List[Dict]:
+    def run():
+        with quiet(not verbose):
+            process_pages(job, sheet_mm, output_dir=out_dir, pagination="fill")
+
+    cards = sum(info.get("amount", 1) for info in job)
+    return [result("process_pages", "pipeline", measure(run, repeat, lambda: shutil.rmtree(out_dir, ignore_errors=True)),
+                   cards=cards, sheet=DEFAULT_SHEET)]
+
+
+def bench_parallel(job: List[Dict], sheet_mm, repeat: int, out_dir: str, workers: List[int], verbose: bool) -> List[Dict]:
+    cards = sum(info.get("amount", 1) for info in job)
+    results = []
+    for n in workers:
+        def run():
+            with quiet(not verbose):
+                process_pages_parallel(job, sheet_mm, output_dir=out_dir, max_workers=n, pagination="fill")
+
+        results.append(result(
+            f"process_pages_parallel[workers={n}]", "parallel",
+            measure(run, repeat, lambda: shutil.rmtree(out_dir, ignore_errors=True)),
+            cards=cards, sheet=DEFAULT_SHEET, workers=n,
+        ))
+    return results
+
+
+# ---- --plan-costs の較正 -----------------------------------------------------
+
+def calibrate(job: List[Dict], sheet_mm, out_dir: str, verbose: bool) -> Dict[str, float]:
+    """1ページ分を計測付きで処理し、dry_run の DEFAULT_COSTS と同じキーのコストを求める
+
+    DEFAULT_COSTS と同じく1コアでの値にするため、書き出しは合成が終わってから1スレッドで行う。
+    """
+    base_rss = metrics.current_rss()
+    items = first_page(job, sheet_mm)
+    recorder = metrics.enable()
+    recorder.drain()
+    writer = DeferredWriter(max_workers=1)
+    with quiet(not verbose):
+        cards = load_images(items, ImageCache())
+        t0 = time.perf_counter()
+        try:
+            make_sheet_layers(sheet_mm, cards, output_prefix=os.path.join(out_dir, "calibrate"), writer=writer)
+            compose = time.perf_counter() - t0
+        finally:
+            writer.start()
+            writer.close()
+    records = recorder.drain()
+
+    decoded = {r["file"] for r in records if r["stage"] == "decode"}
+    source_mpx = sum(w * h for w, h in (Image.open(p).size for p in decoded)) / 1e6
+    decode = sum(r["seconds"] for r in records if r["stage"] in ("decode", "resize_char", "resize_bg"))
+    card = sum(r["seconds"] for r in records if r["stage"] in CARD_STAGES)
+    encodes = [r for r in records if r["stage"] == "png_encode"]
+    sheet_mpx = mm_to_px(sheet_mm[0]) * mm_to_px(sheet_mm[1]) / 1e6
+    costs = {
+        "decode_seconds_per_mpx": round(decode / source_mpx, 4) if source_mpx else None,
+        "card_seconds": round(card / len(cards), 4),
+        "page_seconds": round(max(0.0, compose - card), 4),
+        "encode_seconds_per_layer_mpx": round(sum(r["seconds"] for r in encodes) / (len(encodes) * sheet_mpx), 4) if encodes else None,
+        "base_rss_bytes": base_rss,
+    }
+    # 求められなかった項目は DEFAULT_COSTS のままにする
+    return {key: value for key, value in costs.items() if value is not None}
+
+
+# ---- 比較 --------------------------------------------------------------------
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """各ベンチマークの最小値を前回と比べ、(1 + tolerance) 倍より遅いものを返す"""
+    previous = {r["name"]: r for r in baseline["results"]}
+    if baseline.get("environment", {}).get("cpu_count") != current["environment"]["cpu_count"]:
+        print("Warning: 比較対象とCPU数が違います（結果は参考値）")
+    regressions = []
+    print(f"\n=== 前回との比較（許容 +{tolerance * 100:.0f}%） ===")
+    for r in current["results"]:
+        old = previous.get(r["name"])
+        if old is None:
+            print(f"  {r['name']:<45} {r['min']:9.4f}s  (new)")
+            continue
+        ratio = r["min"] / old["min"] if old["min"] else float("inf")
+        mark = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"  {r['name']:<45} {old['min']:9.4f}s → {r['min']:9.4f}s  x{ratio:5.2f} {mark}")
+        if mark:
+            regressions.append({"name": r["name"], "baseline": old["min"], "current": r["min"], "ratio": ratio})
+    return regressions
+
+
+def print_results(results: List[Dict]):
+    print(f"\n=== ベンチマーク結果 ===")
+    for r in results:
+        print(f"  {r['name']:<45} min {r['min']:9.4f}s  median {r['median']:9.4f}s  ({r['repeat']}回)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シート生成のベンチマーク（合成画像を使用）")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS), help="実行するグループ")
+    parser.add_argument("--repeat", type=int, default=5, help="resize・knockoutの繰り返し回数")
+    parser.add_argument("--repeat-full", type=int, default=3, help="sheet・pipeline・parallelの繰り返し回数")
+    parser.add_argument("--cards", type=int, default=36, help="pipeline・parallelのカード枚数（280x580は1ページ18枚）")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="parallelのワーカー数")
+    parser.add_argument("--quick", action="store_true", help="短時間で回す（繰り返し1〜3回、カード18枚）")
+    parser.add_argument("--fixtures", default=str(BENCH_DIR / "fixtures"), help="合成画像の置き場所（なければ生成）")
+    parser.add_argument("--output", default=None, help="結果のJSON（既定: bench/results/bench_<日時>.json）")
+    parser.add_argument("--compare", default=None, help="前回の結果JSON。遅くなったものがあれば終了コード1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="--compareで許容する遅れ（0.2 = 20%%）")
+    parser.add_argument("--calibrate", default=None, help="--plan-costs用のコストJSONの出力先")
+    parser.add_argument("--verbose", action="store_true", help="処理中の出力を表示する")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+        args.repeat_full = 1
+        args.cards = min(args.cards, 18)
+
+    sheet_mm = tuple(map(float, DEFAULT_SHEET.split("x")))
+    print(f"Fixtures: {args.fixtures}")
+    paths = ensure_fixtures(args.fixtures)
+    job = make_job(paths, args.cards)
+
+    started = time.time()
+    results: List[Dict] = []
+    work_dir = tempfile.mkdtemp(prefix="sheet_bench_")
+    try:
+        for group in GROUPS:
+            if group not in args.only:
+                continue
+            print(f"Running {group}...")
+            out_dir = os.path.join(work_dir, group)
+            os.makedirs(out_dir, exist_ok=True)
+            if group == "resize":
+                results += bench_resize(paths, args.repeat)
+            elif group == "knockout":
+                results += bench_knockout(paths, args.repeat, batch_cards=18)
+            elif group == "sheet":
+                results += bench_sheet(job, sheet_mm, args.repeat_full, out_dir, args.verbose)
+            elif group == "pipeline":
+                results += bench_pipeline(job, sheet_mm, args.repeat_full, out_dir, args.verbose)
+            elif group == "parallel":
+                results += bench_parallel(job, sheet_mm, args.repeat_full, out_dir, args.workers, args.verbose)
+        costs = calibrate(job, sheet_mm, work_dir, args.verbose) if args.calibrate else None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "version": BENCH_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "wall_seconds": round(time.time() - started, 3),
+        "environment": environment(),
+        "settings": {
+            "sheet": DEFAULT_SHEET,
+            "card_px": list(CARD_PX),
+            "cards": args.cards,
+            "repeat": args.repeat,
+            "repeat_full": args.repeat_full,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+    print_results(results)
+
+    output = args.output or str(BENCH_DIR / "results" / time.strftime("bench_%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果: {output}")
+
+    if costs is not None:
+        with open(args.calibrate, "w", encoding="utf-8") as f:
+            json.dump(costs, f, indent=2)
+        print(f"コスト（--plan-costs 用）: {args.calibrate}")
+        for key, value in costs.items():
+            print(f"  {key}: {value}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} 件のベンチマークが遅くなっています")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
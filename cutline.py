@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# cutline.py - カットラインのベクター出力（SVG / PDF）
+"""
+カットラインはカード配置（grid_layoutの座標）・CARD_PX・CUTLINE_PXだけで決まる矩形なので、
+ラスタ画像を描かずに座標から直接ベクターパスとして書き出す。
+
+矩形は cutline_rects() の (x1, y1, x2, y2)（両端を含む画素範囲）で表し、ラスタ版の
+ImageDraw.rectangle(outline, width=CUTLINE_PX) と同じ範囲に線が入るよう、線の中心を
+外周から CUTLINE_PX/2 内側に置く。
+"""
+from typing import List, Sequence, Tuple
+
+from pdf_writer import write_layered_pdf
+
+MM_PER_INCH = 25.4
+VECTOR_FORMATS = ("svg", "pdf")
+
+Rect = Tuple[int, int, int, int]
+
+
+def cutline_rects(positions: Sequence[Tuple[int, int]], card_px: Tuple[int, int], cutline_px: int) -> List[Rect]:
+    """各カードのカットライン矩形（カード領域の外側にcutline_px幅の枠、両端を含む）"""
+    w, h = card_px
+    return [
+        (x - cutline_px, y - cutline_px, x + w + cutline_px - 1, y + h + cutline_px - 1)
+        for x, y in positions
+    ]
+
+
+def _num(v: float) -> str:
+    s = f"{v:.3f}".rstrip("0").rstrip(".")
+    return s or "0"
+
+
+def cutline_svg(rects: Sequence[Rect], sheet_size: Tuple[int, int], dpi: int, line_px: int) -> str:
+    """カットラインのSVG（座標はpx、width/heightはmmで実寸を指定）"""
+    w, h = sheet_size
+    half = line_px / 2.0
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_num(w / dpi * MM_PER_INCH)}mm" '
+        f'height="{_num(h / dpi * MM_PER_INCH)}mm" viewBox="0 0 {w} {h}">',
+        f'<g id="cutline" fill="none" stroke="#000000" stroke-width="{line_px}">',
+    ]
+    for x1, y1, x2, y2 in rects:
+        lines.append(
+            f'<rect x="{_num(x1 + half)}" y="{_num(y1 + half)}" '
+            f'width="{_num(x2 + 1 - x1 - line_px)}" height="{_num(y2 + 1 - y1 - line_px)}"/>'
+        )
+    lines += ["</g>", "</svg>", ""]
+    return "\n".join(lines)
+
+
+def write_cutline(path: str, fmt: str, rects: Sequence[Rect], sheet_size: Tuple[int, int], dpi: int, line_px: int):
+    """カットラインをSVGまたはPDF（cutlineレイヤー1つのPDF）で書き出す"""
+    if fmt == "svg":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(cutline_svg(rects, sheet_size, dpi, line_px))
+    elif fmt == "pdf":
+        write_layered_pdf(path, sheet_size, dpi, [], cut_rects=rects, cutline_px=line_px)
+    else:
+        raise ValueError(f"Unknown cutline format: {fmt}")
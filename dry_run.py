@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# dry_run.py - --plan: 画像をデコードせずにページ計画と所要時間・メモリ・出力サイズを見積もる
+"""
+画像はヘッダーだけを読み（Image.open は画素をデコードしない）、ページ計画は本番と同じ
+layout の関数で作る。見積もりはカード1枚・ページ1枚あたりの実測コスト（DEFAULT_COSTS）からの
+概算で、--plan-costs に JSON を渡すと項目ごとに上書きできる。
+
+DEFAULT_COSTS は 280x580mm・350dpi のシート、zlib標準（レベル6）、1コアで測った値:
+- decode_seconds_per_mpx: 元画像のデコード＋CARD_PXへのリサイズ（元画像1メガピクセルあたり）
+- card_seconds: カード1枚の合成（白板・グレア・カットライン・ラベル）
+- page_seconds: ページ1枚の固定費（レイヤー確保・配置・書き出し前の切り抜き判定）
+- encode_seconds_per_layer_mpx: PNGエンコード（レイヤー1枚の1メガピクセルあたり）
+- output_bytes_per_card / _per_bg_card / _per_logo_card: 出力PNGのカード1枚あたりのバイト数
+  （背景・ロゴのあるカードは追加分）
+- base_rss_bytes: Python＋Pillow＋NumPyを読み込んだだけのプロセスのメモリ
+"""
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from image_cache import DEFAULT_MAX_BYTES
+from layer_writer import MASK_LAYERS, LAYERS_PER_PAGE
+
+DEFAULT_COSTS = {
+    "decode_seconds_per_mpx": 0.08,
+    "card_seconds": 0.16,
+    "page_seconds": 0.9,
+    "encode_seconds_per_layer_mpx": 0.04,
+    "output_bytes_per_card": 170_000,
+    "output_bytes_per_bg_card": 1_800_000,
+    "output_bytes_per_logo_card": 115_000,
+    "base_rss_bytes": 40 * 1024 * 1024,
+}
+MB = 1024 * 1024
+
+
+def load_costs(path: Optional[str] = None) -> Dict[str, float]:
+    """DEFAULT_COSTS に --plan-costs のJSONを上書きしたもの
+
+    ファイルが読めなければ OSError、内容が正しくなければ ValueError（JSONの構文エラーを含む）。
+    """
+    costs = dict(DEFAULT_COSTS)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError("costs must be a JSON object")
+        unknown = set(overrides) - set(costs)
+        if unknown:
+            raise ValueError(f"Unknown cost keys: {', '.join(sorted(unknown))}")
+        invalid = [k for k, v in overrides.items() if isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0]
+        if invalid:
+            raise ValueError(f"Cost values must be non-negative numbers: {', '.join(sorted(invalid))}")
+        costs.update(overrides)
+    return costs
+
+
+class HeaderReader:
+    """画像ヘッダーから大きさを読む（同じパスは1度だけ開く）"""
+
+    def __init__(self):
+        self.sizes: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def size(self, path: str) -> Optional[Tuple[int, int]]:
+        if path not in self.sizes:
+            try:
+                with Image.open(path) as im:
+                    self.sizes[path] = im.size
+            except Exception:
+                self.sizes[path] = None
+        return self.sizes[path]
+
+    @property
+    def missing(self) -> List[str]:
+        return [path for path, size in self.sizes.items() if size is None]
+
+
+def _item_paths(info: Dict) -> List[str]:
+    return [info[k] for k in ("char", "bg", "logo") if info.get(k)]
+
+
+def estimate_job(
+    page_items: List[List[Dict]],
+    sheet_px: Tuple[int, int],
+    card_px: Tuple[int, int],
+    mask_format: str = "rgba",
+    parallel: bool = False,
+    workers: int = 1,
+    encode_workers: int = 1,
+    costs: Optional[Dict[str, float]] = None,
+) -> Dict:
+    """ページ計画から、ページごとのデコード量と全体の時間・メモリ・出力サイズを見積もる
+
+    parallelがFalseなら index.py（ページを順に処理し、PNGの書き出しはencode_workersスレッドで次のページと並行）、
+    Trueなら index_parallel.py（ページごとにworkers個のワーカープロセスで処理）として見積もる。
+    """
+    costs = costs or DEFAULT_COSTS
+    headers = HeaderReader()
+    sheet_mpx = sheet_px[0] * sheet_px[1] / 1e6
+    card_bytes = card_px[0] * card_px[1] * 4
+    mask_bpp = 4 if mask_format == "rgba" else 1
+    layer_bytes = int(sheet_px[0] * sheet_px[1] * (
+        (LAYERS_PER_PAGE - len(MASK_LAYERS)) * 4 + len(MASK_LAYERS) * mask_bpp
+    ))
+
+    pages = []
+    job_sources: Dict[str, float] = {}
+    largest_source = 0
+    for page_no, items in enumerate(page_items, start=1):
+        sources: Dict[str, float] = {}
+        cards = bg_cards = logo_cards = 0
+        for info in items:
+            amount = info.get("amount", 1)
+            cards += amount
+            bg_cards += amount if info.get("bg") else 0
+            logo_cards += amount if info.get("logo") else 0
+            for path in _item_paths(info):
+                size = headers.size(path)
+                if size is not None:
+                    sources[path] = size[0] * size[1] / 1e6
+                    largest_source = max(largest_source, size[0] * size[1] * 4)
+        job_sources.update(sources)
+        layers_written = LAYERS_PER_PAGE if logo_cards else LAYERS_PER_PAGE - 2
+        pages.append({
+            "page": page_no,
+            "cards": cards,
+            "unique_images": len(sources),
+            "decoded_bytes": int(sum(sources.values()) * 1e6 * 4),
+            "tile_bytes": len(sources) * card_bytes,
+            "decode_seconds": sum(sources.values()) * costs["decode_seconds_per_mpx"],
+            "compose_seconds": cards * costs["card_seconds"] + costs["page_seconds"],
+            "encode_seconds": layers_written * sheet_mpx * costs["encode_seconds_per_layer_mpx"],
+            "output_bytes": int(
+                cards * costs["output_bytes_per_card"]
+                + bg_cards * costs["output_bytes_per_bg_card"]
+                + logo_cards * costs["output_bytes_per_logo_card"]
+            ),
+        })
+
+    n_pages = len(pages)
+    cpus = os.cpu_count() or 1
+    base = costs["base_rss_bytes"]
+    decode_transient = largest_source * 2  # デコード直後の元画像とRGBA変換後
+    max_tiles = max((p["tile_bytes"] for p in pages), default=0)
+    worker_rss = base + layer_bytes + max_tiles + decode_transient  # index_parallel.pyのワーカー1つ
+    if not parallel:
+        # 同じ画像は1度だけデコード（キャッシュはジョブ全体で共有、上限あり）
+        decode = sum(job_sources.values()) * costs["decode_seconds_per_mpx"]
+        compose = sum(p["compose_seconds"] for p in pages)
+        encode = sum(p["encode_seconds"] for p in pages)
+        encode_wall = encode / max(1, min(encode_workers, cpus - 1)) if cpus > 1 else encode
+        runtime = decode + compose + encode_wall if cpus == 1 else max(decode + compose, encode_wall)
+        tiles = min(len(job_sources) * card_bytes, DEFAULT_MAX_BYTES)
+        # 合成中のページと書き出し待ちの1ページ分のレイヤー
+        peak_rss = base + layer_bytes * min(2, n_pages) + tiles + decode_transient
+        processes = 1
+    else:
+        # ワーカーごとにページ単位でデコード（共有しない場合）
+        active = max(1, min(workers, n_pages, cpus))
+        page_time = [p["decode_seconds"] + p["compose_seconds"] + p["encode_seconds"] for p in pages]
+        decode = sum(p["decode_seconds"] for p in pages)
+        compose = sum(p["compose_seconds"] for p in pages)
+        encode = sum(p["encode_seconds"] for p in pages)
+        runtime = sum(page_time) / active
+        if page_time:
+            runtime = max(runtime, max(page_time))
+        processes = min(max(1, workers), n_pages)
+        peak_rss = base + processes * worker_rss
+
+    return {
+        "pages": pages,
+        "total_pages": n_pages,
+        "total_cards": sum(p["cards"] for p in pages),
+        "unique_images": len(job_sources),
+        "missing_images": headers.missing,
+        "sheet_layer_bytes": layer_bytes,
+        "decoded_bytes": int(sum(job_sources.values()) * 1e6 * 4),
+        "peak_rss_bytes": int(peak_rss),
+        "worker_rss_bytes": int(worker_rss),
+        "output_bytes": sum(p["output_bytes"] for p in pages),
+        "seconds": {
+            "decode": round(decode, 2),
+            "compose": round(compose, 2),
+            "encode": round(encode, 2),
+            "estimated_wall": round(runtime, 2),
+        },
+        "workers": processes,
+        "cpus": cpus,
+        "costs": costs,
+    }
+
+
+def print_estimate(est: Dict):
+    """見積もりの要約を表示する"""
+    print("\n=== 見積もり（--plan、画像はヘッダーのみ読み込み） ===")
+    print(f"ページ数: {est['total_pages']}  カード数: {est['total_cards']}  画像: {est['unique_images']} 種類")
+    for p in est["pages"]:
+        print(
+            f"  ページ {p['page']}: {p['cards']} 枚, 画像 {p['unique_images']} 種類, "
+            f"デコード {p['decoded_bytes'] / MB:.0f}MB, 出力 {p['output_bytes'] / MB:.1f}MB, "
+            f"{p['decode_seconds'] + p['compose_seconds'] + p['encode_seconds']:.1f}秒"
+        )
+    s = est["seconds"]
+    print(f"シート1枚のレイヤー: {est['sheet_layer_bytes'] / MB:.0f}MB")
+    print(f"想定ピークメモリ(RSS): {est['peak_rss_bytes'] / MB:.0f}MB（並列 {est['workers']}）")
+    print(f"出力サイズ: {est['output_bytes'] / MB:.1f}MB")
+    print(
+        f"処理時間: 約{s['estimated_wall']:.0f}秒（CPU時間 デコード {s['decode']:.0f}秒 + "
+        f"合成 {s['compose']:.0f}秒 + PNG書き出し {s['encode']:.0f}秒、{est['cpus']}コア）"
+    )
+    if est["missing_images"]:
+        print(f"Warning: 読めない画像 {len(est['missing_images'])} 件: {', '.join(est['missing_images'][:5])}")
+    print(f"並列処理の目安: 1ワーカーあたり約{est['worker_rss_bytes'] / MB:.0f}MB（--workers N で約 N 倍）")
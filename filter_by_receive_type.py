@@ -5,6 +5,9 @@ receiveTypeでフィルタリングして画像を処理するスクリプト
 receiveType:
   0 = イベント受け取り（現地受け取り）
   1 = 配送
+
+--receive-type all を指定すると、すべてのreceiveTypeを1回の読み込みで振り分け、
+--run-command では1つのプロセスの中で順に画像を生成する（デコード済み画像・フォントを共有）。
 """
 
 import json
@@ -12,41 +15,130 @@ import sys
 import argparse
 from pathlib import Path
 
-def filter_orders_by_receive_type(order_info_file, order_images_file, receive_type=0):
-    """
-    receiveTypeでフィルタリングした画像リストを作成
-    """
-    # オーダー情報を読み込み
-    with open(order_info_file, 'r', encoding='utf-8') as f:
-        order_info = json.load(f)
+RECEIVE_TYPES = {
+    '0': 'イベント受け取り',
+    '1': '配送',
+}
 
-    # 画像情報を読み込み
-    with open(order_images_file, 'r', encoding='utf-8') as f:
-        order_images = json.load(f)
+# 画像生成の設定（index.py --sheet 280x580 --knockout-mode normal --knockout-shrink 0.05 と同じ）
+RENDER_SHEET = '280x580'
+RENDER_KNOCKOUT_MODE = 'normal'
+RENDER_KNOCKOUT_SHRINK = 0.05
 
-    # receiveTypeでフィルタリングしたorderIdを取得
-    filtered_order_ids = set()
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def orders_by_receive_type(order_info, receive_types):
+    """receiveType → そのreceiveTypeの注文（order_infoの並び順）"""
+    orders = {str(rt): [] for rt in receive_types}
     for order in order_info:
-        if str(order.get('receiveType', '')) == str(receive_type):
-            filtered_order_ids.add(str(order['orderId']))
-            print(f"Found order {order['orderId']} ({order['userName']}) with receiveType={receive_type}")
+        matched = orders.get(str(order.get('receiveType', '')))
+        if matched is not None:
+            matched.append(order)
+    return orders
 
-    print(f"\nTotal orders with receiveType={receive_type}: {len(filtered_order_ids)}")
-    print(f"Order IDs: {', '.join(sorted(filtered_order_ids, key=lambda x: int(x) if x.isdigit() else 0))}")
 
-    # 画像をフィルタリング
-    filtered_images = []
+def partition_images(order_images, orders):
+    """画像をreceiveTypeごとに振り分ける（画像リストを1回走査し、orderIdの索引で引く）"""
+    order_ids = {rt: {str(order['orderId']) for order in matched} for rt, matched in orders.items()}
+    partitions = {rt: [] for rt in orders}
     for img in order_images:
-        if str(img.get('orderId', '')) in filtered_order_ids:
-            filtered_images.append(img)
+        order_id = str(img.get('orderId', ''))
+        for rt, ids in order_ids.items():
+            if order_id in ids:
+                partitions[rt].append(img)
+    return partitions
 
-    print(f"\nTotal images after filtering: {len(filtered_images)}")
+
+def load_partitions(order_info_file, order_images_file, receive_types, index_file=None):
+    """(receiveType → 注文, receiveType → 画像) を返す
+
+    index_fileを指定すると order_store の索引から引く（元のJSONが変わったときだけ読み直す）。
+    """
+    if index_file:
+        from order_store import OrderStore
+
+        with OrderStore(index_file) as store:
+            reloaded = store.sync(order_info_file, order_images_file)
+            print(f"Order index: {index_file} ({'reloaded ' + ', '.join(reloaded) if reloaded else 'up to date'})")
+            orders = {str(rt): store.orders(rt) for rt in receive_types}
+            partitions = {str(rt): store.images(rt) for rt in receive_types}
+        return orders, partitions
+
+    orders = orders_by_receive_type(load_json(order_info_file), receive_types)
+    return orders, partition_images(load_json(order_images_file), orders)
+
+
+def print_partition(receive_type, orders, images, verbose=True):
+    """receiveTypeごとの注文数・画像数・カード枚数を表示する"""
+    order_ids = set()
+    for order in orders:
+        order_ids.add(str(order['orderId']))
+        if verbose:
+            print(f"Found order {order['orderId']} ({order['userName']}) with receiveType={receive_type}")
+
+    print(f"\nTotal orders with receiveType={receive_type}: {len(order_ids)}")
+    print(f"Order IDs: {', '.join(sorted(order_ids, key=lambda x: int(x) if x.isdigit() else 0))}")
+    print(f"\nTotal images after filtering: {len(images)}")
 
     # amountを考慮した合計枚数を計算
-    total_cards = sum(img.get('amount', 1) for img in filtered_images)
+    total_cards = sum(img.get('amount', 1) for img in images)
     print(f"Total cards (considering amount): {total_cards}")
 
-    return filtered_images
+
+def filter_orders_by_receive_type(order_info_file, order_images_file, receive_type=0, index_file=None):
+    """
+    receiveTypeでフィルタリングした画像リストを作成
+    """
+    orders, partitions = load_partitions(order_info_file, order_images_file, [receive_type], index_file)
+    images = partitions[str(receive_type)]
+    print_partition(receive_type, orders[str(receive_type)], images)
+    return images
+
+
+def partition_output(output, receive_type):
+    """receiveTypeごとの出力ファイル名（filtered_images.test.json → filtered_images_0.test.json）"""
+    path = Path(output)
+    stem, dot, suffix = path.name.partition('.')
+    return str(path.with_name(f'{stem}_{receive_type}{dot}{suffix}'))
+
+
+def render_partitions(partitions):
+    """receiveTypeごとの画像を同じプロセスで生成する
+
+    index.pyをサブプロセスで起動する代わりに process_pages を直接呼ぶ。
+    デコード済み画像のキャッシュ・PNG書き出しスレッド・ラベル用フォントは全receiveTypeで共有するので、
+    両方のreceiveTypeに出てくる背景やロゴは1度だけ読み込む。
+    """
+    from image_cache import ImageCache
+    from layer_writer import LayerWriter
+    from index import process_pages
+
+    w_mm, h_mm = map(float, RENDER_SHEET.split('x'))
+    cache = ImageCache()
+    # 途中のreceiveTypeで失敗したら、未着手の書き出しを取り消して書き出しスレッドを止める
+    with LayerWriter() as writer:
+        for receive_type, images in partitions.items():
+            if not images:
+                continue
+            output_dir = f'output_receive_{receive_type}'
+            print("\n" + "="*60)
+            print(f"Executing image processing for receiveType={receive_type} ({RECEIVE_TYPES.get(receive_type, '')})...")
+            print("="*60)
+            process_pages(
+                image_info=images,
+                sheet_mm=(w_mm, h_mm),
+                output_dir=output_dir,
+                knockout_shrink_mm=RENDER_KNOCKOUT_SHRINK,
+                knockout_mode=RENDER_KNOCKOUT_MODE,
+                writer=writer,
+                cache=cache,
+            )
+            print(f"\n✅ Image processing completed: {output_dir}/")
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -64,84 +156,73 @@ def main():
     )
     parser.add_argument(
         '--receive-type',
-        type=int,
-        default=0,
-        choices=[0, 1],
-        help='receiveType (0=イベント受け取り, 1=配送)'
+        default='0',
+        choices=[*RECEIVE_TYPES, 'all'],
+        help='receiveType (0=イベント受け取り, 1=配送, all=すべてを1回で振り分け)'
     )
     parser.add_argument(
         '--output',
         default='filtered_images.test.json',
-        help='フィルタリング後の出力ファイル'
+        help='フィルタリング後の出力ファイル（allの場合は filtered_images_0.test.json のようにreceiveTypeを付ける）'
+    )
+    parser.add_argument(
+        '--index',
+        default=None,
+        help='注文の索引ファイル（SQLite）。元のJSONが変わったときだけ読み直す（例: .order_index.sqlite）'
     )
     parser.add_argument(
         '--run-command',
         action='store_true',
-        help='画像処理コマンドを自動実行'
+        help='画像処理を同じプロセスで実行（出力先: output_receive_<receiveType>/）'
     )
 
     args = parser.parse_args()
 
-    # フィルタリング実行
-    filtered_images = filter_orders_by_receive_type(
-        args.order_info,
-        args.order_images,
-        args.receive_type
-    )
-
-    if not filtered_images:
-        print(f"\nNo images found with receiveType={args.receive_type}")
+    # 注文の索引を作り、画像を1回の走査で振り分ける
+    receive_types = list(RECEIVE_TYPES) if args.receive_type == 'all' else [args.receive_type]
+    orders, partitions = load_partitions(args.order_info, args.order_images, receive_types, args.index)
+
+    outputs = {}
+    for receive_type, images in partitions.items():
+        print_partition(receive_type, orders[receive_type], images, verbose=args.receive_type != 'all')
+        if not images:
+            print(f"\nNo images found with receiveType={receive_type}")
+            continue
+        # フィルタリング結果を保存
+        output = args.output if args.receive_type != 'all' else partition_output(args.output, receive_type)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(images, f, ensure_ascii=False, indent=2)
+        outputs[receive_type] = output
+        print(f"\nFiltered images saved to: {output}")
+
+    if not outputs:
         sys.exit(1)
 
-    # フィルタリング結果を保存
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(filtered_images, f, ensure_ascii=False, indent=2)
-
-    print(f"\nFiltered images saved to: {args.output}")
-
-    # 処理コマンドを生成
+    # 画像を生成
     if args.run_command:
-        import subprocess
-
-        # コマンドを構築
-        cmd = [
-            'python3', 'index.py',
-            '--sheet', '280x580',
-            '--images', json.dumps(filtered_images),
-            '--output-dir', f'output_receive_{args.receive_type}',
-            '--knockout-mode', 'normal',
-            '--knockout-shrink', '0.05'
-        ]
-
-        print("\n" + "="*60)
-        print("Executing image processing...")
-        print("="*60)
-
-        # コマンド実行
         try:
-            subprocess.run(cmd, check=True)
-            print("\n✅ Image processing completed successfully!")
-            print(f"Output directory: output_receive_{args.receive_type}/")
-        except subprocess.CalledProcessError as e:
+            render_partitions(partitions)
+        except Exception as e:
             print(f"\n❌ Error during image processing: {e}")
             sys.exit(1)
     else:
         # 手動実行用のコマンドを表示
-        print("\n" + "="*60)
-        print("To process these images, run:")
-        print("="*60)
-        print(f'python3 index.py --sheet 280x580 \\')
-        print(f'  --images "$(cat {args.output})" \\')
-        print(f'  --output-dir output_receive_{args.receive_type} \\')
-        print(f'  --knockout-mode normal \\')
-        print(f'  --knockout-shrink 0.05')
-
-        print("\nOr for parallel processing:")
-        print(f'python3 index_parallel.py --sheet 280x580 \\')
-        print(f'  --images "$(cat {args.output})" \\')
-        print(f'  --output-dir output_receive_{args.receive_type} \\')
-        print(f'  --knockout-mode normal \\')
-        print(f'  --knockout-shrink 0.05')
+        for receive_type, output in outputs.items():
+            print("\n" + "="*60)
+            print("To process these images, run:")
+            print("="*60)
+            print(f'python3 index.py --sheet {RENDER_SHEET} \\')
+            print(f'  --images-file {output} \\')
+            print(f'  --output-dir output_receive_{receive_type} \\')
+            print(f'  --knockout-mode {RENDER_KNOCKOUT_MODE} \\')
+            print(f'  --knockout-shrink {RENDER_KNOCKOUT_SHRINK}')
+
+            print("\nOr for parallel processing:")
+            print(f'python3 index_parallel.py --sheet {RENDER_SHEET} \\')
+            print(f'  --images-file {output} \\')
+            print(f'  --output-dir output_receive_{receive_type} \\')
+            print(f'  --knockout-mode {RENDER_KNOCKOUT_MODE} \\')
+            print(f'  --knockout-shrink {RENDER_KNOCKOUT_SHRINK}')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
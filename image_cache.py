@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# image_cache.py - デコード＆リサイズ済み画像のメモリキャッシュ
+"""
+背景・ロゴなど複数アイテムで共有される画像を、1回の実行につき1度だけ
+デコード＆リサイズするためのLRUキャッシュ。
+
+キーはファイル内容のハッシュ（コンテンツアドレス）＋リサイズ関数＋出力サイズ＋拡大可否。
+パスが異なっても内容が同じ画像は同じエントリを共有する。
+
+DiskTileCache は同じキーでリサイズ済み画像・白板マスクなどのカード単位の成果物を
+ディスクに保存し、実行をまたいで再利用する（容量上限を超えると古いものから削除）。
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import metrics
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # メモリ上限の既定値（512MB）
+DEFAULT_DISK_MAX_BYTES = 4 * 1024 * 1024 * 1024  # ディスクキャッシュ上限の既定値（4GB）
+DISK_EVICT_RATIO = 0.9  # 上限超過時はこの割合まで削減する
+HASH_CHUNK_SIZE = 1024 * 1024
+TILE_CACHE_VERSION = 2  # リサイズ・白板処理の出力が変わる変更をしたら上げる（ディスクキャッシュを無効化）
+
+
+def file_digest(path: str) -> str:
+    """ファイル内容のSHA-1ハッシュを返す"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(kind: str, source: str, params: Dict[str, Any]) -> str:
+    """成果物の種類・元データのキー・処理パラメータからキャッシュキーを作る"""
+    payload = json.dumps([TILE_CACHE_VERSION, kind, source, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def function_id(fn: Callable) -> str:
+    """関数の識別子（スクリプト実行時の__main__でも区別できるようファイル名を使う）"""
+    return f"{os.path.basename(fn.__code__.co_filename)}:{fn.__qualname__}"
+
+
+def cached_artifact(
+    tile_cache: Optional["DiskTileCache"],
+    kind: str,
+    source_key: Optional[str],
+    params: Dict[str, Any],
+    create_fn: Callable[[], Image.Image],
+) -> Image.Image:
+    """ディスクキャッシュがあれば経由してcreate_fn()の成果物を取得する"""
+    if tile_cache is None or not source_key:
+        return create_fn()
+    return tile_cache.get_or_create(make_key(kind, source_key, params), create_fn)
+
+
+def cached_artifacts(
+    tile_cache: Optional["DiskTileCache"],
+    kind: str,
+    source_keys: List[Optional[str]],
+    params: Dict[str, Any],
+    create_batch_fn: Callable[[List[int]], List[Image.Image]],
+) -> List[Image.Image]:
+    """cached_artifactの複数版。キャッシュにないものだけをまとめてcreate_batch_fn(インデックス)で生成する"""
+    results: List[Optional[Image.Image]] = [None] * len(source_keys)
+    keys: List[Optional[str]] = [None] * len(source_keys)
+    if tile_cache is not None:
+        for i, source_key in enumerate(source_keys):
+            if source_key:
+                keys[i] = make_key(kind, source_key, params)
+                results[i] = tile_cache.load(keys[i])
+    missing = [i for i, im in enumerate(results) if im is None]
+    if missing:
+        for i, im in zip(missing, create_batch_fn(missing)):
+            results[i] = im
+            if keys[i] is not None:
+                tile_cache.store(keys[i], im)
+    return results
+
+
+def image_nbytes(im: Image.Image) -> int:
+    """デコード済み画像のおおよそのメモリ使用量（バイト）"""
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+
+class ImageCache:
+    """デコード＆リサイズ済み画像のLRUキャッシュ（スレッドセーフ）
+
+    返される画像は複数カードで共有されるため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, disk: Optional["DiskTileCache"] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._shared: Dict[str, Image.Image] = {}  # 他プロセスと共有するタイル（上限・LRUの対象外）
+        self._digests: Dict[str, Tuple[int, int, str]] = {}  # path -> (mtime_ns, size, digest)
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def digest(self, path: str) -> str:
+        """パスの内容ハッシュ（mtime・サイズが変わらない限り再計算しない）"""
+        st = os.stat(path)
+        with self._lock:
+            known = self._digests.get(path)
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def add_shared(self, tiles: Dict[str, Image.Image]):
+        """共有メモリ上のタイルを登録する（キーはtile_key()と同じ。破棄されない）"""
+        with self._lock:
+            self._shared.update(tiles)
+
+    def tile_key(
+        self,
+        path: str,
+        resize_fn: Callable[..., Image.Image],
+        target_wh: Tuple[int, int],
+        allow_upscale: bool,
+    ) -> str:
+        """リサイズ済み画像のキー（白板マスクなど派生成果物のキーの元にもなる）"""
+        return make_key("resize", self.digest(path), {
+            "fn": function_id(resize_fn),
+            "target": list(target_wh),
+            "upscale": bool(allow_upscale),
+        })
+
+    def get(
+        self,
+        path: str,
+        resize_fn: Callable[..., Image.Image],
+        target_wh: Tuple[int, int],
+        allow_upscale: bool,
+    ) -> Image.Image:
+        """pathの画像をRGBAでデコードし、resize_fnでtarget_whにリサイズした結果を返す"""
+        key = self.tile_key(path, resize_fn, target_wh, allow_upscale)
+        while True:
+            with self._lock:
+                im = self._shared.get(key)
+                if im is not None:
+                    self.hits += 1
+                    return im
+                im = self._entries.get(key)
+                if im is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return im
+                pending = self._inflight.get(key)
+                if pending is None:
+                    # このスレッドがデコードを担当する
+                    self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 他スレッドが同じ画像をデコード中なので完了を待つ
+            pending.wait()
+
+        try:
+            im = None
+            if self.disk is not None:
+                with metrics.stage("tile_cache_load", file=path):
+                    im = self.disk.load(key)
+            if im is None:
+                with Image.open(path) as src:
+                    with metrics.stage("decode", file=path):
+                        rgba = src.convert("RGBA")
+                # resize_char_canvas → resize_char、resize_bg_canvas → resize_bg
+                with metrics.stage(resize_fn.__name__.replace("_canvas", ""), file=path):
+                    im = resize_fn(rgba, target_wh, allow_upscale=allow_upscale)
+                del rgba
+                if self.disk is not None:
+                    self.disk.store(key, im)
+            self._put(key, im)
+            return im
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def _put(self, key: str, im: Image.Image):
+        nbytes = image_nbytes(im)
+        with self._lock:
+            self._entries[key] = im
+            self.current_bytes += nbytes
+            # 上限を超えたら古いものから破棄（最新の1件は常に保持）
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self.current_bytes -= image_nbytes(old)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "shared": len(self._shared),
+                "bytes": self.current_bytes,
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (
+            f"Image cache: hits={s['hits']} misses={s['misses']} "
+            f"evictions={s['evictions']} entries={s['entries']} "
+            f"({s['bytes'] / (1024 * 1024):.1f}MB)"
+            + (f" shared={s['shared']}" if s["shared"] else "")
+        )
+
+
+class DiskTileCache:
+    """カード単位の成果物（リサイズ済み画像・白板マスク）のディスクキャッシュ
+
+    1エントリ1ファイル（PNG）で root/<キー先頭2文字>/<キー>.png に保存する。
+    読み込み時にmtimeを更新し、容量上限を超えたらmtimeの古いものから削除する。
+    書き込みは一時ファイル経由のos.replaceで行うため、複数プロセスから同時に使ってよい。
+    """
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._total_bytes = self._scan_total()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def load(self, key: str) -> Optional[Image.Image]:
+        path = self.path_for(key)
+        try:
+            with Image.open(path) as f:
+                f.load()
+                im = f.copy()
+            os.utime(path)  # LRU用にアクセス時刻を更新
+        except (OSError, SyntaxError):
+            # 未作成・他プロセスで削除済み・破損ファイルはミス扱い
+            self.misses += 1
+            return None
+        self.hits += 1
+        return im
+
+    def store(self, key: str, im: Image.Image):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        # 圧縮より速度優先（キャッシュは再エンコードされない中間ファイル）
+        im.save(tmp_path, format="PNG", compress_level=1)
+        new_size = os.path.getsize(tmp_path)
+        try:
+            old_size = os.path.getsize(path)  # 同じキーを上書きする場合は古いファイル分を差し引く
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        self._total_bytes += new_size - old_size
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def get_or_create(self, key: str, create_fn: Callable[[], Image.Image]) -> Image.Image:
+        """キャッシュにあればそれを返し、なければcreate_fn()の結果を保存して返す"""
+        im = self.load(key)
+        if im is None:
+            im = create_fn()
+            self.store(key, im)
+        return im
+
+    def _entries(self):
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".png"):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, st.st_mtime, st.st_size
+
+    def _scan_total(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        limit = self.max_bytes * DISK_EVICT_RATIO
+        for path, _, size in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def summary(self) -> str:
+        return (
+            f"Tile cache ({self.root}): hits={self.hits} misses={self.misses} "
+            f"evictions={self.evictions} ({self._total_bytes / (1024 * 1024):.1f}MB)"
+        )
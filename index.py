@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
 # acrylic_sheet_generator.py
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional, Iterator
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import math
 
+import numpy as np
 from PIL import Image, ImageDraw, ImageOps, ImageFilter
 from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+from image_cache import ImageCache, DiskTileCache, cached_artifact, cached_artifacts
+from layer_writer import (
+    LayerWriter, PNG_STRATEGIES, CONTAINERS, DEFAULT_ENCODE_WORKERS, MASK_FORMATS, INK,
+    new_layer, ink_source, alpha_over, save_layers,
+)
+from cutline import VECTOR_FORMATS, cutline_rects
+from label_cache import label_cache
+from layout import (
+    ShelfPacker, PAGINATION_MODES, PAGE_PLAN_FILE,
+    sheet_layout, paginate_items, page_capacity, plan_pages, split_orders, write_page_plan, group_by_order,
+)
+from dry_run import estimate_job, load_costs, print_estimate
+from job_input import JobInputError, load_items
+import metrics
+import knockout
+
 DPI = 350
 MM_PER_INCH = 25.4
 
@@ -30,6 +49,11 @@ CUTLINE_PX = mm_to_px(CUTLINE_MM)
 MARGIN_PX = mm_to_px(MARGIN_MM)
 SPACING_PX = mm_to_px(SPACING_MM)
 KNOCKOUT_SHRINK_PX = max(1, mm_to_px(KNOCKOUT_SHRINK_MM))
+LABEL_MARGIN_MM = 50                 # ラベル表示用の左側追加マージン（ミリメートル）- キー識別子の表示スペース確保
+LABEL_MARGIN_PX = mm_to_px(LABEL_MARGIN_MM)
+LABEL_FRAME = (CARD_PX[1], 600)      # ラベルの描画枠（回転前、幅=カード高さ）
+LABEL_ORIGIN = (20, 300)             # 描画枠内のテキスト位置
+LABEL_ANCHOR = "lm"                  # テキストの基準点（左端・垂直中央）
 
 # Quality & scaling policy
 ALLOW_UPSCALE_CHAR = False   # 文字やキャラクターは基本的に拡大しない（甘くなるため）
@@ -114,30 +138,114 @@ def grid_layout(
     return positions, rows, cols
 
 
-def load_images(image_info: List[Dict]) -> List[Dict]:
-    """各カード用に {key, char_img, bg_img, logo_img, userName, amount} を読み込む"""
+def sheet_packer(sheet_px: Tuple[int, int]) -> ShelfPacker:
+    """シート1枚分のパッカー（左側の余白はラベル用マージンを足したもの）"""
+    return ShelfPacker(
+        sheet_px, CARD_PX, MARGIN_PX, SPACING_PX, CUTLINE_PX,
+        left_margin_px=MARGIN_PX + LABEL_MARGIN_PX,
+    )
+
+
+def cards_overlap(positions: List[Tuple[int, int]], card_px: Tuple[int, int] = CARD_PX) -> bool:
+    """カード矩形同士が重なっているかを判定（タイル単位合成の可否チェック用）"""
+    cw, ch = card_px
+    rects = sorted((x, y, x + cw, y + ch) for x, y in positions)
+    for i, (x1, y1, x2, y2) in enumerate(rects):
+        for ox1, oy1, ox2, oy2 in rects[i + 1:]:
+            if ox1 >= x2:
+                break  # x順にソート済みなので以降は重ならない
+            if oy1 < y2 and y1 < oy2:
+                return True
+    return False
+
+
+def composite_card(layer: Image.Image, tile: Image.Image, xy: Tuple[int, int], tile_local: bool = True) -> Image.Image:
+    """カード画像をレイヤーにalpha_compositeする。
+
+    tile_local=True の場合はカードの矩形内だけを合成する（シート全体の確保・合成を行わない）。
+    False の場合は従来通りシートサイズの一時レイヤーを作って全体を合成する。
+    どちらも結果はバイト単位で同一。
+    """
+    if tile_local:
+        layer.alpha_composite(tile, xy)
+        return layer
+    full = Image.new("RGBA", layer.size, (0, 0, 0, 0))
+    full.paste(tile, xy)
+    return Image.alpha_composite(layer, full)
+
+
+def make_knockout_mask(alpha: Image.Image, threshold: int, shrink_px: int, knockout_style: str = "binary") -> Image.Image:
+    """アルファチャンネルから白板マスク（L）を生成する（閾値処理＋収縮）"""
+    # knockout_styleに応じた閾値処理（スタイルごとのLUTで一括変換）
+    alpha_processed = knockout.apply_knockout(alpha, knockout_style, threshold)
+
+    # ステップ2: 収縮処理（より穏やかに）
+    if shrink_px > 0:
+        # まず少しぼかしてから収縮（エッジを滑らかに）
+        alpha_smooth = alpha_processed.filter(ImageFilter.GaussianBlur(radius=knockout.SMOOTH_RADIUS))
+        knock = knockout.erode(alpha_smooth, shrink_px)  # shrink_px画素分の収縮（1pxならMinFilter(3)と同じ）
+    else:
+        knock = alpha_processed
+    return knock
+
+
+def make_knockout_masks(alphas: List[Image.Image], threshold: int, shrink_px: int, knockout_style: str = "binary") -> List[Image.Image]:
+    """複数カードのαを (N, H, W) に積み重ねて白板マスクを一括生成する（make_knockout_maskと同一結果）"""
+    if not alphas:
+        return []
+    planes = np.stack([np.asarray(a) for a in alphas])
+    masks = knockout.knockout_planes(planes, knockout_style, threshold, shrink_px)
+    return [Image.fromarray(m) for m in masks]
+
+
+def resized_card_images(card: Dict) -> Tuple[Image.Image, Image.Image, Optional[Image.Image]]:
+    """カードの (char, bg, logo) をCARD_PXにリサイズして返す（load_imagesでリサイズ済みならそのまま）"""
+    logo_img = card.get("logo")
+    if card.get("resized"):
+        return card["char"], card["bg"], logo_img
+    # Downscale with high-quality LANCZOS; avoid unnecessary upscaling
+    char_img = resize_char_canvas(card["char"], CARD_PX, allow_upscale=ALLOW_UPSCALE_CHAR)
+    bg_img   = resize_bg_canvas(card["bg"], CARD_PX, allow_upscale=ALLOW_UPSCALE_BG)
+    if logo_img:
+        # ロゴをカードサイズにリサイズ（レターボックス形式）
+        logo_img = resize_char_canvas(logo_img, CARD_PX, allow_upscale=True)
+    return char_img, bg_img, logo_img
+
+
+def load_images(image_info: List[Dict], cache: Optional[ImageCache] = None) -> List[Dict]:
+    """各カード用に {key, char_img, bg_img, logo_img, userName, amount} を読み込む
+
+    画像はCARD_PXにリサイズ済みの状態でキャッシュから取得する（同じ背景・ロゴは1回だけデコード）。
+    """
+    if cache is None:
+        cache = ImageCache()
+    empty_bg = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
     cards = []
     for idx, info in enumerate(image_info):
         try:
             print(f"Loading item {idx + 1}/{len(image_info)}: {info['key']} (char: {info['char']})")
-            char = Image.open(info["char"]).convert("RGBA")
+            char = cache.get(info["char"], resize_char_canvas, CARD_PX, ALLOW_UPSCALE_CHAR)
+            char_key = cache.tile_key(info["char"], resize_char_canvas, CARD_PX, ALLOW_UPSCALE_CHAR)
             
             # 背景画像の読み込み（nullの場合はデフォルト背景を作成）
             bg = None
             if info.get("bg"):
                 print(f"  Loading background: {info['bg']}")
-                bg = Image.open(info["bg"]).convert("RGBA")
+                bg = cache.get(info["bg"], resize_bg_canvas, CARD_PX, ALLOW_UPSCALE_BG)
             else:
                 # 背景がない場合は透明な背景を作成
                 print(f"  No background, creating transparent background")
-                bg = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
+                bg = empty_bg
             
             # ロゴ画像の読み込み（オプショナル）
             logo = None
+            logo_key = None
             if "logo" in info and info["logo"]:
                 try:
                     print(f"  Loading logo: {info['logo']}")
-                    logo = Image.open(info["logo"]).convert("RGBA")
+                    # ロゴはカードサイズにリサイズ（レターボックス形式）
+                    logo = cache.get(info["logo"], resize_char_canvas, CARD_PX, True)
+                    logo_key = cache.tile_key(info["logo"], resize_char_canvas, CARD_PX, True)
                 except Exception as e:
                     print(f"Warning: Failed to load logo {info['logo']}: {e}")
             
@@ -152,6 +260,9 @@ def load_images(image_info: List[Dict]) -> List[Dict]:
                     "bg": bg,
                     "bg_path": info.get("bg"),  # 元のbgパス情報を保持（nullチェック用）
                     "logo": logo,
+                    "resized": True,  # char/bg/logoはCARD_PXにリサイズ済み
+                    "char_key": char_key,  # ディスクキャッシュ用のキー
+                    "logo_key": logo_key,
                     "userName": info.get("userName", info["key"]),  # userNameがない場合はkeyを使用
                     "orderId": info.get("orderId", "")
                 })
@@ -165,6 +276,7 @@ def load_images(image_info: List[Dict]) -> List[Dict]:
             raise
             
     print(f"\nSuccessfully loaded {len(cards)} cards from {len(image_info)} items")
+    print(cache.summary())
     return cards
 
 
@@ -175,7 +287,27 @@ def make_sheet_layers(
     knockout_shrink_mm: float = None,
     knockout_mode: str = "normal",
     knockout_style: str = "binary",
+    tile_cache: Optional[DiskTileCache] = None,
+    batch_knockout: bool = False,
+    writer: Optional[LayerWriter] = None,
+    mask_format: str = "rgba",
+    crop_layers: bool = False,
+    container: str = "png",
+    cutline_vector: Tuple[str, ...] = (),
+    raster_cutline: bool = True,
 ):
+    """1シート分のレイヤーPNGを作る
+
+    writerを渡した場合、PNGの書き出しはwriterのスレッドに積んだまま戻る（完了はwriter側で待つ）。
+    渡さない場合はこの関数内で並列に書き出し、完了してから戻る。
+    mask_formatがrgba以外の場合、マスク系レイヤーはLモードで合成し、指定形式で書き出して
+    <prefix>_layers.json にレイヤー構成を記録する。
+    crop_layersの場合は空のレイヤーを書き出さず、それ以外はインクのある範囲に切り抜く
+    （シート上の位置はマニフェストに記録）。
+    containerがtiffの場合は全レイヤーを <prefix>.tif の1ファイルにまとめる。
+    カットラインはカード配置から矩形として求め、cutline_vectorの形式（svg/pdf）で
+    <prefix>_cutline.<形式> にも書き出す。raster_cutlineがFalseならラスタのcutlineレイヤーは作らない。
+    """
     # 引数でパラメータを調整
     shrink_mm = knockout_shrink_mm if knockout_shrink_mm is not None else KNOCKOUT_SHRINK_MM
     shrink_px = max(0, mm_to_px(shrink_mm))
@@ -191,13 +323,22 @@ def make_sheet_layers(
         threshold = KNOCKOUT_THRESHOLD
         min_alpha = KNOCKOUT_MIN_ALPHA
 
+    # ディスクキャッシュのキーに含める白板処理パラメータ
+    knock_params = {
+        "knockout_mode": knockout_mode,
+        "threshold": threshold,
+        "shrink_px": shrink_px,
+        "card_px": list(CARD_PX),
+        "dpi": DPI,
+    }
+
     # --- シート寸法 ---
     # 実際のシート寸法をピクセルに変換（余白なし）
     sheet_px_original = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
 
     # 左側のラベル用に余分なマージンを追加（シートサイズは変わらない）
-    label_margin_mm = 50  # ラベル表示用の左側追加マージン（ミリメートル）- キー識別子の表示スペース確保
-    label_margin_px = mm_to_px(label_margin_mm)
+    label_margin_mm = LABEL_MARGIN_MM
+    label_margin_px = LABEL_MARGIN_PX
 
     # デバッグ情報
     print(f"シート寸法(mm): {sheet_mm[0]} x {sheet_mm[1]}")
@@ -209,263 +350,269 @@ def make_sheet_layers(
 
     # MARGINを調整 - 左側だけ増やす
     left_margin_px = MARGIN_PX + label_margin_px
-    # --- レイヤ初期化 ---
+    # --- レイヤ初期化（マスク系レイヤーはmask_formatに応じてRGBAまたはL）---
     layers = {
-        "cutline": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "glare":   Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "logos":   Image.new("RGBA", sheet_size, (0, 0, 0, 0)),  # ロゴレイヤー（キャラクターの上）
-        "logo_knock": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),  # ロゴ用白板レイヤー
-        "character": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "char_knock": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "bg_knock": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "background": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),
-        "labels": Image.new("RGBA", sheet_size, (0, 0, 0, 0)),  # ユーザー名ラベル用
+        "cutline": new_layer("cutline", sheet_size, mask_format) if raster_cutline else None,
+        "glare":   new_layer("glare", sheet_size, mask_format),
+        "logos":   new_layer("logos", sheet_size, mask_format),  # ロゴレイヤー（キャラクターの上）
+        "logo_knock": new_layer("logo_knock", sheet_size, mask_format),  # ロゴ用白板レイヤー
+        "character": new_layer("character", sheet_size, mask_format),
+        "char_knock": new_layer("char_knock", sheet_size, mask_format),
+        "bg_knock": new_layer("bg_knock", sheet_size, mask_format),
+        "background": new_layer("background", sheet_size, mask_format),
+        "labels": new_layer("labels", sheet_size, mask_format),  # ユーザー名ラベル用
     }
-    draw_cut = ImageDraw.Draw(layers["cutline"])
+    if raster_cutline:
+        draw_cut = ImageDraw.Draw(layers["cutline"])
+    else:
+        del layers["cutline"]  # カットラインはベクターのみで出力
 
-    # フォント設定 (日本語フォントを優先的に使用)
-    try:
-        from PIL import ImageFont
-        # MacOS でよく使われる日本語フォントを試す
-        font_size = 100  # フォントサイズを調整
-        font = None
-        
-        # 利用可能な日本語フォントのリスト
-        japanese_fonts = [
-            "/System/Library/Fonts/Hiragino Sans GB.ttc",  # これは存在することを確認済み
-            "/System/Library/Fonts/PingFang.ttc",  # 中国語フォントだが日本語も表示可能
-            "/System/Library/Fonts/STHeiti Light.ttc",
-            "/System/Library/Fonts/STHeiti Medium.ttc"
-        ]
-        
-        # フォントを順に試す
-        for font_path in japanese_fonts:
-            try:
-                font = ImageFont.truetype(font_path, font_size, index=0)
-                print(f"Using font: {font_path}")
-                break
-            except Exception as e:
-                continue
-        
-        # 日本語フォントが見つからない場合
-        if font is None:
-            try:
-                # 最後の手段としてArialを使用
-                font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", font_size)
-                print("Warning: Using Helvetica font - Japanese characters may not display correctly")
-            except IOError:
-                font = ImageFont.load_default()
-                print("Warning: Using default font - Japanese characters will not display correctly")
-                
-    except (IOError, ImportError):
-        font = ImageFont.load_default()
-        print("Warning: Font loading failed - Japanese characters will not display correctly")
+    # ラベル（フォントはプロセスで1度だけ読み込み、同じユーザー名の描画は使い回す）
+    labels = label_cache(LABEL_FRAME, LABEL_ORIGIN, LABEL_ANCHOR)
 
-    # --- 配置計算 ---
-    positions, rows, cols = grid_layout(
+    # --- 配置計算（ページ分割と同じパッカーで左上から詰める）---
+    _, rows, cols = grid_layout(
         sheet_px=sheet_size,
         left_margin_px=left_margin_px  # 左側の余白を増やす
     )
-    print(f"シートレイアウト: {cols}列 x {rows}行 = 最大{len(positions)}枚")
+    print(f"シートレイアウト: {cols}列 x {rows}行 = 最大{rows * cols}枚")
+    positions = sheet_layout(sheet_packer(sheet_size), [CARD_PX] * len(card_data))
     if len(card_data) > len(positions):
         raise ValueError("シートに入りきりません：画像数を減らすかシートを拡大してください。")
 
-    # --- カードごとに処理 ---
-    for card, (x, y) in zip(card_data, positions):
-        char_img_raw = card["char"]
-        bg_img_raw   = card["bg"]
-        logo_img_raw = card.get("logo")
-        user_name    = card.get("userName", card["key"])
-
-        # Downscale with high-quality LANCZOS; avoid unnecessary upscaling
-        char_img = resize_char_canvas(char_img_raw, CARD_PX, allow_upscale=ALLOW_UPSCALE_CHAR)
-        bg_img   = resize_bg_canvas(bg_img_raw, CARD_PX, allow_upscale=ALLOW_UPSCALE_BG)
-
-        # background
-        layers["background"].paste(bg_img, (x, y), bg_img)
-
-        # bg_knockout: 背景ノックアウト - 背景がある場合のみカード領域全体を完全黒（不透明）で塗りつぶし
-        # 背景がnullの場合（透明背景の場合）はbg_knockレイヤーも作成しない
-        if card.get("bg_path"):
-            bg_mask = Image.new("L", CARD_PX, 255)
-            black_bg = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-            layers["bg_knock"].paste(black_bg, (x, y), bg_mask)
-
-        # character: alpha_compositeを使用して半透明の発光エフェクトを正しく合成
-        # paste()では半透明ピクセルが薄くなるため、alpha_compositeで正確な合成を行う
-        char_layer = Image.new("RGBA", sheet_size, (0, 0, 0, 0))
-        char_layer.paste(char_img, (x, y))
-        layers["character"] = Image.alpha_composite(layers["character"], char_layer)
-        
-        # logo: ロゴ画像（キャラクターの上に配置）- 同様にalpha_compositeを使用
-        if logo_img_raw:
-            # ロゴをカードサイズにリサイズ（レターボックス形式）
-            logo_img = resize_char_canvas(logo_img_raw, CARD_PX, allow_upscale=True)
-            logo_layer = Image.new("RGBA", sheet_size, (0, 0, 0, 0))
-            logo_layer.paste(logo_img, (x, y))
-            layers["logos"] = Image.alpha_composite(layers["logos"], logo_layer)
-
-            # logo knockout: ロゴノックアウト - ロゴにも白板を生成
-            logo_alpha = logo_img.split()[-1]  # ロゴのアルファチャンネルを抽出
-
-            # ロゴ用の白板処理（完全2値化）
-            logo_alpha_processed = logo_alpha.point(lambda p:
-                0 if p < threshold else  # 閾値以下 → 完全透明
-                255  # 閾値以上 → 完全不透明（白板）
+    # タイル単位合成: カード矩形が重ならない場合はカード領域内だけを合成する
+    tile_local = not cards_overlap(positions[:len(card_data)])
+    if not tile_local:
+        print("Warning: カード領域が重なっているため、シート全体の合成処理にフォールバックします")
+
+    card_images = [resized_card_images(card) for card in card_data]
+
+    # ページ単位の一括白板処理: 全カードのαを積み重ねて閾値処理・ぼかし・収縮を1回で行う
+    char_knocks = None
+    logo_knocks = {}
+    if batch_knockout:
+        with metrics.stage("knockout", batch=True):
+            char_alphas = [imgs[0].split()[-1] for imgs in card_images]
+            char_knocks = cached_artifacts(
+                tile_cache, "char_knock", [card.get("char_key") for card in card_data],
+                dict(knock_params, knockout_style=knockout_style),
+                lambda idx: make_knockout_masks([char_alphas[i] for i in idx], threshold, shrink_px, knockout_style),
             )
+            logo_idx = [i for i, imgs in enumerate(card_images) if imgs[2]]
+            logo_alphas = [card_images[i][2].split()[-1] for i in logo_idx]
+            masks = cached_artifacts(
+                tile_cache, "logo_knock", [card_data[i].get("logo_key") for i in logo_idx],
+                dict(knock_params, knockout_style="binary"),
+                lambda idx: make_knockout_masks([logo_alphas[i] for i in idx], threshold, shrink_px, "binary"),
+            )
+            logo_knocks = dict(zip(logo_idx, masks))
 
-            # 収縮処理（ロゴも同様に）
-            if shrink_px > 0:
-                logo_alpha_smooth = logo_alpha_processed.filter(ImageFilter.GaussianBlur(radius=0.3))
-                logo_knock = logo_alpha_smooth.filter(ImageFilter.MinFilter(3))
-            else:
-                logo_knock = logo_alpha_processed
-
-            black_logo = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-            layers["logo_knock"].paste(black_logo, (x, y), logo_knock)
-
-        # character knockout: キャラクターノックアウト - アルファチャンネルを収縮させて黒シルエット生成
-        alpha = char_img.split()[-1]  # アルファチャンネル（透明度情報）を抽出
+    # --- カットライン矩形（カード位置から計算。ラスタ・ベクターの両方で使う）---
+    cut_rects = cutline_rects([xy for _, xy in zip(card_data, positions)], CARD_PX, CUTLINE_PX)
 
-        # knockout_styleに応じた処理
-        if knockout_style == "gradient":
-            # グレースケール白板：透明度をそのまま反映
-            alpha_processed = alpha.point(lambda p:
-                0 if p < threshold else  # 閾値以下 → 完全透明
-                min(255, int(p * 1.2))  # 閾値以上 → 透明度を少し強調してグレースケール
-            )
-        elif knockout_style == "hybrid":
-            # ハイブリッド：中心は黒、エッジはグラデーション
-            import numpy as np
-            alpha_np = np.array(alpha)
-
-            # コア部分（高透明度）は完全黒
-            core_mask = alpha_np > 200
-            # エッジ部分は元の透明度を維持
-            edge_mask = (alpha_np > threshold) & (alpha_np <= 200)
-
-            result = np.zeros_like(alpha_np)
-            result[core_mask] = 255
-            result[edge_mask] = alpha_np[edge_mask]
-
-            alpha_processed = Image.fromarray(result, mode='L')
-        elif knockout_style == "adaptive":
-            # アダプティブ：画像の特性に応じて自動調整
-            import numpy as np
-            alpha_np = np.array(alpha)
-
-            # ヒストグラムを分析
-            hist, bins = np.histogram(alpha_np[alpha_np > 0], bins=50)
-
-            # 透明度の分布に基づいて処理を決定
-            mean_alpha = np.mean(alpha_np[alpha_np > threshold])
-
-            if mean_alpha > 200:
-                # 不透明が多い → バイナリ処理
-                alpha_processed = alpha.point(lambda p: 0 if p < threshold else 255)
-            elif mean_alpha > 150:
-                # 中間 → ハイブリッド
-                result = np.where(alpha_np > 200, 255,
-                                np.where(alpha_np > threshold, alpha_np, 0))
-                alpha_processed = Image.fromarray(result.astype(np.uint8), mode='L')
+    # --- カードごとに処理 ---
+    for i, (card, (x, y)) in enumerate(zip(card_data, positions)):
+        char_img, bg_img, logo_img = card_images[i]
+        user_name    = card.get("userName", card["key"])
+        card_labels = {"card": i + 1, "key": card["key"]}  # --metrics の記録に付けるラベル
+
+        # 白板マスク: キャラクター・ロゴのアルファチャンネルを収縮させたシルエット
+        with metrics.stage("knockout", **card_labels):
+            logo_knock = None
+            if logo_img:
+                logo_alpha = logo_img.split()[-1]  # ロゴのアルファチャンネルを抽出
+
+                # ロゴ用の白板処理（完全2値化＋収縮）
+                if i in logo_knocks:
+                    logo_knock = logo_knocks[i]
+                else:
+                    logo_knock = cached_artifact(
+                        tile_cache, "logo_knock", card.get("logo_key"),
+                        dict(knock_params, knockout_style="binary"),
+                        lambda: make_knockout_mask(logo_alpha, threshold, shrink_px, "binary"),
+                    )
+
+            alpha = char_img.split()[-1]  # アルファチャンネル（透明度情報）を抽出
+
+            if char_knocks is not None:
+                knock = char_knocks[i]
             else:
-                # 半透明が多い → グラデーション
-                alpha_processed = alpha.point(lambda p:
-                    0 if p < threshold else min(255, int(p * 1.5))
+                knock = cached_artifact(
+                    tile_cache, "char_knock", card.get("char_key"),
+                    dict(knock_params, knockout_style=knockout_style),
+                    lambda: make_knockout_mask(alpha, threshold, shrink_px, knockout_style),
                 )
-        else:  # binary (default)
-            # 従来の2値化処理
-            alpha_processed = alpha.point(lambda p:
-                0 if p < threshold else  # 閾値以下 → 完全透明
-                255  # 閾値以上 → 完全不透明（白板）
-            )
 
-        # ステップ2: 収縮処理（より穏やかに）
-        if shrink_px > 0:
-            # まず少しぼかしてからMinFilter（エッジを滑らかに）
-            alpha_smooth = alpha_processed.filter(ImageFilter.GaussianBlur(radius=0.3))
-            knock = alpha_smooth.filter(ImageFilter.MinFilter(3))  # 固定サイズ3で最小限の収縮
-        else:
-            knock = alpha_processed
-
-        # グレースケール白板の場合は、黒の透明度を調整
-        if knockout_style in ["gradient", "hybrid", "adaptive"]:
-            # グレースケールマスクとして使用
-            layers["char_knock"].paste(Image.new("L", CARD_PX, 0), (x, y))
-            knock_layer = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
-            knock_layer.paste(Image.new("RGB", CARD_PX, (0, 0, 0)), (0, 0), knock)
-            layers["char_knock"].alpha_composite(knock_layer, (x, y))
-        else:
-            # 従来のバイナリ白板
-            black = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-            layers["char_knock"].paste(black, (x, y), knock)
+        with metrics.stage("composite", **card_labels):
+            # background
+            layers["background"].paste(bg_img, (x, y), bg_img)
+
+            # bg_knockout: 背景ノックアウト - 背景がある場合のみカード領域全体を完全黒（不透明）で塗りつぶし
+            # 背景がnullの場合（透明背景の場合）はbg_knockレイヤーも作成しない
+            if card.get("bg_path"):
+                bg_mask = Image.new("L", CARD_PX, 255)
+                black_bg = Image.new(layers["bg_knock"].mode, CARD_PX, INK[layers["bg_knock"].mode])
+                layers["bg_knock"].paste(black_bg, (x, y), bg_mask)
+
+            # character: alpha_compositeを使用して半透明の発光エフェクトを正しく合成
+            # paste()では半透明ピクセルが薄くなるため、alpha_compositeで正確な合成を行う
+            layers["character"] = composite_card(layers["character"], char_img, (x, y), tile_local)
+
+            # logo: ロゴ画像（キャラクターの上に配置）- 同様にalpha_compositeを使用
+            if logo_img:
+                layers["logos"] = composite_card(layers["logos"], logo_img, (x, y), tile_local)
+
+                # logo knockout: ロゴノックアウト - ロゴにも白板を生成
+                black_logo = Image.new(layers["logo_knock"].mode, CARD_PX, INK[layers["logo_knock"].mode])
+                layers["logo_knock"].paste(black_logo, (x, y), logo_knock)
+
+            # character knockout: キャラクターノックアウト - 白板マスクの範囲を黒シルエットにする
+            # グレースケール白板の場合は、黒の透明度を調整
+            if knockout.is_grayscale(knockout_style):
+                # グレースケールマスクとして使用
+                if layers["char_knock"].mode == "RGBA":
+                    layers["char_knock"].paste(Image.new("L", CARD_PX, 0), (x, y))
+                    knock_layer = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
+                    knock_layer.paste(Image.new("RGB", CARD_PX, (0, 0, 0)), (0, 0), knock)
+                    layers["char_knock"].alpha_composite(knock_layer, (x, y))
+                else:
+                    # Lレイヤーでは上と同じα計算（L画像の貼り付けは不透明な黒になる）
+                    layers["char_knock"].paste(255, (x, y, x + CARD_PX[0], y + CARD_PX[1]))
+                    alpha_over(layers["char_knock"], knock, (x, y))
+            else:
+                # 従来のバイナリ白板
+                black = Image.new(layers["char_knock"].mode, CARD_PX, INK[layers["char_knock"].mode])
+                layers["char_knock"].paste(black, (x, y), knock)
+
+            # cutline: カットライン（矩形枠）- 印刷時の切断位置を示す黒線（カード位置から線幅分外側）
+            bx1, by1, bx2, by2 = cut_rects[i]
+            if raster_cutline:
+                draw_cut.rectangle(
+                    [(bx1, by1), (bx2, by2)], outline=INK[layers["cutline"].mode], width=CUTLINE_PX
+                )
 
         # glare layer: グレア効果レイヤー - キャラクターのアルファチャンネルをマスクとして黒色で塗りつぶし
-        black = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-        layers["glare"].paste(black, (x, y), alpha)
-
-        # cutline: カットライン（矩形枠）- 印刷時の切断位置を示す黒線
-        bx1 = x - CUTLINE_PX  # 左端座標（カード位置から線幅分外側）
-        by1 = y - CUTLINE_PX  # 上端座標（カード位置から線幅分外側）
-        bx2 = x + CARD_PX[0] + CUTLINE_PX - 1  # 右端座標
-        by2 = y + CARD_PX[1] + CUTLINE_PX - 1  # 下端座標
-        draw_cut.rectangle(
-            [(bx1, by1), (bx2, by2)], outline=(0, 0, 0, 255), width=CUTLINE_PX
-        )
-        
-        # userName テキスト描画: ユーザー名を左側に-90度回転して配置
-        key_text = user_name  # ユーザー名を表示
-        # テキスト描画用の一時画像を作成（回転前の縦長サイズ）
-        text_img = Image.new("RGBA", (CARD_PX[1], 600), (0, 0, 0, 0))  # 幅=カード高さ、高さ=600px
-        text_draw = ImageDraw.Draw(text_img)
-        
-        # テキストを中央寄せで描画
-        try:
-            w, h = text_draw.textsize(key_text, font=font)
-            position = ((text_img.width - w) // 2, (text_img.height - h) // 2)
-            text_draw.text(position, key_text, fill=(0, 0, 0, 255), font=font)
-        except (AttributeError, TypeError):
-            # 新しいバージョンのPILではtextsizeが非推奨
-            try:
-                text_draw.text((20, 300), key_text, fill=(0, 0, 0, 255), font=font, anchor="lm")
-            except TypeError:
-                # 古いバージョンのPILでは単純にテキスト描画
-                text_draw.text((20, 300), key_text, fill=(0, 0, 0, 255), font=font)
+        with metrics.stage("glare", **card_labels):
+            black = Image.new(layers["glare"].mode, CARD_PX, INK[layers["glare"].mode])
+            layers["glare"].paste(black, (x, y), alpha)
+
+        with metrics.stage("label", **card_labels):
+            # userName テキスト描画: ユーザー名を左側に-90度回転して配置（文字のある範囲だけの画像）
+            rotated_text, (label_dx, label_dy) = labels.get(user_name)
+            
+            # カットラインとラベルの間隔設定
+            label_margin = mm_to_px(5)  # カットラインから5mm離す - ラベルが切断されないための安全距離
+            
+            # 回転後のラベル枠の幅と高さ（配置は枠基準で計算する）
+            text_width, text_height = labels.rotated_size
+            
+            # ラベル位置の微調整 - 画像にかぶらないよう左側に配置
+            label_right_shift = 240  # ラベルを右に240px移動（300pxから60px左へ調整）
+            
+            # カットラインの左側の座標（右に移動して画像に近づける）
+            text_x = bx1 - label_margin - text_width + label_right_shift
+            
+            # シート外にはみ出さないように調整
+            if text_x < 10:  # 左端に最低10pxの余白を確保
+                text_x = 10
                 
-        # -90度回転（時計回り90度）- 縦書き風のラベル表示を実現
-        rotated_text = text_img.rotate(90, expand=True)
-        
-        # カットラインとラベルの間隔設定
-        label_margin = mm_to_px(5)  # カットラインから5mm離す - ラベルが切断されないための安全距離
-        
-        # テキスト画像の幅と高さを取得
-        text_width = rotated_text.width
-        text_height = rotated_text.height
-        
-        # ラベル位置の微調整 - 画像にかぶらないよう左側に配置
-        label_right_shift = 240  # ラベルを右に240px移動（300pxから60px左へ調整）
-        
-        # カットラインの左側の座標（右に移動して画像に近づける）
-        text_x = bx1 - label_margin - text_width + label_right_shift
-        
-        # シート外にはみ出さないように調整
-        if text_x < 10:  # 左端に最低10pxの余白を確保
-            text_x = 10
+            text_y = by1 + (by2 - by1) // 2 - text_height // 2  # 垂直方向中央
             
-        text_y = by1 + (by2 - by1) // 2 - text_height // 2  # 垂直方向中央
-        
-        # テキストをラベルレイヤーに貼り付け
-        layers["labels"].paste(rotated_text, (text_x, text_y), rotated_text)
-
-    # --- PNG 出力 ---
-    for name, img in layers.items():
+            # テキストをラベルレイヤーに貼り付け
+            if rotated_text is not None:
+                label_src = ink_source(layers["labels"], rotated_text)
+                layers["labels"].paste(label_src, (text_x + label_dx, text_y + label_dy), label_src)
+
+    # --- PNG 出力（スレッドプールで並列エンコード）---
+    own_writer = writer is None
+    if own_writer:
+        writer = LayerWriter()
+    try:
         # logosレイヤーとlogo_knockレイヤーは存在する場合のみ保存
-        if (name == "logos" or name == "logo_knock") and not any(card.get("logo") for card in card_data):
-            continue  # ロゴがない場合はスキップ
-
-        path = f"{output_prefix}_{name}.png"
-        img.save(path, dpi=(DPI, DPI))
-        print("Saved:", path)
+        has_logo = any(card.get("logo") for card in card_data)
+        save_layers(
+            writer, layers, output_prefix, DPI,
+            mask_format=mask_format,
+            crop=crop_layers,
+            skip=() if has_logo else ("logos", "logo_knock"),
+            container=container,
+            cut_rects=cut_rects,
+            cutline_px=CUTLINE_PX,
+            cutline_vector=cutline_vector,
+        )
+    except BaseException:
+        if own_writer:
+            writer.abort()
+        raise
+    if own_writer:
+        writer.close()
+
+
+def iter_loaded_pages(page_items: List[List[Dict]], cache: ImageCache, prefetch_pages: int = 1) -> Iterator[List[Dict]]:
+    """ページごとにカード画像を読み込んで順に返す
+
+    呼び出し側が返したページを処理している間に、次の最大prefetch_pagesページ分を別スレッドで先読みする
+    （0なら先読みせず、要求されてから読み込む）。メモリに載るのは処理中の1ページ＋先読み分。
+    返したページのカードは呼び出し側が参照を手放せば解放される。
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        next_page = 0
+
+        def submit():
+            nonlocal next_page
+            pending.append(executor.submit(metrics.bind(load_images, page=next_page + 1), page_items[next_page], cache))
+            next_page += 1
+
+        while pending or next_page < len(page_items):
+            if not pending:
+                submit()  # 先読みしていなければ、このページをここで読み込む
+            cards = pending.popleft().result()
+            # 返すページの読み込みが終わってから、その処理中に読んでおくページを積む
+            while next_page < len(page_items) and len(pending) < prefetch_pages:
+                submit()
+            yield cards
+            del cards
+
+
+def plan_job(
+    image_info: List[Dict],
+    sheet_mm: Tuple[float, float],
+    pagination: str = "orders",
+    one_page: bool = False,
+) -> Tuple[List[List[Dict]], int]:
+    """orderIdごとにまとめてページ計画を作る（画像は読まない）
+
+    (ページごとの項目リスト, 1ページの最大枚数) を返す。one_pageの場合は全項目を1ページにする。
+    """
+    # orderIdごとにグループ化（orderIdの順番でソート）
+    grouped_image_info, sorted_order_ids = group_by_order(image_info)
+    
+    # シート1枚あたりのカード数 - ラベル用マージンを含めた実際の配置で数える
+    sheet_px = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
+    _, rows, cols = grid_layout(sheet_px=sheet_px, left_margin_px=MARGIN_PX + LABEL_MARGIN_PX)
+    cards_per_page = page_capacity(lambda: sheet_packer(sheet_px))  # 1ページに配置可能な最大カード数
+    
+    # ページごとの項目リスト（amountを考慮、画像はページごとに読み込む）
+    # fillは配置と同じパッカーで詰める。ordersは注文単位でページに割り当てる
+    if one_page:
+        page_items = [list(image_info)]
+    elif pagination == "orders":
+        page_items = plan_pages(grouped_image_info, cards_per_page)
+    else:
+        page_items = paginate_items(grouped_image_info, lambda: sheet_packer(sheet_px))
+    
+    # 必要なページ数を計算
+    total_cards = sum(info.get("amount", 1) for info in grouped_image_info)
+    total_pages = len(page_items)
+    
+    print(f"合計 {len(image_info)} アイテム → {total_cards} 枚のカード（amountを考慮）")
+    print(f"{total_pages} ページに分割します")
+    print(f"1ページあたり 最大{cards_per_page}枚 ({cols}列 x {rows}行)")
+    print(f"Order IDs: {', '.join(sorted_order_ids)}")
+    split = split_orders(page_items)
+    print(f"ページをまたぐ注文: {', '.join(split) if split else 'なし'}")
+    return page_items, cards_per_page
 
 
 # ------------------------ 使い方例 -------------------------------
@@ -477,72 +624,93 @@ def process_pages(
     knockout_shrink_mm: float = None,
     knockout_mode: str = "normal",
     knockout_style: str = "binary",
+    tile_cache: Optional[DiskTileCache] = None,
+    batch_knockout: bool = False,
+    prefetch_pages: int = 1,
+    writer: Optional[LayerWriter] = None,
+    mask_format: str = "rgba",
+    crop_layers: bool = False,
+    container: str = "png",
+    cutline_vector: Tuple[str, ...] = (),
+    raster_cutline: bool = True,
+    pagination: str = "orders",
+    cache: Optional[ImageCache] = None,
 ):
-    """画像情報をページ分割して処理する（orderIdごとにグループ化）"""
+    """画像情報をページ分割して処理する（orderIdごとにグループ化）
+
+    画像はページ単位で読み込んで処理後に解放するため、メモリ使用量は
+    注文全体ではなく1ページ分（＋先読みprefetch_pagesページ分）で決まる。
+    PNGの書き出しはwriterのスレッドで行い、次のページの合成と並行して進める。
+    paginationがordersの場合は注文をページをまたがないように割り当て（1ページに入らない注文を除く）、
+    fillの場合は注文順に詰める。画像を読む前にページ計画を <output_dir>/page_plan.json に書き出す。
+    cacheを渡すと、複数回の呼び出し（receiveTypeごとの生成など）でデコード済み画像を使い回す。
+    """
     import os
-    from math import ceil
-    from collections import defaultdict
-    
-    # orderIdごとにグループ化
-    orders = defaultdict(list)
-    for item in image_info:
-        order_id = item.get("orderId", "no_order")
-        orders[order_id].append(item)
-    
-    # orderIdの順番でソート
-    sorted_order_ids = sorted(orders.keys(), key=lambda x: int(x) if x.isdigit() else float('inf'))
     
-    # 全体のカードリストを再構築（orderIdごとにまとめる）
-    grouped_image_info = []
-    for order_id in sorted_order_ids:
-        grouped_image_info.extend(orders[order_id])
+    # ページ計画（画像はまだ読まない）を作って書き出す
+    page_items, cards_per_page = plan_job(image_info, sheet_mm, pagination)
+    total_pages = len(page_items)
+    os.makedirs(output_dir, exist_ok=True)
+    plan_path = os.path.join(output_dir, PAGE_PLAN_FILE)
+    write_page_plan(plan_path, page_items, pagination, sheet_mm, cards_per_page)
+    print(f"ページ計画: {plan_path}")
     
-    # シート1枚あたりのカード数を計算 - ページ分割のための事前計算
-    temp_sheet_px = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
-    _, rows, cols = grid_layout(sheet_px=temp_sheet_px)
-    cards_per_page = rows * cols  # 1ページに配置可能な最大カード数
-    
-    # load_imagesで展開されたカードリストを作成（amountを考慮）
-    expanded_cards = load_images(grouped_image_info)
-    
-    # 必要なページ数を計算
-    total_cards = len(expanded_cards)
-    total_pages = ceil(total_cards / cards_per_page)
-    
-    print(f"合計 {len(image_info)} アイテム → {total_cards} 枚のカード（amountを考慮）")
-    print(f"{total_pages} ページに分割します")
-    print(f"1ページあたり 最大{cards_per_page}枚 ({cols}列 x {rows}行)")
-    print(f"Order IDs: {', '.join(sorted_order_ids)}")
-    
-    # ページごとに処理
-    for page_no in range(1, total_pages + 1):
-        # このページに含めるカードの範囲を計算
-        start_idx = (page_no - 1) * cards_per_page
-        end_idx = min(page_no * cards_per_page, total_cards)
-        
-        # このページのカードデータを取得
-        page_cards = expanded_cards[start_idx:end_idx]
-        print(f"ページ {page_no}/{total_pages}: {len(page_cards)} 枚のカード処理中...")
+    # ページごとに読み込み→処理→解放（次のページは裏で先読み）
+    if cache is None:
+        cache = ImageCache(disk=tile_cache)
+    own_writer = writer is None
+    if own_writer:
+        writer = LayerWriter()
+    # 途中で失敗しても書き出しスレッドと先読みスレッドを必ず止める
+    # （自前のwriterは未着手の書き出しを取り消す。渡されたwriterの後始末は呼び出し側で行う）
+    pages = iter_loaded_pages(page_items, cache, prefetch_pages)
+    try:
+        for page_no, page_cards in enumerate(pages, start=1):
+            print(f"ページ {page_no}/{total_pages}: {len(page_cards)} 枚のカード処理中...")
         
-        # ページ用のディレクトリを作成（数字だけのフォルダ名）- makePSD.jsが認識できる形式
-        page_dir = os.path.join(output_dir, f"{page_no}")  # 例: output/1, output/2
-        if not os.path.exists(page_dir):
-            os.makedirs(page_dir, exist_ok=True)
+            # ページ用のディレクトリを作成（数字だけのフォルダ名）- makePSD.jsが認識できる形式
+            page_dir = os.path.join(output_dir, f"{page_no}")  # 例: output/1, output/2
+            if not os.path.exists(page_dir):
+                os.makedirs(page_dir, exist_ok=True)
         
-        # このページ用の出力プレフィックス
-        page_prefix = os.path.join(page_dir, output_prefix)
+            # このページ用の出力プレフィックス
+            page_prefix = os.path.join(page_dir, output_prefix)
         
-        # このページのカードを処理（既に展開済みなのでload_imagesは不要）
-        make_sheet_layers(
-            sheet_mm=sheet_mm,
-            card_data=page_cards,
-            output_prefix=page_prefix,
-            knockout_shrink_mm=knockout_shrink_mm,
-            knockout_mode=knockout_mode,
-            knockout_style=knockout_style
-        )
+            # このページのカードを処理
+            with metrics.labels(page=page_no):
+                make_sheet_layers(
+                    sheet_mm=sheet_mm,
+                    card_data=page_cards,
+                    output_prefix=page_prefix,
+                    knockout_shrink_mm=knockout_shrink_mm,
+                    knockout_mode=knockout_mode,
+                    knockout_style=knockout_style,
+                    tile_cache=tile_cache,
+                    batch_knockout=batch_knockout,
+                    writer=writer,
+                    mask_format=mask_format,
+                    crop_layers=crop_layers,
+                    container=container,
+                    cutline_vector=cutline_vector,
+                    raster_cutline=raster_cutline,
+                )
         
-        print(f"ページ {page_no} 完了: {page_dir}/*.png\n")
+            print(f"ページ {page_no} 合成完了: {page_dir}/*.png（書き出しは並行して実行）\n")
+            del page_cards  # 次のページの前に解放
+    except BaseException:
+        if own_writer:
+            writer.abort()
+        raise
+    finally:
+        pages.close()
+    if own_writer:
+        writer.close()
+    else:
+        writer.wait()
+    print(cache.summary())
+    print(label_cache(LABEL_FRAME, LABEL_ORIGIN, LABEL_ANCHOR).summary())
+    if tile_cache is not None:
+        print(tile_cache.summary())
 
 
 if __name__ == "__main__":
@@ -554,11 +722,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--sheet", default="280x580", help="シート寸法 mm 例: 280x580"
     )
-    parser.add_argument(
+    images_group = parser.add_mutually_exclusive_group(required=True)
+    images_group.add_argument(
         "--images",
-        required=True,
         help="JSON: [{'key': 'ch1','char':'path.png','bg':'path.jpg'}, ...]",
     )
+    images_group.add_argument(
+        "--images-file",
+        help="画像情報のJSON配列またはJSONL（1行1項目）のファイル。少しずつ読み込む（- で標準入力）",
+    )
     parser.add_argument(
         "--prefix", default="sheet", help="出力ファイル名前の接頭辞"
     )
@@ -577,45 +749,189 @@ if __name__ == "__main__":
         help="白板処理モード: normal=標準, aggressive=薄い部分も白板化, minimal=最小限の処理"
     )
     parser.add_argument(
-        "--knockout-style", choices=["binary", "gradient", "hybrid", "adaptive"], default="binary",
-        help="白板スタイル: binary=2値化, gradient=グレースケール, hybrid=混合, adaptive=自動"
+        "--knockout-style", choices=knockout.available_styles(), default="binary",
+        help="白板スタイル: binary=2値化, gradient=グレースケール, hybrid=混合, adaptive=自動, steep*=傾斜グラデーション"
+    )
+    parser.add_argument(
+        "--pagination", choices=PAGINATION_MODES, default="orders",
+        help="ページ分割の方法: orders=注文（orderId）をページにまたがせない（1ページに入らない注文のみ分割）、"
+             "fill=注文順にページを詰める。ページ計画は <output-dir>/page_plan.json に出力。デフォルト: orders"
+    )
+    parser.add_argument(
+        "--plan", action="store_true",
+        help="ドライラン。画像はヘッダーだけ読み、ページ計画・ページごとのデコード量・想定ピークメモリ・"
+             "出力サイズ・処理時間の見積もりを表示して page_plan.json に書き出す（合成はしない）"
+    )
+    parser.add_argument(
+        "--plan-costs", default=None,
+        help="--plan の見積もりに使うコスト（dry_run.DEFAULT_COSTS の項目）を上書きするJSONファイル"
+    )
+    parser.add_argument(
+        "--batch-knockout", action="store_true",
+        help="ページ内の全カードの白板処理（閾値・ぼかし・収縮）をまとめて一括実行（結果は同一）"
+    )
+    parser.add_argument(
+        "--png-compress", type=int, choices=range(0, 10), default=None, metavar="0-9",
+        help="PNGの圧縮レベル（0=無圧縮・最速、9=最小サイズ）。デフォルト: zlib標準(6)"
+    )
+    parser.add_argument(
+        "--png-strategy", choices=list(PNG_STRATEGIES), default="default",
+        help="PNGのzlib圧縮戦略。透明部分の多いレイヤーは rle が速い。デフォルト: default"
+    )
+    parser.add_argument(
+        "--mask-layers", choices=MASK_FORMATS, default="rgba",
+        help="マスク系レイヤー（cutline/glare/*_knock/labels）の形式。"
+             "la=黒+αのグレースケール（従来のjsxでそのまま読める）、gray/bilevel=白地に黒（乗算で重ねる）。"
+             "rgba以外ではページごとに <prefix>_layers.json を出力。デフォルト: rgba"
+    )
+    parser.add_argument(
+        "--crop-layers", action="store_true",
+        help="空のレイヤーを書き出さず、それ以外は描画範囲に切り抜いて書き出す（位置は <prefix>_layers.json に記録）"
+    )
+    parser.add_argument(
+        "--container", choices=CONTAINERS, default="png",
+        help="ページの出力形式。png=レイヤーごとのPNG、tiff=全レイヤーを1つのマルチページTIFF（<prefix>.tif）、"
+             "pdf=レイヤー（OCG）付きPDF（<prefix>.pdf、カットラインはベクター）。デフォルト: png"
+    )
+    parser.add_argument(
+        "--cutline-vector", action="append", choices=VECTOR_FORMATS, default=None,
+        help="カットラインをカード配置から計算したベクターパスとして <prefix>_cutline.svg / .pdf にも書き出す"
+             "（両方なら2回指定）"
+    )
+    parser.add_argument(
+        "--no-raster-cutline", action="store_true",
+        help="ラスタのカットラインレイヤー（sheet_cutline.png）を作らない。--cutline-vector か --container pdf と併用"
+    )
+    parser.add_argument(
+        "--png-workers", type=int, default=None,
+        help="PNGエンコードのスレッド数。デフォルト: CPUコア数（最大4）"
+    )
+    parser.add_argument(
+        "--prefetch-pages", type=int, default=1,
+        help="処理中のページと並行して先読みするページ数（0で先読みしない）。メモリ使用量はおよそ(1+この値)ページ分。デフォルト: 1"
+    )
+    parser.add_argument(
+        "--tile-cache", default=None,
+        help="カード単位の成果物（リサイズ済み画像・白板マスク）を保存するキャッシュディレクトリ。実行をまたいで再利用"
+    )
+    parser.add_argument(
+        "--tile-cache-max-mb", type=int, default=4096,
+        help="タイルキャッシュの容量上限(MB)。超過時は古いものから削除。デフォルト: 4096"
+    )
+    parser.add_argument(
+        "--metrics", default=None,
+        help="段階ごと（decode/resize/knockout/glare/composite/label/PNG書き出し）の時間とメモリを"
+             "カード・ページ単位で記録するファイル（拡張子で形式: .json / .csv / .prom）"
     )
     args = parser.parse_args()
+    cutline_vector = tuple(dict.fromkeys(args.cutline_vector or ()))
+    if args.no_raster_cutline and not cutline_vector and args.container != "pdf":
+        parser.error("--no-raster-cutline には --cutline-vector または --container pdf が必要です")
+    if args.prefetch_pages < 0:
+        parser.error("--prefetch-pages は0以上で指定してください")
+    try:
+        plan_costs = load_costs(args.plan_costs)
+    except (OSError, ValueError) as e:
+        parser.error(f"--plan-costs を読めません: {e}")
 
     try:
         w_mm, h_mm = map(float, args.sheet.lower().split("x"))
     except Exception:
         sys.exit("シート寸法は 280x580 のように指定してください。")
 
-    try:
-        image_info = json.loads(args.images)
-    except json.JSONDecodeError:
-        sys.exit("--images に JSON 形式でパスを渡してください。")
+    if args.images_file:
+        try:
+            image_info = load_items(args.images_file)
+        except OSError as e:
+            sys.exit(f"--images-file を読めません: {e}")
+        except JobInputError as e:
+            sys.exit(f"--images-file の形式が正しくありません（{e}）")
+    else:
+        try:
+            image_info = json.loads(args.images)
+        except json.JSONDecodeError:
+            sys.exit("--images に JSON 形式でパスを渡してください。")
     
     # 出力ディレクトリの作成
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir, exist_ok=True)
     
-    if args.one_page:
-        # 単一ページとして処理
-        cards = load_images(image_info)
-        output_prefix = os.path.join(args.output_dir, args.prefix)
-        make_sheet_layers(
-            sheet_mm=(w_mm, h_mm),
-            card_data=cards,
-            output_prefix=output_prefix,
-            knockout_shrink_mm=args.knockout_shrink,
-            knockout_mode=args.knockout_mode,
-            knockout_style=args.knockout_style
+    if args.plan:
+        # ドライラン: 画像はヘッダーだけ読み、ページ計画と見積もりを出して終了
+        sheet_mm = (w_mm, h_mm)
+        page_items, cards_per_page = plan_job(image_info, sheet_mm, args.pagination, one_page=args.one_page)
+        estimate = estimate_job(
+            page_items, (mm_to_px(w_mm), mm_to_px(h_mm)), CARD_PX,
+            mask_format=args.mask_layers,
+            encode_workers=args.png_workers or DEFAULT_ENCODE_WORKERS,
+            costs=plan_costs,
         )
-    else:
-        # 複数ページに分割して処理
-        process_pages(
-            image_info=image_info,
-            sheet_mm=(w_mm, h_mm),
-            output_prefix=args.prefix,
-            output_dir=args.output_dir,
-            knockout_shrink_mm=args.knockout_shrink,
-            knockout_mode=args.knockout_mode,
-            knockout_style=args.knockout_style
-        )
\ No newline at end of file
+        print_estimate(estimate)
+        plan_path = os.path.join(args.output_dir, PAGE_PLAN_FILE)
+        write_page_plan(plan_path, page_items, "one_page" if args.one_page else args.pagination,
+                        sheet_mm, cards_per_page, estimate=estimate)
+        print(f"ページ計画: {plan_path}")
+        sys.exit(0)
+    
+    if args.metrics:
+        metrics.enable()
+
+    # 途中で失敗しても、それまでの計測結果は書き出す
+    try:
+        tile_cache = None
+        if args.tile_cache:
+            tile_cache = DiskTileCache(args.tile_cache, max_bytes=args.tile_cache_max_mb * 1024 * 1024)
+
+        writer = LayerWriter(
+            max_workers=args.png_workers or DEFAULT_ENCODE_WORKERS,
+            compress_level=args.png_compress,
+            strategy=args.png_strategy,
+        )
+
+        # 途中で失敗したら未着手の書き出しを取り消して書き出しスレッドを止める
+        with writer:
+            if args.one_page:
+                # 単一ページとして処理
+                with metrics.labels(page=1):
+                    cards = load_images(image_info, cache=ImageCache(disk=tile_cache))
+                    output_prefix = os.path.join(args.output_dir, args.prefix)
+                    make_sheet_layers(
+                        sheet_mm=(w_mm, h_mm),
+                        card_data=cards,
+                        output_prefix=output_prefix,
+                        knockout_shrink_mm=args.knockout_shrink,
+                        knockout_mode=args.knockout_mode,
+                        knockout_style=args.knockout_style,
+                        tile_cache=tile_cache,
+                        batch_knockout=args.batch_knockout,
+                        writer=writer,
+                        mask_format=args.mask_layers,
+                        crop_layers=args.crop_layers,
+                        container=args.container,
+                        cutline_vector=cutline_vector,
+                        raster_cutline=not args.no_raster_cutline,
+                    )
+            else:
+                # 複数ページに分割して処理
+                process_pages(
+                    image_info=image_info,
+                    sheet_mm=(w_mm, h_mm),
+                    output_prefix=args.prefix,
+                    output_dir=args.output_dir,
+                    knockout_shrink_mm=args.knockout_shrink,
+                    knockout_mode=args.knockout_mode,
+                    knockout_style=args.knockout_style,
+                    tile_cache=tile_cache,
+                    batch_knockout=args.batch_knockout,
+                    prefetch_pages=args.prefetch_pages,
+                    writer=writer,
+                    mask_format=args.mask_layers,
+                    crop_layers=args.crop_layers,
+                    container=args.container,
+                    cutline_vector=cutline_vector,
+                    raster_cutline=not args.no_raster_cutline,
+                    pagination=args.pagination,
+                )
+    finally:
+        if args.metrics:
+            metrics.finish(args.metrics)
@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
 # acrylic_sheet_generator_parallel.py - 並列処理版
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 import math
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import json
 import sys
 import os
 import time
 
-from PIL import Image, ImageDraw, ImageOps, ImageFilter, ImageFont
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps, ImageFilter
 from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+from image_cache import ImageCache, DiskTileCache, cached_artifact, cached_artifacts
+import knockout
+from layer_writer import (
+    LayerWriter, PNG_STRATEGIES, CONTAINERS, MASK_FORMATS, INK,
+    new_layer, ink_source, alpha_over, save_layers,
+)
+from cutline import VECTOR_FORMATS, cutline_rects
+from label_cache import label_cache
+from layout import (
+    ShelfPacker, PAGINATION_MODES, PAGE_PLAN_FILE,
+    sheet_layout, paginate_items, page_capacity, plan_pages, write_page_plan, group_by_order,
+)
+from dry_run import estimate_job, load_costs, print_estimate
+from job_input import JobInputError, load_items
+import metrics
+from shared_tiles import SharedTileWriter, SharedTileHandle, attach as attach_shared_tiles
+
 DPI = 350
 MM_PER_INCH = 25.4
 
@@ -34,9 +52,14 @@ CUTLINE_PX = mm_to_px(CUTLINE_MM)
 MARGIN_PX = mm_to_px(MARGIN_MM)
 SPACING_PX = mm_to_px(SPACING_MM)
 KNOCKOUT_SHRINK_PX = max(1, mm_to_px(KNOCKOUT_SHRINK_MM))
+LABEL_MARGIN_PX = mm_to_px(50)  # ラベル表示用の左側追加マージン
+LABEL_FRAME = (CARD_PX[1], 600)  # ラベルの描画枠（回転前）
+LABEL_ORIGIN = (20, 300)
 
 ALLOW_UPSCALE_CHAR = False
 ALLOW_UPSCALE_BG = True
+WORKER_LOAD_THREADS = 2  # 各ワーカープロセス内で画像を読み込むスレッド数
+WORKER_ENCODE_THREADS = 2  # 各ワーカープロセス内でPNGをエンコードするスレッド数（最小値）
 
 def resize_char_canvas(im: Image.Image, target_wh: Tuple[int,int], allow_upscale: bool = ALLOW_UPSCALE_CHAR) -> Image.Image:
     tw, th = target_wh
@@ -92,22 +115,58 @@ def grid_layout(sheet_px, card_px=CARD_PX, margin_px=MARGIN_PX, spacing_px=SPACI
             positions.append((x, y))
     return positions, rows, cols
 
+def sheet_packer(sheet_px) -> ShelfPacker:
+    """シート1枚分のパッカー（左側の余白はラベル用マージンを足したもの）"""
+    return ShelfPacker(sheet_px, CARD_PX, MARGIN_PX, SPACING_PX, CUTLINE_PX, left_margin_px=MARGIN_PX + LABEL_MARGIN_PX)
+
+def make_knockout_mask(alpha: Image.Image, threshold: int, shrink_px: int, knockout_style: str = "binary") -> Image.Image:
+    """アルファチャンネルから白板マスク（L）を生成する（閾値処理＋収縮）"""
+    alpha_processed = knockout.apply_knockout(alpha, knockout_style, threshold)
+    if shrink_px > 0:
+        alpha_smooth = alpha_processed.filter(ImageFilter.GaussianBlur(radius=knockout.SMOOTH_RADIUS))
+        return knockout.erode(alpha_smooth, shrink_px)
+    return alpha_processed
+
+def make_knockout_masks(alphas: List[Image.Image], threshold: int, shrink_px: int, knockout_style: str = "binary") -> List[Image.Image]:
+    """複数カードのαを (N, H, W) に積み重ねて白板マスクを一括生成する（make_knockout_maskと同一結果）"""
+    if not alphas:
+        return []
+    planes = np.stack([np.asarray(a) for a in alphas])
+    masks = knockout.knockout_planes(planes, knockout_style, threshold, shrink_px)
+    return [Image.fromarray(m) for m in masks]
+
+def resized_card_images(card: Dict) -> Tuple[Image.Image, Image.Image, Optional[Image.Image]]:
+    """カードの (char, bg, logo) をCARD_PXにリサイズして返す（読み込み時にリサイズ済みならそのまま）"""
+    logo_img = card.get("logo")
+    if card.get("resized"):
+        return card["char"], card["bg"], logo_img
+    char_img = resize_char_canvas(card["char"], CARD_PX, allow_upscale=ALLOW_UPSCALE_CHAR)
+    bg_img = resize_bg_canvas(card["bg"], CARD_PX, allow_upscale=ALLOW_UPSCALE_BG)
+    if logo_img:
+        logo_img = resize_char_canvas(logo_img, CARD_PX, allow_upscale=True)
+    return char_img, bg_img, logo_img
+
 # 並列画像読み込み関数
-def load_single_image(info: Dict) -> Dict:
-    """単一画像の読み込み（並列処理用）"""
+def load_single_image(info: Dict, cache: Optional[ImageCache] = None) -> Dict:
+    """単一画像の読み込み（並列処理用）- CARD_PXにリサイズ済みの画像をキャッシュから取得"""
+    if cache is None:
+        cache = ImageCache()
     try:
-        char = Image.open(info["char"]).convert("RGBA")
+        char = cache.get(info["char"], resize_char_canvas, CARD_PX, ALLOW_UPSCALE_CHAR)
+        char_key = cache.tile_key(info["char"], resize_char_canvas, CARD_PX, ALLOW_UPSCALE_CHAR)
 
         bg = None
         if info.get("bg"):
-            bg = Image.open(info["bg"]).convert("RGBA")
+            bg = cache.get(info["bg"], resize_bg_canvas, CARD_PX, ALLOW_UPSCALE_BG)
         else:
             bg = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
 
         logo = None
+        logo_key = None
         if "logo" in info and info["logo"]:
             try:
-                logo = Image.open(info["logo"]).convert("RGBA")
+                logo = cache.get(info["logo"], resize_char_canvas, CARD_PX, True)
+                logo_key = cache.tile_key(info["logo"], resize_char_canvas, CARD_PX, True)
             except:
                 pass
 
@@ -117,6 +176,9 @@ def load_single_image(info: Dict) -> Dict:
             "bg": bg,
             "bg_path": info.get("bg"),
             "logo": logo,
+            "resized": True,
+            "char_key": char_key,
+            "logo_key": logo_key,
             "userName": info.get("userName", info["key"]),
             "orderId": info.get("orderId", ""),
             "amount": info.get("amount", 1)
@@ -125,17 +187,19 @@ def load_single_image(info: Dict) -> Dict:
         print(f"Error loading {info['key']}: {e}")
         return None
 
-def load_images_parallel(image_info: List[Dict], max_workers: int = 4) -> List[Dict]:
-    """並列で画像を読み込む"""
+def load_images_parallel(image_info: List[Dict], max_workers: int = 4, cache: Optional[ImageCache] = None) -> List[Dict]:
+    """並列で画像を読み込む（共有の背景・ロゴはキャッシュで1回だけデコード）"""
+    if cache is None:
+        cache = ImageCache()
     cards = []
 
     print(f"Loading {len(image_info)} items with {max_workers} workers...")
 
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 各画像を並列で読み込み
-        future_to_info = {executor.submit(load_single_image, info): info for info in image_info}
+        # 各画像を並列で読み込み（カードの並びは入力順を保つ）
+        futures = [executor.submit(metrics.bind(load_single_image), info, cache) for info in image_info]
 
-        for future in as_completed(future_to_info):
+        for future in futures:
             result = future.result()
             if result:
                 # amountに応じて複製
@@ -144,12 +208,61 @@ def load_images_parallel(image_info: List[Dict], max_workers: int = 4) -> List[D
                     cards.append(dict(result))
 
     print(f"Successfully loaded {len(cards)} cards from {len(image_info)} items")
+    print(cache.summary())
     return cards
 
+# ワーカープロセスごとの画像キャッシュ（同じプロセスで処理するページ間で背景・ロゴを共有）
+_worker_cache: Optional[ImageCache] = None
+
+
+def worker_image_cache(tile_cache: Optional[DiskTileCache], shared: Optional[SharedTileHandle] = None) -> ImageCache:
+    """このプロセスの画像キャッシュを返す（初回呼び出し時に作成し、共有タイルをmmapする）"""
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = ImageCache(disk=tile_cache)
+        if shared is not None:
+            _worker_cache.add_shared(attach_shared_tiles(shared))
+    return _worker_cache
+
+
+def card_assets(info: Dict) -> List[Tuple[str, object, bool]]:
+    """カードが使う画像の (パス, リサイズ関数, 拡大可否) の一覧（load_single_imageと同じ組み合わせ）"""
+    assets = [(info["char"], resize_char_canvas, ALLOW_UPSCALE_CHAR)]
+    if info.get("bg"):
+        assets.append((info["bg"], resize_bg_canvas, ALLOW_UPSCALE_BG))
+    if info.get("logo"):
+        assets.append((info["logo"], resize_char_canvas, True))
+    return assets
+
+
+def build_shared_tiles(page_items: List[List[Dict]], cache: ImageCache, writer: SharedTileWriter):
+    """2ページ以上で使われる画像（共通の背景・ロゴなど）をリサイズして共有タイルに書き出す"""
+    pages_using: Dict[Tuple[str, object, bool], int] = {}
+    for items in page_items:
+        for asset in {a for info in items for a in card_assets(info)}:
+            pages_using[asset] = pages_using.get(asset, 0) + 1
+    for (path, resize_fn, upscale), n_pages in pages_using.items():
+        if n_pages < 2:
+            continue
+        key = cache.tile_key(path, resize_fn, CARD_PX, upscale)
+        if key in writer:
+            continue
+        try:
+            writer.add(key, cache.get(path, resize_fn, CARD_PX, upscale))
+        except Exception as e:
+            # 読めない画像はワーカー側の通常の読み込みに任せる（エラー表示もそちらで行う）
+            print(f"Warning: Failed to share {path}: {e}")
+
+
 def process_single_page(args):
-    """単一ページを処理（並列処理用）"""
-    page_no, page_cards, sheet_mm, output_prefix, knockout_shrink_mm, knockout_mode = args
+    """単一ページを処理（並列処理用）
+
+    親プロセスからは画像パスなどの項目リストだけを受け取り、デコード＆リサイズはワーカー側で行う。
+    """
+    page_no, page_items, sheet_mm, output_prefix, knockout_shrink_mm, knockout_mode, knockout_style, tile_cache, batch_knockout, shared, card_workers, png_compress, png_strategy, mask_format, crop_layers, container, cutline_vector, raster_cutline = args
 
+    cache = worker_image_cache(tile_cache, shared)
+    page_cards = load_images_parallel(page_items, max_workers=WORKER_LOAD_THREADS, cache=cache)
     print(f"Processing page {page_no} with {len(page_cards)} cards...")
 
     # ローカルで設定を再計算
@@ -166,137 +279,198 @@ def process_single_page(args):
         threshold = KNOCKOUT_THRESHOLD
         min_alpha = KNOCKOUT_MIN_ALPHA
 
+    knock_params = {
+        "knockout_mode": knockout_mode,
+        "threshold": threshold,
+        "shrink_px": shrink_px,
+        "card_px": list(CARD_PX),
+        "dpi": DPI,
+    }
+
     # シート設定
     sheet_px = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
-    label_margin_px = mm_to_px(50)
-    left_margin_px = MARGIN_PX + label_margin_px
 
-    # レイヤー初期化
+    # レイヤー初期化（raster_cutlineがFalseならカットラインはベクターのみ）
     layers = {
-        "cutline": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "glare": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "logos": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "logo_knock": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "character": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "char_knock": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "bg_knock": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "background": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
-        "labels": Image.new("RGBA", sheet_px, (0, 0, 0, 0)),
+        name: new_layer(name, sheet_px, mask_format)
+        for name in ("cutline", "glare", "logos", "logo_knock", "character",
+                     "char_knock", "bg_knock", "background", "labels")
+        if raster_cutline or name != "cutline"
     }
 
-    draw_cut = ImageDraw.Draw(layers["cutline"])
-
-    # フォント設定
-    try:
-        font_size = 100
-        font = None
-        japanese_fonts = [
-            "/System/Library/Fonts/Hiragino Sans GB.ttc",
-            "/System/Library/Fonts/PingFang.ttc",
-        ]
-        for font_path in japanese_fonts:
-            try:
-                font = ImageFont.truetype(font_path, font_size, index=0)
-                break
-            except:
-                continue
-        if font is None:
-            font = ImageFont.load_default()
-    except:
-        font = ImageFont.load_default()
-
-    # 配置計算
-    positions, _, _ = grid_layout(sheet_px=sheet_px, left_margin_px=left_margin_px)
-
-    # カードごとに処理
-    for card, (x, y) in zip(page_cards, positions):
-        char_img_raw = card["char"]
-        bg_img_raw = card["bg"]
-        logo_img_raw = card.get("logo")
-        user_name = card.get("userName", card["key"])
-
-        char_img = resize_char_canvas(char_img_raw, CARD_PX, allow_upscale=ALLOW_UPSCALE_CHAR)
-        bg_img = resize_bg_canvas(bg_img_raw, CARD_PX, allow_upscale=ALLOW_UPSCALE_BG)
-
-        # background
-        layers["background"].paste(bg_img, (x, y), bg_img)
-
-        # bg_knockout
-        if card.get("bg_path"):
-            bg_mask = Image.new("L", CARD_PX, 255)
-            black_bg = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-            layers["bg_knock"].paste(black_bg, (x, y), bg_mask)
-
-        # character
-        layers["character"].paste(char_img, (x, y), char_img)
-
-        # logo
-        if logo_img_raw:
-            logo_img = resize_char_canvas(logo_img_raw, CARD_PX, allow_upscale=True)
-            layers["logos"].paste(logo_img, (x, y), logo_img)
-
-            # logo knockout
-            logo_alpha = logo_img.split()[-1]
-            logo_alpha_processed = logo_alpha.point(lambda p: 0 if p < threshold else 255)
-            if shrink_px > 0:
-                logo_alpha_smooth = logo_alpha_processed.filter(ImageFilter.GaussianBlur(radius=0.3))
-                logo_knock = logo_alpha_smooth.filter(ImageFilter.MinFilter(3))
+    draw_cut = ImageDraw.Draw(layers["cutline"]) if raster_cutline else None
+
+    # 配置計算（ページ分割と同じパッカーで左上から詰める）
+    positions = sheet_layout(sheet_packer(sheet_px), [CARD_PX] * len(page_cards))
+
+    card_images = [resized_card_images(card) for card in page_cards]
+
+    # ページ単位の一括白板処理
+    char_knocks = None
+    logo_knocks = {}
+    if batch_knockout:
+        with metrics.stage("knockout", batch=True):
+            char_alphas = [imgs[0].split()[-1] for imgs in card_images]
+            char_knocks = cached_artifacts(
+                tile_cache, "char_knock", [card.get("char_key") for card in page_cards],
+                dict(knock_params, knockout_style=knockout_style),
+                lambda idx: make_knockout_masks([char_alphas[i] for i in idx], threshold, shrink_px, knockout_style),
+            )
+            logo_idx = [i for i, imgs in enumerate(card_images) if imgs[2]]
+            logo_alphas = [card_images[i][2].split()[-1] for i in logo_idx]
+            masks = cached_artifacts(
+                tile_cache, "logo_knock", [page_cards[i].get("logo_key") for i in logo_idx],
+                dict(knock_params, knockout_style="binary"),
+                lambda idx: make_knockout_masks([logo_alphas[i] for i in idx], threshold, shrink_px),
+            )
+            logo_knocks = dict(zip(logo_idx, masks))
+
+    def prepare_card(i):
+        """カード単位の重い処理（白板マスク・グレア用α・ラベル描画）。シートへの貼り付けは行わない"""
+        card = page_cards[i]
+        char_img, _, logo_img = card_images[i]
+
+        with metrics.stage("knockout", card=i + 1, key=card["key"]):
+            logo_knock = None
+            if logo_img:
+                if i in logo_knocks:
+                    logo_knock = logo_knocks[i]
+                else:
+                    logo_alpha = logo_img.split()[-1]
+                    logo_knock = cached_artifact(
+                        tile_cache, "logo_knock", card.get("logo_key"),
+                        dict(knock_params, knockout_style="binary"),
+                        lambda: make_knockout_mask(logo_alpha, threshold, shrink_px),
+                    )
+
+            alpha = char_img.split()[-1]
+            if char_knocks is not None:
+                knock = char_knocks[i]
             else:
-                logo_knock = logo_alpha_processed
-            black_logo = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-            layers["logo_knock"].paste(black_logo, (x, y), logo_knock)
-
-        # character knockout
-        alpha = char_img.split()[-1]
-        alpha_processed = alpha.point(lambda p: 0 if p < threshold else 255)
-        if shrink_px > 0:
-            alpha_smooth = alpha_processed.filter(ImageFilter.GaussianBlur(radius=0.3))
-            knock = alpha_smooth.filter(ImageFilter.MinFilter(3))
-        else:
-            knock = alpha_processed
-        black = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-        layers["char_knock"].paste(black, (x, y), knock)
+                knock = cached_artifact(
+                    tile_cache, "char_knock", card.get("char_key"),
+                    dict(knock_params, knockout_style=knockout_style),
+                    lambda: make_knockout_mask(alpha, threshold, shrink_px, knockout_style),
+                )
+
+        with metrics.stage("label_render", card=i + 1, key=card["key"]):
+            label = label_cache(LABEL_FRAME, LABEL_ORIGIN).get(card.get("userName", card["key"]))
+        return knock, logo_knock, alpha, label
+
+    # カード単位の処理はスレッドプールで並列実行（PIL/NumPyの重い処理はGILを解放する）
+    n_cards = min(len(page_cards), len(positions))
+    if card_workers > 1 and n_cards > 1:
+        with ThreadPoolExecutor(max_workers=card_workers) as pool:
+            prepared = list(pool.map(metrics.bind(prepare_card), range(n_cards)))
+    else:
+        prepared = [prepare_card(i) for i in range(n_cards)]
+
+    # カットライン矩形（カード位置から計算）
+    cut_rects = cutline_rects([xy for _, xy in zip(page_cards, positions)], CARD_PX, CUTLINE_PX)
+
+    # シートへの貼り付け（直列）
+    for i, (card, (x, y)) in enumerate(zip(page_cards, positions)):
+        char_img, bg_img, logo_img = card_images[i]
+        knock, logo_knock, alpha, (rotated_text, (label_dx, label_dy)) = prepared[i]
+        card_labels = {"card": i + 1, "key": card["key"]}  # --metrics の記録に付けるラベル
+
+        with metrics.stage("composite", **card_labels):
+            # background
+            layers["background"].paste(bg_img, (x, y), bg_img)
+
+            # bg_knockout
+            if card.get("bg_path"):
+                bg_mask = Image.new("L", CARD_PX, 255)
+                black_bg = Image.new(layers["bg_knock"].mode, CARD_PX, INK[layers["bg_knock"].mode])
+                layers["bg_knock"].paste(black_bg, (x, y), bg_mask)
+
+            # character
+            layers["character"].paste(char_img, (x, y), char_img)
+
+            # logo
+            if logo_img:
+                layers["logos"].paste(logo_img, (x, y), logo_img)
+
+                # logo knockout
+                black_logo = Image.new(layers["logo_knock"].mode, CARD_PX, INK[layers["logo_knock"].mode])
+                layers["logo_knock"].paste(black_logo, (x, y), logo_knock)
+
+            # character knockout
+            if knockout.is_grayscale(knockout_style):
+                # グレースケール白板はアルファ合成
+                if layers["char_knock"].mode == "RGBA":
+                    layers["char_knock"].paste(Image.new("L", CARD_PX, 0), (x, y))
+                    knock_layer = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
+                    knock_layer.paste(Image.new("RGB", CARD_PX, (0, 0, 0)), (0, 0), knock)
+                    layers["char_knock"].alpha_composite(knock_layer, (x, y))
+                else:
+                    layers["char_knock"].paste(255, (x, y, x + CARD_PX[0], y + CARD_PX[1]))
+                    alpha_over(layers["char_knock"], knock, (x, y))
+            else:
+                black = Image.new(layers["char_knock"].mode, CARD_PX, INK[layers["char_knock"].mode])
+                layers["char_knock"].paste(black, (x, y), knock)
 
-        # glare
-        black = Image.new("RGBA", CARD_PX, (0, 0, 0, 255))
-        layers["glare"].paste(black, (x, y), alpha)
+            # cutline
+            bx1, by1, bx2, by2 = cut_rects[i]
+            if draw_cut is not None:
+                draw_cut.rectangle([(bx1, by1), (bx2, by2)], outline=INK[layers["cutline"].mode], width=CUTLINE_PX)
 
-        # cutline
-        bx1 = x - CUTLINE_PX
-        by1 = y - CUTLINE_PX
-        bx2 = x + CARD_PX[0] + CUTLINE_PX - 1
-        by2 = y + CARD_PX[1] + CUTLINE_PX - 1
-        draw_cut.rectangle([(bx1, by1), (bx2, by2)], outline=(0, 0, 0, 255), width=CUTLINE_PX)
+        # glare
+        with metrics.stage("glare", **card_labels):
+            black = Image.new(layers["glare"].mode, CARD_PX, INK[layers["glare"].mode])
+            layers["glare"].paste(black, (x, y), alpha)
 
         # labels
-        key_text = user_name
-        text_img = Image.new("RGBA", (CARD_PX[1], 600), (0, 0, 0, 0))
-        text_draw = ImageDraw.Draw(text_img)
-        try:
-            text_draw.text((20, 300), key_text, fill=(0, 0, 0, 255), font=font)
-        except:
-            pass
-        rotated_text = text_img.rotate(90, expand=True)
-        label_margin = mm_to_px(5)
-        text_width = rotated_text.width
-        text_height = rotated_text.height
-        label_right_shift = 240  # 300pxから60px左へ調整（画像にかぶらないよう）
-        text_x = bx1 - label_margin - text_width + label_right_shift
-        if text_x < 10:
-            text_x = 10
-        text_y = by1 + (by2 - by1) // 2 - text_height // 2
-        layers["labels"].paste(rotated_text, (text_x, text_y), rotated_text)
-
-    # PNG出力
-    for name, img in layers.items():
-        if (name == "logos" or name == "logo_knock") and not any(card.get("logo") for card in page_cards):
-            continue
-        path = f"{output_prefix}_{name}.png"
-        img.save(path, dpi=(DPI, DPI))
+        with metrics.stage("label", **card_labels):
+            label_margin = mm_to_px(5)
+            text_width, text_height = LABEL_FRAME[1], LABEL_FRAME[0]  # 回転後の枠基準で配置
+            label_right_shift = 240  # 300pxから60px左へ調整（画像にかぶらないよう）
+            text_x = bx1 - label_margin - text_width + label_right_shift
+            if text_x < 10:
+                text_x = 10
+            text_y = by1 + (by2 - by1) // 2 - text_height // 2
+            if rotated_text is not None:
+                label_src = ink_source(layers["labels"], rotated_text)
+                layers["labels"].paste(label_src, (text_x + label_dx, text_y + label_dy), label_src)
+
+    # PNG出力（レイヤーごとにスレッドで並列エンコード）
+    with LayerWriter(max_workers=max(WORKER_ENCODE_THREADS, card_workers), compress_level=png_compress, strategy=png_strategy) as writer:
+        has_logo = any(card.get("logo") for card in page_cards)
+        save_layers(
+            writer, layers, output_prefix, DPI,
+            mask_format=mask_format,
+            crop=crop_layers,
+            skip=() if has_logo else ("logos", "logo_knock"),
+            container=container,
+            cut_rects=cut_rects,
+            cutline_px=CUTLINE_PX,
+            cutline_vector=cutline_vector,
+        )
 
     print(f"Page {page_no} completed")
     return page_no
 
+def measure_single_page(args):
+    """process_single_page を計測付きで実行し、(ページ番号, 記録) を返す（--metrics 用）"""
+    recorder = metrics.enable()
+    recorder.drain()  # 同じワーカーで前に処理したページの記録は返却済み
+    with metrics.labels(page=args[0]):
+        page_no = process_single_page(args)
+    return page_no, recorder.drain()
+
+
+def plan_job(image_info: List[Dict], sheet_mm: Tuple[float, float], pagination: str = "orders"):
+    """orderIdごとにまとめてページ計画を作る（画像は読まない）。(ページごとの項目, 1ページの最大枚数)"""
+    grouped_image_info, _ = group_by_order(image_info)
+    # ラベル用マージンを含めた実際の配置で数える
+    sheet_px = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
+    cards_per_page = page_capacity(lambda: sheet_packer(sheet_px))
+    if pagination == "orders":
+        page_items = plan_pages(grouped_image_info, cards_per_page)
+    else:
+        page_items = paginate_items(grouped_image_info, lambda: sheet_packer(sheet_px))
+    return page_items, cards_per_page
+
 def process_pages_parallel(
     image_info: List[Dict],
     sheet_mm: Tuple[float, float],
@@ -304,12 +478,34 @@ def process_pages_parallel(
     output_dir: str = ".",
     knockout_shrink_mm: float = None,
     knockout_mode: str = "normal",
-    max_workers: int = None
+    knockout_style: str = "binary",
+    max_workers: int = None,
+    tile_cache: Optional[DiskTileCache] = None,
+    batch_knockout: bool = False,
+    prefetch_pages: int = 1,
+    shared_tiles: bool = False,
+    card_workers: Optional[int] = None,
+    png_compress: Optional[int] = None,
+    png_strategy: str = "default",
+    mask_format: str = "rgba",
+    crop_layers: bool = False,
+    container: str = "png",
+    cutline_vector: Tuple[str, ...] = (),
+    raster_cutline: bool = True,
+    pagination: str = "orders",
 ):
-    """ページを並列処理"""
+    """ページを並列処理
+
+    親プロセスはページごとの項目リスト（画像パス・amountなど）を投入するだけで、
+    デコード＆リサイズは各ワーカーが行う（プロセス間で画素データを転送しない）。
+    処理待ちのページは max_workers + prefetch_pages 個までに制限する。
+    shared_tiles=True の場合は、複数ページで使われる画像だけ親プロセスで1度リサイズして
+    mmapファイルに置き、各ワーカーはそれをコピーなしで参照する。
+    card_workers は1ページ内のカード処理に使うスレッド数。None の場合はページ数が
+    ワーカー数より少ないとき（1〜2ページの注文など）に余るコアをカード単位の並列処理に回す。
+    pagination は index.py の process_pages と同じ（ページ計画は <output_dir>/page_plan.json）。
+    """
     import os
-    from math import ceil
-    from collections import defaultdict
 
     # CPUコア数に基づいて最適なワーカー数を決定
     if max_workers is None:
@@ -317,77 +513,87 @@ def process_pages_parallel(
 
     print(f"Using {max_workers} parallel workers")
 
-    # orderIdごとにグループ化
-    orders = defaultdict(list)
-    for item in image_info:
-        order_id = item.get("orderId", "no_order")
-        orders[order_id].append(item)
-
-    sorted_order_ids = sorted(orders.keys(), key=lambda x: int(x) if x.isdigit() else float('inf'))
+    # ページ分割（画像は各ワーカーがページごとに読み込む）
+    page_items, cards_per_page = plan_job(image_info, sheet_mm, pagination)
+    os.makedirs(output_dir, exist_ok=True)
+    plan_path = os.path.join(output_dir, PAGE_PLAN_FILE)
+    write_page_plan(plan_path, page_items, pagination, sheet_mm, cards_per_page)
+    total_cards = sum(info.get("amount", 1) for items in page_items for info in items)
+    total_pages = len(page_items)
 
-    grouped_image_info = []
-    for order_id in sorted_order_ids:
-        grouped_image_info.extend(orders[order_id])
+    print(f"合計 {len(image_info)} アイテム → {total_cards} 枚のカード")
+    print(f"{total_pages} ページに分割します（ページ計画: {plan_path}）")
 
-    # カード数計算
-    temp_sheet_px = (mm_to_px(sheet_mm[0]), mm_to_px(sheet_mm[1]))
-    _, rows, cols = grid_layout(sheet_px=temp_sheet_px)
-    cards_per_page = rows * cols
+    if card_workers is None:
+        card_workers = max(1, max_workers // max(1, min(total_pages, max_workers)))
+    if card_workers > 1:
+        print(f"Using {card_workers} threads per page for card processing")
 
-    # 画像を並列で読み込み
+    # ページごとの項目リストをワーカーに投入（処理待ちのページ数は上限まで）
     start_time = time.time()
-    expanded_cards = load_images_parallel(grouped_image_info, max_workers=max_workers)
-    load_time = time.time() - start_time
-    print(f"Image loading completed in {load_time:.2f} seconds")
+    max_pending = max_workers + max(0, prefetch_pages)
+    pending = set()
 
-    # ページ分割
-    total_cards = len(expanded_cards)
-    total_pages = ceil(total_cards / cards_per_page)
+    # 計測が有効なら、ワーカーはページごとの記録を返し、親プロセスの記録にまとめる
+    recorder = metrics.recorder()
+    task = measure_single_page if recorder is not None else process_single_page
 
-    print(f"合計 {len(image_info)} アイテム → {total_cards} 枚のカード")
-    print(f"{total_pages} ページに分割します")
-
-    # ページごとの処理タスクを作成
-    page_tasks = []
-    for page_no in range(1, total_pages + 1):
-        start_idx = (page_no - 1) * cards_per_page
-        end_idx = min(page_no * cards_per_page, total_cards)
-        page_cards = expanded_cards[start_idx:end_idx]
-
-        page_dir = os.path.join(output_dir, f"{page_no}")
-        if not os.path.exists(page_dir):
-            os.makedirs(page_dir, exist_ok=True)
-
-        page_prefix = os.path.join(page_dir, output_prefix)
-        page_tasks.append((
-            page_no, page_cards, sheet_mm, page_prefix,
-            knockout_shrink_mm, knockout_mode
-        ))
-
-    # ページを並列処理
-    process_start = time.time()
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_single_page, task) for task in page_tasks]
-        for future in as_completed(futures):
+    def collect(futures):
+        for future in futures:
             try:
-                page_no = future.result()
+                result = future.result()
+                if recorder is not None:
+                    recorder.extend(result[1])
             except Exception as e:
                 print(f"Error processing page: {e}")
 
-    process_time = time.time() - process_start
+    writer = SharedTileWriter() if shared_tiles else None
+    shared = None
+    try:
+        # 共有タイルの書き出し中に失敗しても、一時ファイルは finally で消す
+        if writer is not None:
+            build_shared_tiles(page_items, ImageCache(disk=tile_cache), writer)
+            shared = writer.close()
+            print(writer.summary())
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for page_no, items in enumerate(page_items, start=1):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                page_dir = os.path.join(output_dir, f"{page_no}")
+                if not os.path.exists(page_dir):
+                    os.makedirs(page_dir, exist_ok=True)
+
+                page_prefix = os.path.join(page_dir, output_prefix)
+                pending.add(executor.submit(task, (
+                    page_no, items, sheet_mm, page_prefix,
+                    knockout_shrink_mm, knockout_mode, knockout_style, tile_cache, batch_knockout, shared, card_workers,
+                    png_compress, png_strategy, mask_format, crop_layers, container,
+                    cutline_vector, raster_cutline
+                )))
+
+            collect(as_completed(pending))
+    finally:
+        if writer is not None:
+            writer.remove()
+
     total_time = time.time() - start_time
 
     print(f"\n処理完了:")
-    print(f"  画像読み込み: {load_time:.2f}秒")
-    print(f"  ページ生成: {process_time:.2f}秒")
     print(f"  合計時間: {total_time:.2f}秒")
+    if tile_cache is not None:
+        print(tile_cache.summary())
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Acrylic Sheet Generator (Parallel)")
     parser.add_argument("--sheet", default="280x580", help="シート寸法 mm")
-    parser.add_argument("--images", required=True, help="JSON")
+    images_group = parser.add_mutually_exclusive_group(required=True)
+    images_group.add_argument("--images", help="JSON")
+    images_group.add_argument("--images-file", help="画像情報のJSON配列またはJSONLファイル（- で標準入力）")
     parser.add_argument("--prefix", default="sheet", help="出力ファイル名前の接頭辞")
     parser.add_argument("--output-dir", default="output", help="出力ディレクトリ")
     parser.add_argument("--one-page", action="store_true", help="ページ分割せず1シートに")
@@ -398,30 +604,112 @@ if __name__ == "__main__":
         default="normal",
         help="白板処理モード"
     )
+    parser.add_argument(
+        "--knockout-style",
+        choices=knockout.available_styles(),
+        default="binary",
+        help="白板スタイル（binary/gradient/hybrid/adaptive/steep* など）"
+    )
     parser.add_argument("--workers", type=int, help="並列ワーカー数（デフォルト: CPUコア数）")
+    parser.add_argument("--pagination", choices=PAGINATION_MODES, default="orders", help="ページ分割の方法（orders=注文をページにまたがせない、fill=注文順に詰める）。計画は <output-dir>/page_plan.json")
+    parser.add_argument("--plan", action="store_true", help="ドライラン。画像はヘッダーだけ読み、ページ計画と時間・メモリ・出力サイズの見積もりを表示（合成はしない）")
+    parser.add_argument("--plan-costs", default=None, help="--plan の見積もりコストを上書きするJSONファイル")
+    parser.add_argument("--batch-knockout", action="store_true", help="ページ内の白板処理を一括実行")
+    parser.add_argument("--prefetch-pages", type=int, default=1, help="ワーカー数に加えて先読みしておくページ数")
+    parser.add_argument("--card-workers", type=int, default=None, help="1ページ内のカード処理スレッド数（デフォルト: ページ数が少ないとき余るコアを使用）")
+    parser.add_argument("--png-compress", type=int, choices=range(0, 10), default=None, metavar="0-9", help="PNGの圧縮レベル（0=最速、9=最小サイズ）")
+    parser.add_argument("--png-strategy", choices=list(PNG_STRATEGIES), default="default", help="PNGのzlib圧縮戦略")
+    parser.add_argument("--mask-layers", choices=MASK_FORMATS, default="rgba", help="マスク系レイヤーの形式（la/gray/bilevel はLモードで合成し、<prefix>_layers.json を出力）")
+    parser.add_argument("--crop-layers", action="store_true", help="空のレイヤーを省き、他は描画範囲に切り抜いて書き出す（位置は <prefix>_layers.json）")
+    parser.add_argument("--container", choices=CONTAINERS, default="png", help="ページの出力形式（tiff=全レイヤーを1つのマルチページTIFFに、pdf=レイヤー付きPDF）")
+    parser.add_argument("--cutline-vector", action="append", choices=VECTOR_FORMATS, default=None, help="カットラインを <prefix>_cutline.svg / .pdf のベクターでも書き出す（両方なら2回指定）")
+    parser.add_argument("--no-raster-cutline", action="store_true", help="ラスタのカットラインレイヤーを作らない（--cutline-vector か --container pdf と併用）")
+    parser.add_argument("--shared-tiles", action="store_true", help="複数ページで使う背景・ロゴを1度だけリサイズしてワーカー間で共有")
+    parser.add_argument("--tile-cache", default=None, help="カード単位の成果物を保存するキャッシュディレクトリ")
+    parser.add_argument("--tile-cache-max-mb", type=int, default=4096, help="タイルキャッシュの容量上限(MB)")
+    parser.add_argument("--metrics", default=None, help="段階ごとの時間とメモリをカード・ページ単位で記録するファイル（.json / .csv / .prom）")
 
     args = parser.parse_args()
+    cutline_vector = tuple(dict.fromkeys(args.cutline_vector or ()))
+    if args.no_raster_cutline and not cutline_vector and args.container != "pdf":
+        parser.error("--no-raster-cutline には --cutline-vector または --container pdf が必要です")
+    if args.prefetch_pages < 0:
+        parser.error("--prefetch-pages は0以上で指定してください")
+    try:
+        plan_costs = load_costs(args.plan_costs)
+    except (OSError, ValueError) as e:
+        parser.error(f"--plan-costs を読めません: {e}")
 
     try:
         w_mm, h_mm = map(float, args.sheet.lower().split("x"))
     except:
         sys.exit("シート寸法は 280x580 のように指定してください。")
 
-    try:
-        image_info = json.loads(args.images)
-    except:
-        sys.exit("--images に JSON 形式でパスを渡してください。")
+    if args.images_file:
+        try:
+            image_info = load_items(args.images_file)
+        except OSError as e:
+            sys.exit(f"--images-file を読めません: {e}")
+        except JobInputError as e:
+            sys.exit(f"--images-file の形式が正しくありません（{e}）")
+    else:
+        try:
+            image_info = json.loads(args.images)
+        except:
+            sys.exit("--images に JSON 形式でパスを渡してください。")
 
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir, exist_ok=True)
 
-    # 並列処理実行
-    process_pages_parallel(
-        image_info=image_info,
-        sheet_mm=(w_mm, h_mm),
-        output_prefix=args.prefix,
-        output_dir=args.output_dir,
-        knockout_shrink_mm=args.knockout_shrink,
-        knockout_mode=args.knockout_mode,
-        max_workers=args.workers
-    )
\ No newline at end of file
+    if args.plan:
+        # ドライラン: 画像はヘッダーだけ読み、ページ計画と見積もりを出して終了
+        page_items, cards_per_page = plan_job(image_info, (w_mm, h_mm), args.pagination)
+        estimate = estimate_job(
+            page_items, (mm_to_px(w_mm), mm_to_px(h_mm)), CARD_PX,
+            mask_format=args.mask_layers,
+            parallel=True,
+            workers=args.workers or min(4, mp.cpu_count()),
+            costs=plan_costs,
+        )
+        print_estimate(estimate)
+        plan_path = os.path.join(args.output_dir, PAGE_PLAN_FILE)
+        write_page_plan(plan_path, page_items, args.pagination, (w_mm, h_mm), cards_per_page, estimate=estimate)
+        print(f"ページ計画: {plan_path}")
+        sys.exit(0)
+
+    if args.metrics:
+        metrics.enable()
+
+    # 途中で失敗しても、それまでの計測結果は書き出す
+    try:
+        tile_cache = None
+        if args.tile_cache:
+            tile_cache = DiskTileCache(args.tile_cache, max_bytes=args.tile_cache_max_mb * 1024 * 1024)
+
+        # 並列処理実行
+        process_pages_parallel(
+            image_info=image_info,
+            sheet_mm=(w_mm, h_mm),
+            output_prefix=args.prefix,
+            output_dir=args.output_dir,
+            knockout_shrink_mm=args.knockout_shrink,
+            knockout_mode=args.knockout_mode,
+            knockout_style=args.knockout_style,
+            max_workers=args.workers,
+            tile_cache=tile_cache,
+            batch_knockout=args.batch_knockout,
+            prefetch_pages=args.prefetch_pages,
+            shared_tiles=args.shared_tiles,
+            card_workers=args.card_workers,
+            png_compress=args.png_compress,
+            png_strategy=args.png_strategy,
+            mask_format=args.mask_layers,
+            crop_layers=args.crop_layers,
+            container=args.container,
+            cutline_vector=cutline_vector,
+            raster_cutline=not args.no_raster_cutline,
+            pagination=args.pagination,
+        )
+    finally:
+        if args.metrics:
+            metrics.finish(args.metrics)
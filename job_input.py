@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# job_input.py - --images-file: 画像情報をファイル（または標準入力）から順に読む
+"""
+--images にJSON文字列を渡すと、大きな注文バッチでは引数の長さ制限（ARG_MAX）に当たり、
+文字列全体とパース結果を同時にメモリに持つことになる。--images-file はファイルを
+少しずつ読みながら項目を1つずつ返すので、ファイル全体を文字列として持たない。
+
+形式は先頭の文字で判定する:
+- "[" で始まればJSON配列（--images と同じ内容）
+- それ以外はJSONL（1行に1項目のオブジェクト、空行は無視）
+
+パスに "-" を渡すと標準入力から読む。
+"""
+import json
+import re
+import sys
+from typing import Dict, Iterator, List, TextIO
+
+CHUNK_CHARS = 1 << 16
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+
+class JobInputError(ValueError):
+    """画像情報ファイルの形式エラー（どこで失敗したかをメッセージに含める）"""
+
+
+def _check_item(item, where: str) -> Dict:
+    if not isinstance(item, dict):
+        raise JobInputError(f"{where}: 項目はオブジェクト（{{\"key\": ..., \"char\": ...}}）で指定してください")
+    return item
+
+
+class _ChunkReader:
+    """テキストをチャンク単位で読み、先頭から消費していくバッファ"""
+
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """バッファに続きを読み足す（読めなければFalse）"""
+        if self.eof:
+            return False
+        chunk = self.f.read(CHUNK_CHARS)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """空白を読み飛ばして次の1文字を返す（終端なら空文字）"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+
+def _iter_array(reader: _ChunkReader, decoder: json.JSONDecoder) -> Iterator[Dict]:
+    """JSON配列の要素を1つずつデコードする（要素がバッファに揃うまで読み足す）"""
+    reader.pos += 1  # "["
+    if reader.peek() == "]":
+        reader.pos += 1
+    else:
+        index = 0
+        while True:
+            if not reader.peek():
+                raise JobInputError(f"item {index}: 配列が閉じられていません")
+            while True:
+                try:
+                    item, end = decoder.raw_decode(reader.buf, reader.pos)
+                except json.JSONDecodeError as e:
+                    if reader.fill():
+                        continue
+                    raise JobInputError(f"item {index}: {e.msg}") from e
+                # 数値などはチャンクの終わりで切れている可能性があるので読み足して確かめる
+                if end == len(reader.buf) and reader.fill():
+                    continue
+                break
+            reader.pos = end
+            yield _check_item(item, f"item {index}")
+            index += 1
+            sep = reader.peek()
+            reader.pos += 1
+            if sep == "]":
+                break
+            if not sep:
+                raise JobInputError(f"item {index}: 配列が閉じられていません")
+            if sep != ",":
+                raise JobInputError(f"item {index}: 区切りの ',' か ']' がありません")
+    if reader.peek():
+        raise JobInputError("配列の後ろに余分なデータがあります")
+
+
+def _lines(reader: _ChunkReader) -> Iterator[str]:
+    """バッファの残りから始めて1行ずつ返す（行の途中で切れたチャンクは次と繋ぐ）"""
+    while True:
+        end = reader.buf.find("\n", reader.pos)
+        if end < 0:
+            if reader.fill():
+                continue
+            if reader.pos < len(reader.buf):
+                yield reader.buf[reader.pos:]
+            return
+        yield reader.buf[reader.pos:end]
+        reader.pos = end + 1
+
+
+def _iter_lines(reader: _ChunkReader, decoder: json.JSONDecoder) -> Iterator[Dict]:
+    """JSONL（1行1項目）を1行ずつデコードする"""
+    for line_no, line in enumerate(_lines(reader), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = decoder.decode(line)
+        except json.JSONDecodeError as e:
+            raise JobInputError(f"line {line_no}: {e.msg}") from e
+        yield _check_item(item, f"line {line_no}")
+
+
+def iter_items(path: str) -> Iterator[Dict]:
+    """画像情報ファイルの項目を順に返す（"-" は標準入力）"""
+    if path == "-":
+        yield from _iter_stream(sys.stdin)
+        return
+    with open(path, "r", encoding="utf-8-sig") as f:
+        yield from _iter_stream(f)
+
+
+def _iter_stream(f: TextIO) -> Iterator[Dict]:
+    reader = _ChunkReader(f)
+    decoder = json.JSONDecoder()
+    if reader.peek() == "[":
+        yield from _iter_array(reader, decoder)
+    else:
+        yield from _iter_lines(reader, decoder)
+
+
+def load_items(path: str) -> List[Dict]:
+    """画像情報ファイルの全項目（ページ計画はorderIdでまとめるため全項目が必要）"""
+    return list(iter_items(path))
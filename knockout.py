@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# knockout.py - 白板（ノックアウト）マスク生成エンジン
+"""
+アルファチャンネルから白板マスクを作る閾値処理を、スタイルごとの256要素LUTで行う。
+
+- 各スタイルは「α値 p と閾値 t から出力値を返す関数」として登録し、
+  (スタイル, 閾値) ごとに1度だけLUTを作ってキャッシュする
+- apply_planes() は (N, H, W) の uint8 配列にまとめて適用できる（ページ単位のバッチ処理用）
+- adaptive のように画像ごとに処理を切り替えるスタイルは、面ごとの統計からLUTを選ぶ
+- knockout_planes() はページ内の全カードを積み重ねた配列に閾値処理・ぼかし・収縮を
+  まとめて適用する（カード単位の処理とピクセル単位で同一の結果）
+
+新しいスタイルは _register() で追加すれば index.py / index_parallel.py の
+--knockout-style でそのまま選択でき、同じ高速パスで処理される。
+"""
+import functools
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# スタイル名 → (p, t) -> 出力値 の関数
+_LUT_FUNCS: Dict[str, Callable[[int, int], int]] = {}
+# 画像ごとにLUTを切り替えるスタイル名 → 面ごとの統計から選ぶ関数
+_SELECTORS: Dict[str, Callable[[np.ndarray, int], List[str]]] = {}
+# グレースケール白板として合成するスタイル（binary以外）
+GRAYSCALE_STYLES = set()
+
+HYBRID_CORE_ALPHA = 200  # hybrid: これより不透明な部分は完全黒
+SMOOTH_RADIUS = 0.3       # 収縮前のぼかし（GaussianBlurの標準偏差）
+GAUSSIAN_PASSES = 3       # PillowのGaussianBlurが内部で使うボックスブラーの回数
+
+
+def _register(name: str, fn: Callable[[int, int], int], grayscale: bool = True):
+    _LUT_FUNCS[name] = fn
+    if grayscale:
+        GRAYSCALE_STYLES.add(name)
+
+
+def _steep(steepness: float) -> Callable[[int, int], int]:
+    """傾斜付きグラデーション: α値がちょっとでもあれば、より強く黒に寄せる"""
+    def steep_func(p: int, t: int) -> int:
+        if p < t:
+            return 0
+        normalized = (p - t) / max(1, 255 - t)
+        steeper = pow(normalized, 1.0 / steepness)
+        return int(min(255, steeper * 255))
+    return steep_func
+
+
+# 完全2値化（従来方式）: 閾値以上 → 完全不透明（白板）
+_register("binary", lambda p, t: 0 if p < t else 255, grayscale=False)
+# グレースケール白板: 透明度を少し強調
+_register("gradient", lambda p, t: 0 if p < t else min(255, int(p * 1.2)))
+# 半透明が多い画像向けの強めのグラデーション（adaptiveで使用）
+_register("gradient_strong", lambda p, t: 0 if p < t else min(255, int(p * 1.5)))
+# αをそのまま使用
+_register("linear", lambda p, t: 0 if p < t else p)
+# ハイブリッド: 中心は黒、エッジは元の透明度を維持
+_register("hybrid", lambda p, t: 255 if p > HYBRID_CORE_ALPHA else (p if p > t else 0))
+_register("steep", _steep(2.5))
+_register("steep_upper1", _steep(3.5))
+_register("steep_upper2", _steep(5.0))
+_register("steep_upper3", _steep(7.0))
+
+
+def _adaptive_select(planes: np.ndarray, t: int) -> List[str]:
+    """アダプティブ: 閾値を超える部分の平均αに応じて面ごとにスタイルを選ぶ"""
+    mask = planes > t
+    counts = mask.sum(axis=(1, 2))
+    sums = np.where(mask, planes, 0).sum(axis=(1, 2), dtype=np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts  # 対象画素がない面はnan → gradient_strong
+    choices = []
+    for mean_alpha in means:
+        if mean_alpha > 200:
+            choices.append("binary")  # 不透明が多い → バイナリ処理
+        elif mean_alpha > 150:
+            choices.append("hybrid")  # 中間 → ハイブリッド
+        else:
+            choices.append("gradient_strong")  # 半透明が多い → グラデーション
+    return choices
+
+
+_SELECTORS["adaptive"] = _adaptive_select
+GRAYSCALE_STYLES.add("adaptive")
+
+
+def available_styles() -> List[str]:
+    """--knockout-style で選択できるスタイル名"""
+    return list(_LUT_FUNCS) + list(_SELECTORS)
+
+
+def is_grayscale(style: str) -> bool:
+    """グレースケール白板（アルファ合成）として扱うスタイルか"""
+    return style in GRAYSCALE_STYLES
+
+
+@functools.lru_cache(maxsize=None)
+def lut(style: str, threshold: int) -> np.ndarray:
+    """(スタイル, 閾値) の256要素LUT（uint8）"""
+    if style not in _LUT_FUNCS:
+        raise ValueError(f"Unknown knockout style: {style}")
+    table = np.array([_LUT_FUNCS[style](p, threshold) for p in range(256)], dtype=np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+def apply_planes(planes: np.ndarray, style: str, threshold: int) -> np.ndarray:
+    """uint8のα面（(H, W) または (N, H, W)）にまとめて閾値処理を適用する"""
+    if style in _SELECTORS:
+        stack = planes if planes.ndim == 3 else planes[np.newaxis]
+        choices = _SELECTORS[style](stack, threshold)
+        names = sorted(set(choices))
+        tables = np.stack([lut(name, threshold) for name in names])
+        idx = np.array([names.index(c) for c in choices], dtype=np.intp)
+        out = tables[idx[:, np.newaxis, np.newaxis], stack]
+        return out if planes.ndim == 3 else out[0]
+    return lut(style, threshold)[planes]
+
+
+def apply_knockout(alpha: Image.Image, style: str, threshold: int) -> Image.Image:
+    """単一のアルファチャンネル（L）に閾値処理を適用する"""
+    out = apply_planes(np.asarray(alpha), style, threshold)
+    return Image.fromarray(out)  # uint8の2次元配列は L モード
+
+
+def gaussian_box_radius(sigma: float, passes: int = GAUSSIAN_PASSES) -> float:
+    """PillowのGaussianBlurが内部で使うボックスブラー半径（Cと同じfloat32で計算）"""
+    f = np.float32
+    sigma2 = f(sigma) * f(sigma) / f(passes)
+    box_len = f(np.sqrt(f(12.0) * sigma2 + f(1.0)))
+    l = f(np.floor((box_len - f(1.0)) / f(2.0)))
+    a = (f(2) * l + f(1)) * (l * (l + f(1)) - f(3) * sigma2)
+    a = a / (f(6) * (sigma2 - (l + f(1)) * (l + f(1))))
+    return float(f(l + a))
+
+
+def gaussian_blur_planes(planes: np.ndarray, sigma: float, passes: int = GAUSSIAN_PASSES) -> np.ndarray:
+    """(N, H, W) の各面に GaussianBlur(sigma) と同一の処理をまとめて適用する
+
+    PillowのGaussianBlurは「横方向のボックスブラー×passes → 縦方向×passes」で、
+    各パスで行・列の端をクランプする。面を縦に積めば行は独立、横に並べれば列は独立なので、
+    積み重ねた1枚の画像に片方向のBoxBlurをかけても面ごとの処理と同じ結果になる。
+    """
+    radius = gaussian_box_radius(sigma, passes)
+    n, h, w = planes.shape
+    # 横方向: 面を縦に積む（(N*H, W)）
+    im = Image.fromarray(np.ascontiguousarray(planes).reshape(n * h, w))
+    for _ in range(passes):
+        im = im.filter(ImageFilter.BoxBlur((radius, 0)))
+    # 縦方向: 面を横に並べる（(H, N*W)）
+    side_by_side = np.asarray(im).reshape(n, h, w).transpose(1, 0, 2).reshape(h, n * w)
+    im = Image.fromarray(np.ascontiguousarray(side_by_side))
+    for _ in range(passes):
+        im = im.filter(ImageFilter.BoxBlur((0, radius)))
+    return np.ascontiguousarray(np.asarray(im).reshape(h, n, w).transpose(1, 0, 2))
+
+
+def _min_filter_1d(planes: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """1方向の最小値フィルタ（窓幅 2*radius+1、端は複製）
+
+    van Herk / Gil-Werman法: 窓幅ごとのブロック内で前方・後方の累積最小を取り、
+    2つの値の最小で窓全体の最小を得る。コストは半径によらず1画素あたり一定。
+    """
+    k = 2 * radius + 1
+    a = np.moveaxis(planes, axis, -1)
+    n = a.shape[-1]
+    nblocks = -(-(n + 2 * radius) // k)
+    total = nblocks * k
+    pad = [(0, 0)] * (a.ndim - 1) + [(radius, total - n - radius)]
+    blocks = np.pad(a, pad, mode="edge").reshape(a.shape[:-1] + (nblocks, k))
+    prefix = np.minimum.accumulate(blocks, axis=-1).reshape(a.shape[:-1] + (total,))
+    suffix = np.minimum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(a.shape[:-1] + (total,))
+    out = np.minimum(suffix[..., :n], prefix[..., k - 1:k - 1 + n])
+    return np.ascontiguousarray(np.moveaxis(out, -1, axis))
+
+
+def erode_planes(planes: np.ndarray, radius: int) -> np.ndarray:
+    """(H, W) または (N, H, W) の各面を半径radius画素だけ収縮する（(2r+1)角の最小値フィルタ）
+
+    radius=1 は MinFilter(3) と同一。縦横に分離して計算するため、半径を大きくしても
+    コストはほぼ変わらない（厚いアクリル向けの大きな白板インセットでも高速）。
+    """
+    if radius <= 0:
+        return planes
+    out = planes
+    for axis in (planes.ndim - 2, planes.ndim - 1):
+        out = _min_filter_1d(out, radius, axis)
+    return out
+
+
+def erode(mask: Image.Image, radius: int) -> Image.Image:
+    """Lモードのマスク画像を半径radius画素だけ収縮する"""
+    if radius <= 0:
+        return mask
+    return Image.fromarray(erode_planes(np.asarray(mask), radius))
+
+
+def knockout_planes(planes: np.ndarray, style: str, threshold: int, shrink_px: int) -> np.ndarray:
+    """(N, H, W) のα面から白板マスクを一括生成する（閾値処理 → ぼかし → shrink_px画素の収縮）"""
+    out = apply_planes(planes, style, threshold)
+    if shrink_px > 0:
+        out = gaussian_blur_planes(out, SMOOTH_RADIUS)
+        out = erode_planes(out, shrink_px)
+    return out
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# label_cache.py - ユーザー名ラベルの描画キャッシュ
+"""
+カード左に置く縦書きラベル（userNameを90度回転したもの）を描画して使い回す。
+
+- フォントはプロセスごとに1度だけ読み込む（load_label_font）
+- 描画結果は (テキスト, フォント, サイズ) をキーに保持し、amount > 1 の項目や
+  同じユーザー名が続く注文では描画・回転をやり直さない
+- 文字のある範囲（バウンディングボックス）だけの画像に描いてtransposeで回転する。
+  従来の「1024x600の画像に描いて rotate(90, expand=True)」と画素単位で同じ結果になり、
+  返すオフセットはその回転後の画像（600x1024）の中での位置
+"""
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+LABEL_FONT_SIZE = 100
+# 利用可能な日本語フォント（先頭から順に試す）
+LABEL_FONTS = (
+    "/System/Library/Fonts/Hiragino Sans GB.ttc",
+    "/System/Library/Fonts/PingFang.ttc",  # 中国語フォントだが日本語も表示可能
+    "/System/Library/Fonts/STHeiti Light.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+)
+FALLBACK_FONT = "/System/Library/Fonts/Helvetica.ttc"
+DEFAULT_MAX_ENTRIES = 4096
+
+Label = Tuple[Optional[Image.Image], Tuple[int, int]]
+
+
+@lru_cache(maxsize=None)
+def load_label_font(font_size: int = LABEL_FONT_SIZE):
+    """ラベル用フォントを読み込む（プロセスごとに1度）。(フォント, フォント名) を返す"""
+    for font_path in LABEL_FONTS:
+        try:
+            font = ImageFont.truetype(font_path, font_size, index=0)
+            print(f"Using font: {font_path}")
+            return font, font_path
+        except Exception:
+            continue
+    try:
+        font = ImageFont.truetype(FALLBACK_FONT, font_size)
+        print("Warning: Using Helvetica font - Japanese characters may not display correctly")
+        return font, FALLBACK_FONT
+    except IOError:
+        print("Warning: Using default font - Japanese characters will not display correctly")
+        return ImageFont.load_default(), "default"
+
+
+def render_label(text: str, font, frame_size: Tuple[int, int], origin: Tuple[int, int], anchor: Optional[str] = None) -> Label:
+    """textを90度回転したラベル画像（文字のある範囲だけ）と、回転後の枠内での左上位置を返す
+
+    frame_sizeは回転前の描画枠、originはその中の描画位置。文字がなければ画像はNone。
+    """
+    w, h = frame_size
+    x0, y0 = origin
+    try:
+        l, t, r, b = font.getbbox(text, anchor=anchor)
+    except (AttributeError, TypeError, ValueError):
+        # getbboxのない古いPillow・anchor非対応のフォントは枠全体に描いてから切り抜く
+        frame = Image.new("RGBA", frame_size, (0, 0, 0, 0))
+        try:
+            ImageDraw.Draw(frame).text(origin, text, fill=(0, 0, 0, 255), font=font, anchor=anchor)
+        except (TypeError, ValueError):
+            ImageDraw.Draw(frame).text(origin, text, fill=(0, 0, 0, 255), font=font)
+        box = frame.getchannel("A").getbbox()
+        if box is None:
+            return None, (0, 0)
+        return frame.crop(box).transpose(Image.Transpose.ROTATE_90), (box[1], w - box[2])
+
+    box = (max(0, x0 + l), max(0, y0 + t), min(w, x0 + r), min(h, y0 + b))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None, (0, 0)
+    img = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((x0 - box[0], y0 - box[1]), text, fill=(0, 0, 0, 255), font=font, anchor=anchor)
+    # 反時計回り90度: 枠内の (x, y) は回転後 (y, w - 1 - x) に移る
+    return img.transpose(Image.Transpose.ROTATE_90), (box[1], w - box[2])
+
+
+class LabelCache:
+    """描画済みラベルを (テキスト, フォント, サイズ) ごとに保持する（スレッドセーフ）
+
+    FreeTypeのフォントはスレッド間で同時に使わないよう、描画はロックの中で行う。
+    返す画像は共有されるので呼び出し側で変更しないこと。
+    """
+
+    def __init__(
+        self,
+        frame_size: Tuple[int, int],
+        origin: Tuple[int, int],
+        anchor: Optional[str] = None,
+        font_size: int = LABEL_FONT_SIZE,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.frame_size = frame_size
+        self.rotated_size = (frame_size[1], frame_size[0])
+        self.origin = origin
+        self.anchor = anchor
+        self.font_size = font_size
+        self.font, self.font_name = load_label_font(font_size)
+        self.max_entries = max(1, max_entries)
+        self._items: "OrderedDict[tuple, Label]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Label:
+        key = (text, self.font_name, self.font_size)
+        with self._lock:
+            label = self._items.get(key)
+            if label is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return label
+            self.misses += 1
+            label = render_label(text, self.font, self.frame_size, self.origin, self.anchor)
+            self._items[key] = label
+            if len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+            return label
+
+    def summary(self) -> str:
+        return f"Label cache: hits={self.hits} misses={self.misses} entries={len(self._items)}"
+
+
+@lru_cache(maxsize=None)
+def label_cache(frame_size: Tuple[int, int], origin: Tuple[int, int], anchor: Optional[str] = None) -> LabelCache:
+    """プロセス内で共有するラベルキャッシュ（同じ描画設定なら同じインスタンス）"""
+    return LabelCache(frame_size, origin, anchor)
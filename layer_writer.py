@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# layer_writer.py - レイヤーPNGの並列書き出し
+"""
+シート1枚分のレイヤー（フルサイズRGBA×最大9枚）のPNGエンコードをスレッドプールで行う。
+
+- PillowのPNGエンコード（zlib）はGILを解放するので、スレッドで複数レイヤーを同時に圧縮できる
+- save() はキューに積んですぐ戻るため、呼び出し側は次のページの合成に進める
+  （ページNのエンコードとページN+1の合成が重なる）
+- 未完了の書き出しは max_pending 枚までに制限し、それ以上は空きが出るまで待つ
+  （フルサイズのレイヤーを何ページ分も抱え込まないため）
+
+圧縮レベル（0〜9）とzlibの圧縮戦略は --png-compress / --png-strategy で指定する。
+
+マスク系レイヤー（MASK_LAYERS）は色が常に黒でαだけが情報なので、--mask-layers を
+指定するとメモリ上は L（α＝インク濃度）で持ち、出力時に次の形式へ変換する。
+
+- la:      黒＋αのグレースケールPNG（透明背景。既存のjsx・makePSD.jsでそのまま読める）
+- gray:    白地に黒インクのグレースケールPNG（値 = 255 - α）
+- bilevel: 白地に黒インクの1bit PNG（0/255だけのレイヤー。中間調を含むものは gray）
+
+gray / bilevel は不透明な白地になるため、取り込み側は <prefix>_layers.json の
+"paper": "white" を見て乗算で重ねること。
+
+--crop-layers を指定すると、何も描かれていないレイヤーは書き出さず、それ以外は
+インクのある範囲（バウンディングボックス）に切り抜いて書き出す。シート上の位置は
+マニフェストの "offset"（左上のpx座標）と "size" に記録する。
+
+--container tiff を指定すると、ページの全レイヤーを1つのマルチページTIFF
+（<prefix>.tif、1レイヤー＝1フレーム）にストリップ単位で順に書き出す。各フレームには
+PageNameタグにレイヤー名、XPosition/YPositionタグにシート上の位置を入れる。
+圧縮はDeflate（1bitのフレームはCCITT G4）。マニフェストの "frame" がフレーム番号。
+
+--container pdf を指定すると、レイヤーごとのOCGを持つPDF（<prefix>.pdf、pdf_writer.py）を
+書き出す。カットラインは cut_rects からベクターパスとして描く。
+
+--cutline-vector svg/pdf を指定すると、カットラインを cut_rects から <prefix>_cutline.svg /
+<prefix>_cutline.pdf にも書き出す（cutline.py）。--no-raster-cutline と組み合わせると
+cutlineのラスタレイヤーは作らず、マニフェストの cutline は "vector": true になる。
+"""
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps, TiffImagePlugin
+
+from cutline import VECTOR_FORMATS, write_cutline
+import metrics
+from pdf_writer import write_layered_pdf
+
+# --png-strategy の値 → zlibの圧縮戦略（Pillowの compress_type）
+PNG_STRATEGIES = {
+    "default": 0,   # Z_DEFAULT_STRATEGY
+    "filtered": 1,  # Z_FILTERED
+    "huffman": 2,   # Z_HUFFMAN_ONLY（最速・圧縮率は低い）
+    "rle": 3,       # Z_RLE（透明部分の多いレイヤー向け）
+    "fixed": 4,     # Z_FIXED
+}
+DEFAULT_ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+LAYERS_PER_PAGE = 9
+DEFAULT_MAX_PENDING = LAYERS_PER_PAGE  # 1ページ分まで先行して合成を進められる
+
+
+# 色が常に黒でαだけが情報を持つレイヤー
+MASK_LAYERS = ("cutline", "glare", "logo_knock", "char_knock", "bg_knock", "labels")
+MASK_FORMATS = ("rgba", "la", "gray", "bilevel")
+INK = {"RGBA": (0, 0, 0, 255), "L": 255}  # レイヤーのモードごとの「黒インク」の値
+MANIFEST_VERSION = 1
+CONTAINERS = ("png", "tiff", "pdf")
+TIFF_COMPRESSION = "tiff_adobe_deflate"
+TIFF_BILEVEL_COMPRESSION = "group4"  # CCITT G4
+TIFF_PAGE_NAME = 285  # PageName
+TIFF_X_POSITION = 286  # XPosition（インチ）
+TIFF_Y_POSITION = 287  # YPosition（インチ）
+
+
+def layer_mode(name: str, mask_format: str = "rgba") -> str:
+    """レイヤーのメモリ上のモード（マスク系レイヤーは mask_format が rgba 以外なら L）"""
+    return "L" if mask_format != "rgba" and name in MASK_LAYERS else "RGBA"
+
+
+def new_layer(name: str, size: Tuple[int, int], mask_format: str = "rgba") -> Image.Image:
+    """空のレイヤー（RGBAは透明、Lはインクなし）"""
+    mode = layer_mode(name, mask_format)
+    return Image.new(mode, size, (0, 0, 0, 0) if mode == "RGBA" else 0)
+
+
+def ink_source(layer: Image.Image, im: Image.Image) -> Image.Image:
+    """黒インクの画像imをlayerに貼るときのソース（Lレイヤーにはαだけを渡す）"""
+    return im if layer.mode == "RGBA" else im.getchannel("A")
+
+
+def alpha_over(layer: Image.Image, src_alpha: Image.Image, xy: Tuple[int, int]):
+    """Lレイヤーに黒インク（α=src_alpha）を重ねる（Image.alpha_compositeのα計算と同一）"""
+    x, y = xy
+    w, h = src_alpha.size
+    box = (x, y, x + w, y + h)
+    dst = np.asarray(layer.crop(box), dtype=np.uint32)
+    src = np.asarray(src_alpha, dtype=np.uint32)
+    tmp = src * 255 + dst * (255 - src) + 0x80
+    out = ((tmp >> 8) + tmp) >> 8
+    layer.paste(Image.fromarray(out.astype(np.uint8)), box)
+
+
+def export_layer(img: Image.Image, mask_format: str = "rgba") -> Tuple[Optional[Callable[[], Image.Image]], Dict]:
+    """レイヤーの出力形式を決める
+
+    (書き出し直前に呼ぶ変換関数 または None, マニフェストの項目) を返す。
+    変換はLayerWriterのスレッドで行う。
+    """
+    if img.mode == "RGBA":
+        return None, {"mode": "RGBA", "paper": "transparent"}
+    if mask_format == "la":
+        return (lambda: Image.merge("LA", (Image.new("L", img.size, 0), img))), {"mode": "LA", "paper": "transparent"}
+    hist = img.histogram()
+    if mask_format == "bilevel" and sum(hist[1:255]) == 0:
+        return (lambda: ImageOps.invert(img).convert("1", dither=Image.Dither.NONE)), {"mode": "1", "paper": "white"}
+    return (lambda: ImageOps.invert(img)), {"mode": "L", "paper": "white"}
+
+
+def layer_bbox(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """インクのある範囲 (left, top, right, bottom)。何も描かれていなければNone"""
+    return (img.getchannel("A") if img.mode == "RGBA" else img).getbbox()
+
+
+def write_manifest(
+    path: str,
+    size: Tuple[int, int],
+    dpi: int,
+    mask_format: str,
+    layers: Dict[str, Dict],
+    cropped: bool = False,
+):
+    """ページのレイヤー構成（ファイル名・形式・地の色・配置）をJSONで書き出す"""
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "size": list(size),
+        "dpi": dpi,
+        "mask_format": mask_format,
+        "cropped": cropped,
+        "ink": "black",
+        "layers": layers,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def save_layers(
+    writer: "LayerWriter",
+    layers: Dict[str, Image.Image],
+    output_prefix: str,
+    dpi: int,
+    mask_format: str = "rgba",
+    crop: bool = False,
+    skip: Tuple[str, ...] = (),
+    container: str = "png",
+    cut_rects: Optional[List[Tuple[int, int, int, int]]] = None,
+    cutline_px: int = 0,
+    cutline_vector: Tuple[str, ...] = (),
+) -> Optional[Dict[str, Dict]]:
+    """ページのレイヤーを <output_prefix>_<name>.png に書き出す（書き出しはwriterのスレッド）
+
+    containerがtiffの場合は全レイヤーを <output_prefix>.tif の各フレームとして書き出す。
+    containerがpdfの場合は <output_prefix>.pdf に書き出す（描画範囲への切り抜きは常に行い、
+    cut_rectsがあればカットラインはベクターで描く）。
+    mask_formatがrgba以外・cropの場合・tiffの場合は <output_prefix>_layers.json も書き出し、
+    そのレイヤー項目を返す。skipのレイヤーは書き出さない（マニフェストにも載せない）。
+    cutline_vectorの形式（svg/pdf）ごとに <output_prefix>_cutline.<形式> をcut_rectsから書き出す
+    （この場合もマニフェストを書き出す）。layersにcutlineがなければラスタのカットラインは出さない。
+    """
+    if container not in CONTAINERS:
+        raise ValueError(f"Unknown layer container: {container}")
+    for fmt in cutline_vector:
+        if fmt not in VECTOR_FORMATS:
+            raise ValueError(f"Unknown cutline format: {fmt}")
+    if cutline_vector and cut_rects is None:
+        raise ValueError("cut_rects is required for vector cutline output")
+    sheet_size = next(iter(layers.values())).size
+    manifest_layers: Dict[str, Dict] = {}
+    tiff_frames = []
+    pdf_layers = []
+    for name, img in layers.items():
+        if name in skip:
+            continue
+        box = (0, 0) + img.size
+        if crop or container == "pdf":
+            box = layer_bbox(img)
+            if box is None:
+                manifest_layers[name] = {"empty": True}
+                # 以前の実行で書き出した同名ファイルが残っていると取り込み側が誤って使うため削除
+                stale = f"{output_prefix}_{name}.png"
+                if container == "png" and os.path.exists(stale):
+                    os.remove(stale)
+                continue
+            if box != (0, 0) + img.size:
+                img = img.crop(box)
+        placement = {"offset": [box[0], box[1]], "size": [box[2] - box[0], box[3] - box[1]]}
+        if container == "pdf":
+            pdf_layers.append((name, img, box[:2]))
+            manifest_layers[name] = dict(file=os.path.basename(f"{output_prefix}.pdf"), ocg=name, **placement)
+            continue
+        convert, entry = export_layer(img, mask_format)
+        if container == "tiff":
+            tiff_frames.append((name, img, convert, box[:2]))
+            manifest_layers[name] = dict(entry, file=os.path.basename(f"{output_prefix}.tif"),
+                                         frame=len(tiff_frames) - 1, **placement)
+            continue
+        path = f"{output_prefix}_{name}.png"
+        writer.save(img, path, dpi=(dpi, dpi), convert=convert)
+        manifest_layers[name] = dict(entry, file=os.path.basename(path), **placement)
+    if "cutline" not in layers and container == "png":
+        # ラスタのカットラインを省略した場合、以前の実行のPNGが残っていれば削除
+        stale = f"{output_prefix}_cutline.png"
+        if os.path.exists(stale):
+            os.remove(stale)
+    vector_files = []
+    for fmt in cutline_vector:
+        path = f"{output_prefix}_cutline.{fmt}"
+        write_cutline(path, fmt, cut_rects, sheet_size, dpi, cutline_px)
+        print(f"Saved: {path}")
+        vector_files.append(os.path.basename(path))
+    if vector_files:
+        manifest_layers.setdefault("cutline", {"vector": True})["vector_files"] = vector_files
+    if tiff_frames:
+        writer.save_tiff(tiff_frames, f"{output_prefix}.tif", dpi=(dpi, dpi))
+    if container == "pdf":
+        if cut_rects is not None:
+            manifest_layers["cutline"] = dict(file=os.path.basename(f"{output_prefix}.pdf"), ocg="cutline", vector=True)
+            if vector_files:
+                manifest_layers["cutline"]["vector_files"] = vector_files
+        writer.save_pdf(pdf_layers, f"{output_prefix}.pdf", sheet_size, dpi, cut_rects, cutline_px)
+    if mask_format == "rgba" and not crop and container == "png" and not vector_files:
+        return None
+    write_manifest(f"{output_prefix}_layers.json", sheet_size, dpi, mask_format, manifest_layers,
+                   cropped=crop or container == "pdf")
+    return manifest_layers
+
+
+class LayerWriter:
+    """レイヤー画像をスレッドプールでPNGに書き出す
+
+    with文で使うと、抜けるときに全ての書き出しの完了を待つ（例外で抜けたときは未着手の書き出しを取り消す）。
+    書き出し中の画像は呼び出し側で変更しないこと。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_ENCODE_WORKERS,
+        compress_level: Optional[int] = None,
+        strategy: str = "default",
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        if compress_level is not None and not 0 <= compress_level <= 9:
+            raise ValueError(f"PNG compress level must be 0-9: {compress_level}")
+        if strategy not in PNG_STRATEGIES:
+            raise ValueError(f"Unknown PNG strategy: {strategy}")
+        self.save_options = {}
+        if compress_level is not None:
+            self.save_options["compress_level"] = compress_level
+        if strategy != "default":
+            self.save_options["compress_type"] = PNG_STRATEGIES[strategy]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._max_pending = max(1, max_pending)
+        self._slots = threading.Semaphore(self._max_pending)
+        self._futures: List[Future] = []
+
+    def save(
+        self,
+        img: Image.Image,
+        path: str,
+        dpi: Tuple[int, int],
+        convert: Optional[Callable[[], Image.Image]] = None,
+    ) -> Future:
+        """imgをpathに書き出すタスクを積む（未完了がmax_pending枚に達していれば空くまで待つ）
+
+        convertを渡すと、書き出しスレッドでconvert()の結果をimgの代わりに保存する。
+        """
+        return self._submit(1, self._save, img, path, dpi, convert)
+
+    def save_tiff(self, frames: List[Tuple], path: str, dpi: Tuple[int, int]) -> Future:
+        """(レイヤー名, 画像, 変換関数, (x, y)) のリストを1つのマルチページTIFFに書き出すタスクを積む"""
+        return self._submit(len(frames), self._save_tiff, frames, path, dpi)
+
+    def save_pdf(
+        self,
+        layers: List[Tuple],
+        path: str,
+        sheet_size: Tuple[int, int],
+        dpi: int,
+        cut_rects: Optional[List[Tuple[int, int, int, int]]] = None,
+        cutline_px: int = 0,
+    ) -> Future:
+        """(レイヤー名, 画像, (x, y)) のリストをレイヤー付きPDFに書き出すタスクを積む"""
+        return self._submit(len(layers), self._save_pdf, layers, path, sheet_size, dpi, cut_rects, cutline_px)
+
+    def _save_pdf(self, layers, path, sheet_size, dpi, cut_rects, cutline_px) -> str:
+        level = self.save_options.get("compress_level", 6)
+        with metrics.stage("pdf_encode", file=os.path.basename(path)):
+            write_layered_pdf(path, sheet_size, dpi, layers, cut_rects=cut_rects, cutline_px=cutline_px, level=level)
+        print("Saved:", path)
+        return path
+
+    def _submit(self, weight: int, fn, *args) -> Future:
+        # 未完了のレイヤー枚数がmax_pendingを超えないよう、レイヤー数分の枠を確保する
+        weight = min(weight, self._max_pending)
+        acquired = 0
+        try:
+            for _ in range(weight):
+                self._slots.acquire()
+                acquired += 1
+            future = self._executor.submit(metrics.bind(fn), *args)  # 計測時は投入元のpageなどのラベルを引き継ぐ
+        except BaseException:
+            for _ in range(acquired):
+                self._slots.release()
+            raise
+        future.add_done_callback(lambda _: [self._slots.release() for _ in range(weight)])
+        self._futures.append(future)
+        return future
+
+    def _save(self, img: Image.Image, path: str, dpi: Tuple[int, int], convert=None) -> str:
+        with metrics.stage("png_encode", file=os.path.basename(path)):
+            if convert is not None:
+                img = convert()
+            img.save(path, dpi=dpi, **self.save_options)
+        print("Saved:", path)
+        return path
+
+    def _save_tiff(self, frames: List[Tuple], path: str, dpi: Tuple[int, int]) -> str:
+        with metrics.stage("tiff_encode", file=os.path.basename(path)), \
+                open(path, "w+b") as fp, TiffImagePlugin.AppendingTiffWriter(fp, new=True) as tf:
+            for name, img, convert, (x, y) in frames:
+                if convert is not None:
+                    img = convert()
+                img.save(
+                    tf, format="TIFF", dpi=dpi,
+                    compression=TIFF_BILEVEL_COMPRESSION if img.mode == "1" else TIFF_COMPRESSION,
+                    tiffinfo={TIFF_PAGE_NAME: name, TIFF_X_POSITION: x / dpi[0], TIFF_Y_POSITION: y / dpi[1]},
+                )
+                tf.newFrame()
+        print("Saved:", path)
+        return path
+
+    def wait(self):
+        """積まれた書き出しが全て終わるまで待つ（失敗があれば例外を送出）"""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        """まだ始まっていない書き出しを取り消して終了する（合成が途中で失敗したとき）
+
+        実行中の書き出しは終わるまで待つ。失敗は送出しない（元の例外を優先する）。
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# layout.py - カードの面付け（シート上の配置とページ分割）
+"""
+カードをシートの左上から行（シェルフ）単位で詰めて配置し、入りきらなくなったら次のページに送る。
+
+配置（make_sheet_layers）とページ分割（process_pages）を同じパッカーで計算するので、
+左側のラベル用マージンを含めて「ページに割り当てた枚数が必ずそのシートに入る」。
+以前はページ分割だけラベル用マージンなしの grid_layout で枚数を数えていたため、
+シート幅によってはページに入りきらずエラーになることがあった。
+
+- カードごとに大きさを変えられる（card_size）。全カード同じ大きさなら grid_layout と同じ座標
+- 並び順は変えない（orderIdでまとめた順のまま詰めるので、同じ注文のカードは隣り合う）
+- amountがページ境界をまたぐ項目は、各ページに入る枚数分のamountに分割する
+
+plan_pages は注文（orderId）を分けられない単位としてページに割り当てる（--pagination orders）。
+1ページに入りきらない注文だけを分割し、それ以外は空きの一番少ない入るページに置く（best fit）。
+ページごとの空き枚数で索引するので計画は O(項目数) で済み、画像を読む前に
+ページ計画（page_plan.json）を書き出せる。
+"""
+import json
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+Size = Tuple[int, int]
+Position = Tuple[int, int]
+
+
+class ShelfPacker:
+    """1シート分の配置を順に決める（左から右へ詰め、入らなければ次の行へ）
+
+    各カードの外側にはborder_px（カットライン幅）の枠、カード同士の間にはspacing_pxをとる。
+    行の高さはその行で一番高いカードに合わせる。行の先頭・シートの先頭の行は
+    はみ出しても置く（grid_layoutの最低1列・1行と同じ）。
+    """
+
+    def __init__(
+        self,
+        sheet_px: Size,
+        card_px: Size,
+        margin_px: int,
+        spacing_px: int,
+        border_px: int,
+        left_margin_px: Optional[int] = None,
+    ):
+        self.card_px = card_px
+        self.spacing_px = spacing_px
+        self.border_px = border_px
+        self.left = margin_px if left_margin_px is None else left_margin_px
+        self.right = sheet_px[0] - margin_px
+        self.top = margin_px
+        self.bottom = sheet_px[1] - margin_px
+        self.positions: List[Position] = []
+        self.full = False
+        self._x = self.left
+        self._y = self.top
+        self._shelf_h = 0
+
+    def place(self, card_px: Optional[Size] = None) -> Optional[Position]:
+        """次のカードのカード左上座標を返す（シートに入らなければNone。以降も入れない）"""
+        if self.full:
+            return None
+        w, h = card_px or self.card_px
+        fw, fh = w + self.border_px * 2, h + self.border_px * 2
+        if self._x > self.left and self._x + fw > self.right:
+            self._x = self.left
+            self._y += self._shelf_h + self.spacing_px
+            self._shelf_h = 0
+        if self._y > self.top and self._y + fh > self.bottom:
+            self.full = True
+            return None
+        pos = (self._x + self.border_px, self._y + self.border_px)
+        self._x += fw + self.spacing_px
+        self._shelf_h = max(self._shelf_h, fh)
+        self.positions.append(pos)
+        return pos
+
+
+def sheet_layout(packer: ShelfPacker, card_sizes: Sequence[Size]) -> List[Position]:
+    """card_sizesの順にカードを配置した座標（入りきらなかったカード以降は含まない）"""
+    positions = []
+    for size in card_sizes:
+        pos = packer.place(size)
+        if pos is None:
+            break
+        positions.append(pos)
+    return positions
+
+
+def paginate_items(
+    image_info: List[Dict],
+    new_packer: Callable[[], ShelfPacker],
+    card_size: Optional[Callable[[Dict], Size]] = None,
+) -> List[List[Dict]]:
+    """画像情報を、実際の配置で入る枚数ごとのページに分ける（画像はまだ読み込まない）
+
+    new_packerは空のシート1枚分のパッカーを返す関数。card_sizeは項目ごとのカードの大きさ
+    （省略時はパッカーのcard_px）。amountがページ境界をまたぐ項目は分割する。
+    """
+    pages: List[List[Dict]] = [[]]
+    packer = new_packer()
+    for info in image_info:
+        size = card_size(info) if card_size else None
+        remaining = info.get("amount", 1)
+        while remaining > 0:
+            n = 0
+            while n < remaining and packer.place(size) is not None:
+                n += 1
+            if n:
+                pages[-1].append(dict(info, amount=n))
+                remaining -= n
+            if remaining:
+                pages.append([])
+                packer = new_packer()
+    return [page for page in pages if page]
+
+
+PAGINATION_MODES = ("orders", "fill")
+PAGE_PLAN_FILE = "page_plan.json"
+PAGE_PLAN_VERSION = 1
+
+
+def group_by_order(image_info: List[Dict]) -> Tuple[List[Dict], List[str]]:
+    """項目をorderIdごとにまとめて並べ直す（数字のorderIdは数値順、それ以外は最後）
+
+    (並べ直した項目, orderIdの並び) を返す。orderIdのない項目は "no_order" として扱う。
+    """
+    orders: Dict[str, List[Dict]] = defaultdict(list)
+    for item in image_info:
+        orders[item.get("orderId", "no_order")].append(item)
+    sorted_order_ids = sorted(orders.keys(), key=lambda x: int(x) if x.isdigit() else float('inf'))
+    grouped = [item for order_id in sorted_order_ids for item in orders[order_id]]
+    return grouped, sorted_order_ids
+
+
+def page_capacity(new_packer: Callable[[], ShelfPacker]) -> int:
+    """空のシート1枚に入るカードの枚数（パッカーのcard_pxで数える）"""
+    packer = new_packer()
+    while packer.place() is not None:
+        pass
+    return len(packer.positions)
+
+
+def _order_groups(image_info: List[Dict]) -> Iterator[List[Dict]]:
+    """連続する同じorderIdの項目をまとめて返す（orderIdのない項目はそれぞれ単独）"""
+    group: List[Dict] = []
+    for info in image_info:
+        order_id = info.get("orderId")
+        if group and (order_id is None or order_id != group[-1].get("orderId")):
+            yield group
+            group = []
+        group.append(info)
+        if order_id is None:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _chunks(items: List[Dict], sizes: Iterator[int]) -> Iterator[List[Dict]]:
+    """項目をsizesの枚数ずつに分ける（amountが境界をまたぐ項目は分割）"""
+    queue = [(info, info.get("amount", 1)) for info in items]
+    i = 0
+    for size in sizes:
+        chunk = []
+        while size > 0 and i < len(queue):
+            info, remaining = queue[i]
+            n = min(size, remaining)
+            chunk.append(dict(info, amount=n))
+            size -= n
+            if n == remaining:
+                i += 1
+            else:
+                queue[i] = (info, remaining - n)
+        yield chunk
+
+
+def plan_pages(image_info: List[Dict], cards_per_page: int) -> List[List[Dict]]:
+    """注文（連続する同じorderIdの項目）を分けずにページへ割り当てる
+
+    注文は、入るページのうち空きが一番少ないページに置き、どこにも入らなければ新しいページを開く。
+    1ページより大きい注文だけは満杯のページと端数に分割する（最小のページ数にまたがる）。
+    ページ内の並びは割り当てた順（同じ注文のカードは隣り合う）。
+    """
+    cards_per_page = max(1, cards_per_page)
+    pages: List[List[Dict]] = []
+    rooms: List[int] = []
+    by_room: Dict[int, List[int]] = defaultdict(list)  # 空き枚数 → ページ番号（古い情報は取り出し時に捨てる）
+
+    def put(page: int, items: List[Dict], n: int):
+        pages[page].extend(items)
+        rooms[page] -= n
+        if rooms[page]:
+            by_room[rooms[page]].append(page)
+
+    def new_page() -> int:
+        pages.append([])
+        rooms.append(cards_per_page)
+        return len(pages) - 1
+
+    def find_page(n: int) -> int:
+        for room in range(n, cards_per_page):
+            candidates = by_room.get(room)
+            while candidates:
+                page = candidates.pop()
+                if rooms[page] == room:
+                    return page
+        return new_page()
+
+    for group in _order_groups(image_info):
+        n = sum(info.get("amount", 1) for info in group)
+        if n <= 0:
+            continue
+        full, rest = divmod(n, cards_per_page) if n > cards_per_page else (0, n)
+        sizes = [cards_per_page] * full + ([rest] if rest else [])
+        for chunk, size in zip(_chunks(group, iter(sizes)), sizes):
+            put(new_page() if size == cards_per_page else find_page(size), chunk, size)
+    return pages
+
+
+def split_orders(pages: List[List[Dict]]) -> List[str]:
+    """複数のページにまたがった注文のorderId"""
+    seen: Dict[str, int] = {}
+    split: Dict[str, None] = {}
+    for page_no, items in enumerate(pages):
+        for info in items:
+            order_id = info.get("orderId")
+            if order_id is not None and seen.setdefault(order_id, page_no) != page_no:
+                split[order_id] = None
+    return list(split)
+
+
+def write_page_plan(
+    path: str,
+    pages: List[List[Dict]],
+    pagination: str,
+    sheet_mm: Tuple[float, float],
+    cards_per_page: int,
+    estimate: Optional[Dict] = None,
+):
+    """ページ計画（ページごとの項目・枚数・注文）をJSONで書き出す（estimateは --plan の見積もり）"""
+    plan = {
+        "version": PAGE_PLAN_VERSION,
+        "pagination": pagination,
+        "sheet_mm": list(sheet_mm),
+        "cards_per_page": cards_per_page,
+        "total_cards": sum(info.get("amount", 1) for items in pages for info in items),
+        "total_pages": len(pages),
+        "split_orders": split_orders(pages),
+        "pages": [
+            {
+                "page": page_no,
+                "cards": sum(info.get("amount", 1) for info in items),
+                "orders": list(dict.fromkeys(info.get("orderId", "no_order") for info in items)),
+                "items": items,
+            }
+            for page_no, items in enumerate(pages, start=1)
+        ],
+    }
+    if estimate is not None:
+        plan["estimate"] = estimate
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
@@ -19,6 +19,15 @@ const LAYER_NAMES = [
   'sheet_background.png',
 ];
 
+// Python側で --mask-layers / --crop-layers を指定した場合のレイヤー構成（なければnull）
+function loadManifest(inputDir) {
+  const manifestPath = path.join(inputDir, 'sheet_layers.json');
+  if (!fs.existsSync(manifestPath)) {
+    return null;
+  }
+  return JSON.parse(fs.readFileSync(manifestPath, 'utf8'));
+}
+
 async function createPsd(pageNo) {
   try {
     const inputDir = path.join(__dirname, 'output', pageNo.toString());
@@ -40,10 +49,23 @@ async function createPsd(pageNo) {
     // Load all images
     console.log(`Processing page ${pageNo}...`);
     const layers = [];
+    const manifest = loadManifest(inputDir);
     
     // Create layers in reverse order (bottom to top in PSD)
     for (const layerName of LAYER_NAMES) {
       const imagePath = path.join(inputDir, layerName);
+      const entry = manifest ? manifest.layers[layerName.replace('sheet_', '').replace('.png', '')] : null;
+      
+      if (entry && entry.empty) {
+        // 空のレイヤー（--crop-layers で書き出しを省略）
+        continue;
+      }
+      
+      if (entry && entry.vector && !fs.existsSync(imagePath)) {
+        // ベクターのみのカットライン（--no-raster-cutline）はPSDに含めない
+        console.log(`Skipping ${layerName} (vector only: ${(entry.vector_files || []).join(', ')})`);
+        continue;
+      }
       
       if (fs.existsSync(imagePath)) {
         console.log(`Loading ${layerName}...`);
@@ -53,9 +75,13 @@ async function createPsd(pageNo) {
         ctx.drawImage(image, 0, 0);
         
         // Add to layers array
+        // 切り抜き済みのレイヤーはマニフェストの位置に配置し、白地のマスク（gray/bilevel）は乗算で重ねる
         layers.unshift({
           name: layerName.replace('.png', ''),
-          canvas: canvas
+          canvas: canvas,
+          left: entry && entry.offset ? entry.offset[0] : 0,
+          top: entry && entry.offset ? entry.offset[1] : 0,
+          blendMode: entry && entry.paper === 'white' ? 'multiply' : 'normal'
         });
       } else {
         console.warn(`Warning: Layer image not found: ${imagePath}`);
@@ -68,15 +94,18 @@ async function createPsd(pageNo) {
     }
     
     // Create PSD data
-    const width = layers[0].canvas.width;
-    const height = layers[0].canvas.height;
+    const width = manifest ? manifest.size[0] : layers[0].canvas.width;
+    const height = manifest ? manifest.size[1] : layers[0].canvas.height;
     
     const psd = {
       width,
       height,
       children: layers.map(layer => ({
         name: layer.name,
-        canvas: layer.canvas
+        canvas: layer.canvas,
+        left: layer.left,
+        top: layer.top,
+        blendMode: layer.blendMode
       }))
     };
     
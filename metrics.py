@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# metrics.py - 処理段階ごとの時間・メモリの計測（--metrics）
+"""
+カード・ページごとに各段階の所要時間とメモリ（RSS）を記録し、JSON / CSV / Prometheusのテキスト形式で書き出す。
+遅いバッチがどこに時間を使ったかを、プロファイラをつながずに確認するためのもの。
+
+段階（stage）:
+- decode: 元画像のデコード（RGBA変換まで）。tile_cache_load はタイルキャッシュからの読み込み
+- resize_char / resize_bg: CARD_PXへのリサイズ（ロゴは resize_char）
+- knockout: 白板マスクの生成（--batch-knockout ではページ単位で1件）
+- composite: 背景・キャラクター・ロゴ・白板・カットラインのシートへの貼り付け
+- glare: グレアレイヤーへの貼り付け
+- label: ユーザー名ラベルの描画（キャッシュ）と貼り付け
+- label_render: index_parallel.py のカード処理スレッドでのラベル描画（キャッシュ）。貼り付けは label に記録する
+  （index.py では描画も label に含む）。どの段階もカード1枚につき1件
+- png_encode / tiff_encode / pdf_encode: レイヤーの書き出し（書き出しスレッドで計測）
+
+各記録には page・card（ページ内の番号）・key・file などのラベルと、段階終了時の RSS（rss_bytes）・
+プロセスのピークRSS（peak_rss_bytes、その時点までの最大値）を付ける。段階は入れ子にしないので、
+同じページの記録の seconds を足せばそのページの計測済み時間になる（スレッドで並行した分は重なる）。
+
+計測は enable() を呼んだプロセスだけで行い、呼ばなければ stage() は何もしないコンテキストを返す。
+"""
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_VERSION = 1
+STAGES = (
+    "decode", "tile_cache_load", "resize_char", "resize_bg", "knockout",
+    "glare", "composite", "label_render", "label", "png_encode", "tiff_encode", "pdf_encode",
+)
+# 出力ファイルの拡張子 → 形式
+METRICS_FORMATS = {".json": "json", ".csv": "csv", ".prom": "prometheus", ".txt": "prometheus"}
+CSV_FIELDS = ("stage", "page", "card", "key", "file", "batch", "seconds", "rss_bytes", "peak_rss_bytes", "pid", "thread", "start")
+
+_NULL = contextlib.nullcontext()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> Optional[int]:
+    """現在のRSS（バイト）。/proc のないOSではNone"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """このプロセスのピークRSS（バイト）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # macOSはバイト、Linuxはキロバイト
+
+
+class MetricsRecorder:
+    """段階ごとの記録を集める（スレッドセーフ）
+
+    labels() で設定したラベル（page など）はスレッドごとに保持し、そのスレッドの stage() の記録に付く。
+    スレッドプールに渡す関数は bind() で包むと、投入したスレッドのラベルを引き継ぐ。
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def context(self) -> Dict:
+        return getattr(self._local, "labels", {})
+
+    @contextlib.contextmanager
+    def labels(self, **labels):
+        previous = self.context()
+        self._local.labels = dict(previous, **labels)
+        try:
+            yield
+        finally:
+            self._local.labels = previous
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **labels):
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            rss, peak = current_rss(), peak_rss()
+            record = dict(self.context(), **labels)
+            record.update(
+                stage=name,
+                seconds=seconds,
+                rss_bytes=rss,
+                # ru_maxrss はカーネルが遅れて更新するので、直後に読んだRSSの方が大きいことがある
+                peak_rss_bytes=max(rss or 0, peak or 0) or None,
+                pid=os.getpid(),
+                thread=threading.current_thread().name,
+                start=start,
+            )
+            with self._lock:
+                self.records.append(record)
+
+    def bind(self, fn: Callable, **labels) -> Callable:
+        context = dict(self.context(), **labels)
+
+        def run(*args, **kwargs):
+            with self.labels(**context):
+                return fn(*args, **kwargs)
+        return run
+
+    def extend(self, records: List[Dict]):
+        with self._lock:
+            self.records.extend(records)
+
+    def drain(self) -> List[Dict]:
+        """記録を取り出して空にする（ワーカープロセスから親へ返すとき）"""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+_recorder: Optional[MetricsRecorder] = None
+
+
+def enable() -> MetricsRecorder:
+    """このプロセスで計測を有効にする（有効なら既存のレコーダーを返す）"""
+    global _recorder
+    if _recorder is None:
+        _recorder = MetricsRecorder()
+    return _recorder
+
+
+def recorder() -> Optional[MetricsRecorder]:
+    return _recorder
+
+
+def stage(name: str, **labels):
+    """段階の計測（無効なら何もしない）: with metrics.stage("decode", file=path): ..."""
+    return _recorder.stage(name, **labels) if _recorder is not None else _NULL
+
+
+def labels(**labels):
+    """このスレッドの以降の記録に付けるラベル: with metrics.labels(page=1): ..."""
+    return _recorder.labels(**labels) if _recorder is not None else _NULL
+
+
+def bind(fn: Callable, **labels) -> Callable:
+    """スレッドプールに渡す関数に、投入したスレッドのラベルを引き継がせる"""
+    return _recorder.bind(fn, **labels) if _recorder is not None else fn
+
+
+def summarize(records: List[Dict]) -> Dict[str, Dict]:
+    """段階ごとの回数・合計秒数・最大秒数・ピークRSS"""
+    stages: Dict[str, Dict] = {}
+    for r in records:
+        s = stages.setdefault(r["stage"], {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss_bytes": 0})
+        s["calls"] += 1
+        s["seconds"] += r["seconds"]
+        s["max_seconds"] = max(s["max_seconds"], r["seconds"])
+        s["peak_rss_bytes"] = max(s["peak_rss_bytes"], r.get("peak_rss_bytes") or 0)
+    order = {name: i for i, name in enumerate(STAGES)}
+    return dict(sorted(stages.items(), key=lambda kv: order.get(kv[0], len(order))))
+
+
+def page_totals(records: List[Dict]) -> Dict[int, Dict[str, float]]:
+    """ページごと・段階ごとの合計秒数（pageラベルのない記録は含まない）"""
+    pages: Dict[int, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for r in records:
+        if r.get("page") is not None:
+            pages[r["page"]][r["stage"]] += r["seconds"]
+    return {page: dict(stages) for page, stages in sorted(pages.items())}
+
+
+def process_peaks(records: List[Dict]) -> Dict[int, int]:
+    """プロセスごとのピークRSS"""
+    peaks: Dict[int, int] = {}
+    for r in records:
+        peaks[r["pid"]] = max(peaks.get(r["pid"], 0), r.get("peak_rss_bytes") or 0)
+    return peaks
+
+
+def _prometheus(records: List[Dict], wall_seconds: float) -> str:
+    def esc(v) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    stages = summarize(records)
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{esc(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    metric("sheet_stage_seconds_total", "counter", "段階ごとの処理時間の合計（秒）",
+           [({"stage": k}, f"{s['seconds']:.6f}") for k, s in stages.items()])
+    metric("sheet_stage_calls_total", "counter", "段階ごとの実行回数",
+           [({"stage": k}, s["calls"]) for k, s in stages.items()])
+    metric("sheet_stage_seconds_max", "gauge", "段階ごとの1回あたりの最大処理時間（秒）",
+           [({"stage": k}, f"{s['max_seconds']:.6f}") for k, s in stages.items()])
+    metric("sheet_stage_peak_rss_bytes", "gauge", "段階の終了時点でのプロセスのピークRSS（最大値）",
+           [({"stage": k}, s["peak_rss_bytes"]) for k, s in stages.items()])
+    metric("sheet_page_stage_seconds", "gauge", "ページごと・段階ごとの処理時間（秒）",
+           [({"page": page, "stage": k}, f"{v:.6f}")
+            for page, totals in page_totals(records).items() for k, v in totals.items()])
+    metric("sheet_process_peak_rss_bytes", "gauge", "プロセスごとのピークRSS",
+           [({"pid": pid}, peak) for pid, peak in process_peaks(records).items()])
+    metric("sheet_wall_seconds", "gauge", "計測開始から書き出しまでの経過時間（秒）", [({}, f"{wall_seconds:.3f}")])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str, records: List[Dict], wall_seconds: float, fmt: Optional[str] = None) -> str:
+    """記録を書き出す。fmtを省略すると拡張子（.json / .csv / .prom / .txt）で決める。形式名を返す"""
+    fmt = fmt or METRICS_FORMATS.get(os.path.splitext(path)[1].lower(), "json")
+    if fmt == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            w.writeheader()
+            for r in records:
+                w.writerow(dict(r, seconds=f"{r['seconds']:.6f}", start=f"{r['start']:.6f}"))
+    elif fmt == "prometheus":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_prometheus(records, wall_seconds))
+    elif fmt == "json":
+        peaks = process_peaks(records)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": METRICS_VERSION,
+                "wall_seconds": round(wall_seconds, 3),
+                "peak_rss_bytes": max(peaks.values(), default=0),
+                "process_peak_rss_bytes": {str(pid): peak for pid, peak in peaks.items()},
+                "stages": summarize(records),
+                "pages": {str(page): totals for page, totals in page_totals(records).items()},
+                "records": records,
+            }, f, ensure_ascii=False, indent=2)
+    else:
+        raise ValueError(f"Unknown metrics format: {fmt}")
+    return fmt
+
+
+def print_summary(records: List[Dict], wall_seconds: float):
+    """段階ごとの合計を表示する"""
+    total = sum(r["seconds"] for r in records) or 1.0
+    print(f"\n=== 段階ごとの計測（経過 {wall_seconds:.1f}秒） ===")
+    for name, s in summarize(records).items():
+        print(
+            f"  {name:<15} {s['seconds']:8.2f}秒 {s['seconds'] / total * 100:5.1f}%  "
+            f"{s['calls']:6d}回  最大 {s['max_seconds']:.3f}秒  ピークRSS {s['peak_rss_bytes'] / (1024 * 1024):.0f}MB"
+        )
+
+
+def finish(path: str):
+    """有効なら記録を書き出して要約を表示する（--metrics の後処理）"""
+    if _recorder is None:
+        return
+    wall = time.time() - _recorder.started
+    records = list(_recorder.records)
+    fmt = write_metrics(path, records, wall)
+    print_summary(records, wall)
+    print(f"計測結果: {path} ({fmt})")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# order_store.py - 注文情報・画像情報の索引（SQLite）
+"""
+filter_by_receive_type.py のための注文の索引。order_info（注文）と order_images（画像）のJSONを
+SQLiteファイルに取り込み、orderId・receiveTypeで引けるようにしておく。
+
+- 元のJSONは mtime・サイズが変わったときだけ内容のハッシュを計算し、ハッシュも変わっていれば
+  そのファイルだけを読み直す（注文情報だけ更新されたら画像情報は読み直さない）
+- 絞り込みは索引を引くだけなので、1か月分の注文でも数ミリ秒で終わる
+- 比較は従来どおり orderId・receiveType を文字列にそろえて行い、画像は元のJSONの並び順で返す
+
+索引ファイルは作り直してよい一時ファイル（消せば次回に全体を読み直す）。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+STORE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY, path TEXT, mtime_ns INTEGER, size INTEGER, digest TEXT
+);
+CREATE TABLE IF NOT EXISTS orders (
+    pos INTEGER PRIMARY KEY, order_id TEXT, receive_type TEXT, data TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_receive_type ON orders (receive_type, order_id);
+CREATE TABLE IF NOT EXISTS images (
+    pos INTEGER PRIMARY KEY, order_id TEXT, data TEXT
+);
+CREATE INDEX IF NOT EXISTS images_order_id ON images (order_id);
+"""
+
+
+def _digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class OrderStore:
+    """注文・画像の索引（SQLiteファイル1つ）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reloaded: List[str] = []  # 直近のsyncで読み直したソース（"orders" / "images"）
+        self._db = sqlite3.connect(path)
+        version = None
+        try:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            version = row and int(row[0])
+        except sqlite3.DatabaseError:
+            pass
+        if version != STORE_VERSION:
+            # 古い形式・壊れた索引は作り直す
+            self._db.close()
+            os.remove(path)
+            self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(STORE_VERSION),)
+            )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stale(self, name: str, path: str) -> Optional[Tuple[int, int, str]]:
+        """ソースが変わっていれば新しい (mtime_ns, size, digest) を返す（変わっていなければNone）"""
+        st = os.stat(path)
+        row = self._db.execute(
+            "SELECT path, mtime_ns, size, digest FROM sources WHERE name = ?", (name,)
+        ).fetchone()
+        if row and row[0] == os.path.abspath(path) and row[1] == st.st_mtime_ns and row[2] == st.st_size:
+            return None
+        digest = _digest(path)
+        if row and row[3] == digest:
+            # 内容は同じ（touchされただけ）: 記録だけ更新する
+            with self._db:
+                self._db.execute(
+                    "UPDATE sources SET path = ?, mtime_ns = ?, size = ? WHERE name = ?",
+                    (os.path.abspath(path), st.st_mtime_ns, st.st_size, name),
+                )
+            return None
+        return st.st_mtime_ns, st.st_size, digest
+
+    def _record(self, name: str, path: str, signature: Tuple[int, int, str]):
+        self._db.execute(
+            "INSERT OR REPLACE INTO sources (name, path, mtime_ns, size, digest) VALUES (?, ?, ?, ?, ?)",
+            (name, os.path.abspath(path), *signature),
+        )
+
+    def sync(self, order_info_file: str, order_images_file: str) -> List[str]:
+        """元のJSONが変わっていれば、変わったものだけ索引に取り込み直す"""
+        self.reloaded = []
+        signature = self._stale("orders", order_info_file)
+        if signature is not None:
+            with open(order_info_file, "r", encoding="utf-8") as f:
+                order_info = json.load(f)
+            with self._db:
+                self._db.execute("DELETE FROM orders")
+                self._db.executemany(
+                    "INSERT INTO orders (pos, order_id, receive_type, data) VALUES (?, ?, ?, ?)",
+                    (
+                        (pos, str(order["orderId"]), str(order.get("receiveType", "")),
+                         json.dumps(order, ensure_ascii=False))
+                        for pos, order in enumerate(order_info)
+                    ),
+                )
+                self._record("orders", order_info_file, signature)
+            self.reloaded.append("orders")
+
+        signature = self._stale("images", order_images_file)
+        if signature is not None:
+            with open(order_images_file, "r", encoding="utf-8") as f:
+                order_images = json.load(f)
+            with self._db:
+                self._db.execute("DELETE FROM images")
+                self._db.executemany(
+                    "INSERT INTO images (pos, order_id, data) VALUES (?, ?, ?)",
+                    (
+                        (pos, str(img.get("orderId", "")), json.dumps(img, ensure_ascii=False))
+                        for pos, img in enumerate(order_images)
+                    ),
+                )
+                self._record("images", order_images_file, signature)
+            self.reloaded.append("images")
+        return self.reloaded
+
+    def _select(self, query: str, params: tuple) -> List[Dict]:
+        # 行ごとにデコードせず、SQLite側で1つのJSON配列につないでから1度でデコードする
+        row = self._db.execute(f"SELECT '[' || group_concat(data, ',') || ']' FROM ({query})", params).fetchone()
+        return json.loads(row[0]) if row[0] else []
+
+    def orders(self, receive_type) -> List[Dict]:
+        """receiveTypeの注文（order_infoの並び順）"""
+        return self._select(
+            "SELECT data FROM orders WHERE receive_type = ? ORDER BY pos", (str(receive_type),)
+        )
+
+    def images(self, receive_type) -> List[Dict]:
+        """receiveTypeの注文に属する画像（order_imagesの並び順）"""
+        return self._select(
+            "SELECT data FROM images WHERE order_id IN "
+            "(SELECT order_id FROM orders WHERE receive_type = ?) ORDER BY pos",
+            (str(receive_type),),
+        )
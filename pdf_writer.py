@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# pdf_writer.py - レイヤー付きPDFの書き出し（Illustratorを経由しない出力）
+"""
+1ページ分のレイヤーを、レイヤーごとにオプションコンテンツグループ（OCG）を持つPDFに書き出す。
+外部ライブラリを使わず zlib だけで書くため、Linuxの描画ノードでもページ単位で並列に実行できる。
+
+- カラーのレイヤー（character/background/logos）は DeviceRGB 画像＋αのソフトマスク
+- マスク系レイヤー（黒インク＋α）は黒の画像＋αのソフトマスク
+- 画像は px * 72 / dpi ポイントで配置するため解像度（dpi）はそのまま保たれる
+- カットラインはラスタ画像の代わりに矩形のベクターパスとして描く（cut_rects）
+
+レイヤーの重なり順は makePSD.js と同じ（PDF_LAYER_ORDER の先頭が最背面）。
+"""
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+PDF_LAYER_ORDER = (
+    "background", "bg_knock", "char_knock", "character",
+    "logo_knock", "logos", "glare", "cutline", "labels",
+)
+COLOR_LAYERS = ("character", "background", "logos")
+BAND_ROWS = 256  # 画像を圧縮するときの1回あたりの行数（メモリ使用量を抑える）
+ZLIB_LEVEL = 6
+
+
+def _pt(px: float, dpi: int) -> float:
+    return px * 72.0 / dpi
+
+
+def _num(v: float) -> str:
+    """PDFの数値表記（不要な小数点以下を省く）"""
+    s = f"{v:.4f}".rstrip("0").rstrip(".")
+    return s if s not in ("", "-0") else "0"
+
+
+def _pdf_string(text: str) -> str:
+    """PDFのリテラル文字列（ASCII以外はUTF-16BEのBOM付き16進文字列）"""
+    if text.isascii():
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return f"({escaped})"
+    return "<FEFF" + text.encode("utf-16-be").hex().upper() + ">"
+
+
+def _bands(img: Image.Image, mode: str) -> Iterator[bytes]:
+    """画像をBAND_ROWS行ずつ指定モードのバイト列にして返す（全体を一度に変換しない）"""
+    w, h = img.size
+    for top in range(0, h, BAND_ROWS):
+        band = img.crop((0, top, w, min(h, top + BAND_ROWS)))
+        if mode == "A":
+            band = band.getchannel("A") if band.mode in ("RGBA", "LA") else band
+        elif band.mode != mode:
+            band = band.convert(mode)
+        yield band.tobytes()
+
+
+def _zeros(size: Tuple[int, int]) -> Iterator[bytes]:
+    w, h = size
+    row_band = bytes(w * BAND_ROWS)
+    for top in range(0, h, BAND_ROWS):
+        yield row_band[:w * (min(h, top + BAND_ROWS) - top)]
+
+
+def _deflate(chunks: Iterator[bytes], level: int = ZLIB_LEVEL) -> bytes:
+    comp = zlib.compressobj(level)
+    out = [comp.compress(chunk) for chunk in chunks]
+    out.append(comp.flush())
+    return b"".join(out)
+
+
+class _PdfObjects:
+    """オブジェクト番号・オフセットを管理しながらPDFを順に書き出す"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offsets: Dict[int, int] = {}
+        self.next_num = 1
+        fp.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self) -> int:
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def write(self, num: int, body: str):
+        self.offsets[num] = self.fp.tell()
+        self.fp.write(f"{num} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def write_stream(self, num: int, entries: str, data: bytes):
+        self.offsets[num] = self.fp.tell()
+        self.fp.write(f"{num} 0 obj\n<< {entries} /Length {len(data)} >>\nstream\n".encode("latin-1"))
+        self.fp.write(data)
+        self.fp.write(b"\nendstream\nendobj\n")
+
+    def finish(self, root: int):
+        xref_at = self.fp.tell()
+        size = self.next_num
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for num in range(1, size):
+            lines.append(f"{self.offsets[num]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {size} /Root {root} 0 R >>\nstartxref\n{xref_at}\n%%EOF\n")
+        self.fp.write("".join(lines).encode("latin-1"))
+
+
+def _write_image(pdf: _PdfObjects, img: Image.Image, color: bool, level: int) -> int:
+    """画像XObjectを書き出して番号を返す（αはソフトマスク。マスク系は黒の画像＋α）"""
+    w, h = img.size
+    smask = pdf.reserve()
+    if img.mode == "L":
+        alpha = _deflate(_bands(img, "L"), level)  # Lモードのマスク系レイヤーは値がそのままα
+    else:
+        alpha = _deflate(_bands(img, "A"), level)
+    pdf.write_stream(
+        smask,
+        f"/Type /XObject /Subtype /Image /Width {w} /Height {h} "
+        f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode",
+        alpha,
+    )
+    image = pdf.reserve()
+    if color:
+        data = _deflate(_bands(img, "RGB"), level)
+        colorspace = "/DeviceRGB"
+    else:
+        data = _deflate(_zeros(img.size), level)  # 黒インク
+        colorspace = "/DeviceGray"
+    pdf.write_stream(
+        image,
+        f"/Type /XObject /Subtype /Image /Width {w} /Height {h} "
+        f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /FlateDecode /SMask {smask} 0 R",
+        data,
+    )
+    return image
+
+
+def cutline_path_ops(
+    cut_rects: Sequence[Tuple[int, int, int, int]],
+    line_px: int,
+    page_h_px: int,
+    dpi: int,
+) -> str:
+    """カットライン矩形（ラスタと同じ画素範囲 (x1, y1, x2, y2)、両端を含む）の描画命令
+
+    ラスタ版は矩形の内側にline_px幅の線を描くので、線の中心は外周から line_px/2 内側になる。
+    """
+    ops = ["q", "0 0 0 RG", f"{_num(_pt(line_px, dpi))} w", "0 J 0 j"]
+    half = line_px / 2.0
+    for x1, y1, x2, y2 in cut_rects:
+        left = x1 + half
+        right = x2 + 1 - half
+        top = y1 + half
+        bottom = y2 + 1 - half
+        ops.append(
+            f"{_num(_pt(left, dpi))} {_num(_pt(page_h_px - bottom, dpi))} "
+            f"{_num(_pt(right - left, dpi))} {_num(_pt(bottom - top, dpi))} re S"
+        )
+    ops.append("Q")
+    return "\n".join(ops)
+
+
+def write_layered_pdf(
+    path: str,
+    sheet_size: Tuple[int, int],
+    dpi: int,
+    layers: List[Tuple[str, Image.Image, Tuple[int, int]]],
+    cut_rects: Optional[Sequence[Tuple[int, int, int, int]]] = None,
+    cutline_px: int = 0,
+    level: int = ZLIB_LEVEL,
+):
+    """1ページのレイヤー付きPDFを書き出す
+
+    layers: (レイヤー名, 画像, シート上の左上座標) のリスト（切り抜き済みの画像でよい）。
+    cut_rectsを渡すと、cutlineレイヤーはラスタの代わりにベクターパスで描く。
+    """
+    order = {name: i for i, name in enumerate(PDF_LAYER_ORDER)}
+    entries = [(name, img, xy) for name, img, xy in layers if not (cut_rects is not None and name == "cutline")]
+    if cut_rects is not None:
+        entries.append(("cutline", None, (0, 0)))
+    entries.sort(key=lambda e: order.get(e[0], len(order)))
+
+    page_w, page_h = sheet_size
+    with open(path, "wb") as fp:
+        pdf = _PdfObjects(fp)
+        catalog = pdf.reserve()
+        pages = pdf.reserve()
+        page = pdf.reserve()
+
+        ocgs = []
+        xobjects = []
+        content = []
+        for i, (name, img, (x, y)) in enumerate(entries):
+            ocg = pdf.reserve()
+            pdf.write(ocg, f"<< /Type /OCG /Name {_pdf_string(name)} >>")
+            ocgs.append(ocg)
+            content.append(f"/OC /L{i} BDC")
+            if img is None:
+                content.append(cutline_path_ops(cut_rects, cutline_px, page_h, dpi))
+            else:
+                image = _write_image(pdf, img, name in COLOR_LAYERS, level)
+                xobjects.append(f"/Im{i} {image} 0 R")
+                w, h = img.size
+                content.append(
+                    f"q {_num(_pt(w, dpi))} 0 0 {_num(_pt(h, dpi))} "
+                    f"{_num(_pt(x, dpi))} {_num(_pt(page_h - y - h, dpi))} cm /Im{i} Do Q"
+                )
+            content.append("EMC")
+
+        contents = pdf.reserve()
+        pdf.write_stream(contents, "/Filter /FlateDecode", zlib.compress("\n".join(content).encode("latin-1")))
+
+        properties = " ".join(f"/L{i} {ocg} 0 R" for i, ocg in enumerate(ocgs))
+        pdf.write(
+            page,
+            f"<< /Type /Page /Parent {pages} 0 R "
+            f"/MediaBox [0 0 {_num(_pt(page_w, dpi))} {_num(_pt(page_h, dpi))}] "
+            f"/Resources << /XObject << {' '.join(xobjects)} >> /Properties << {properties} >> >> "
+            f"/Contents {contents} 0 R >>",
+        )
+        pdf.write(pages, f"<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>")
+        ocg_refs = " ".join(f"{ocg} 0 R" for ocg in ocgs)
+        # レイヤーパネルでは最前面のレイヤーを上に表示する
+        order_refs = " ".join(f"{ocg} 0 R" for ocg in reversed(ocgs))
+        pdf.write(
+            catalog,
+            f"<< /Type /Catalog /Pages {pages} 0 R "
+            f"/OCProperties << /OCGs [{ocg_refs}] /D << /Order [{order_refs}] /ON [{ocg_refs}] >> >> >>",
+        )
+        pdf.finish(catalog)
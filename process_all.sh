@@ -170,7 +170,7 @@ fi
 
 # Python処理実行
 python3 index.py \
-    --images "$(cat "$IMAGES_FILE")" \
+    --images-file "$IMAGES_FILE" \
     --sheet "$SHEET_SIZE" \
     --prefix "$PREFIX" \
     --output-dir "$OUTPUT_DIR" \
@@ -8,45 +8,17 @@ echo "========================================="
 echo "receiveType別処理を開始します"
 echo "========================================="
 
-# Step 1: receiveType=0（イベント受け取り）の処理
+# Step 1-2: receiveType=0（イベント受け取り）/ 1（配送）の処理
 echo ""
-echo "Step 1: receiveType=0（イベント受け取り）の処理"
+echo "Step 1-2: receiveType=0（イベント受け取り）/ 1（配送）の処理"
 echo "-----------------------------------------"
 
-# フィルタリングと画像生成
-python3 filter_by_receive_type.py --receive-type 0 --output filtered_images_0.test.json
-
-if [ -f "filtered_images_0.json" ]; then
-    echo "Generating images for receiveType=0..."
-    python3 index.py --sheet 280x580 \
-        --images "$(cat filtered_images_0.test.json)" \
-        --output-dir output_receive_0 \
-        --knockout-mode normal \
-        --knockout-shrink 0.05
-    echo "✓ Images generated for receiveType=0"
-else
-    echo "⚠ No images found for receiveType=0"
-fi
-
-# Step 2: receiveType=1（配送）の処理
-echo ""
-echo "Step 2: receiveType=1（配送）の処理"
-echo "-----------------------------------------"
-
-# フィルタリングと画像生成
-python3 filter_by_receive_type.py --receive-type 1 --output filtered_images_1.test.json
-
-if [ -f "filtered_images_1.json" ]; then
-    echo "Generating images for receiveType=1..."
-    python3 index.py --sheet 280x580 \
-        --images "$(cat filtered_images_1.test.json)" \
-        --output-dir output_receive_1 \
-        --knockout-mode normal \
-        --knockout-shrink 0.05
-    echo "✓ Images generated for receiveType=1"
-else
-    echo "⚠ No images found for receiveType=1"
-fi
+# 注文をreceiveTypeごとに振り分け、1つのプロセスで両方の画像を生成
+# （filtered_images_0.test.json / filtered_images_1.test.json も保存される）
+python3 filter_by_receive_type.py --receive-type all \
+    --output filtered_images.test.json \
+    --run-command
+echo "✓ Images generated for receiveType=0 and 1"
 
 # Step 3: AIファイル生成
 echo ""
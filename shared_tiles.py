@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# shared_tiles.py - プロセス間で共有するリサイズ済みタイル（mmapファイル）
+"""
+複数ページ（＝複数のワーカープロセス）で使われる背景・ロゴなどを、親プロセスで1度だけ
+CARD_PXにリサイズして1つのファイルに書き出し、各ワーカーはそれをmmapして
+コピーなしで画像として参照する。
+
+- SharedTileWriter: 親プロセス側。ImageCacheと同じキーでタイルを追加し、close()で確定する
+- SharedTileHandle: ワーカーへ渡すピクル可能な目録（ファイルパス＋キーごとのオフセット）
+- attach(): ワーカー側。目録のタイルを読み取り専用の画像として返す
+
+返される画像は読み取り専用のバッファを共有しているため、呼び出し側で変更しないこと
+（Pillowは読み取り専用画像への書き込み時に自動でコピーを作るので壊れはしない）。
+"""
+import mmap
+import os
+import tempfile
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+TILE_ALIGN = 64  # 各タイルの先頭をこのバイト数に揃える
+
+
+class TileEntry(NamedTuple):
+    offset: int
+    size: Tuple[int, int]
+    mode: str
+
+
+class SharedTileHandle(NamedTuple):
+    """ワーカーに渡すタイル目録"""
+    path: str
+    entries: Dict[str, TileEntry]
+
+
+class SharedTileWriter:
+    """共有タイルファイルの書き出し（親プロセス側）
+
+    with文で使うと、抜けた時点でファイルを削除する。
+    """
+
+    def __init__(self, dir: Optional[str] = None):
+        fd, self.path = tempfile.mkstemp(prefix="tiles_", suffix=".bin", dir=dir)
+        self._file = os.fdopen(fd, "wb")
+        self._entries: Dict[str, TileEntry] = {}
+        self.nbytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str, im: Image.Image):
+        """キーに対応するタイルを追加する（同じキーは1度だけ書き込む）"""
+        if key in self._entries:
+            return
+        pad = -self._file.tell() % TILE_ALIGN
+        if pad:
+            self._file.write(b"\0" * pad)
+        offset = self._file.tell()
+        self._file.write(im.tobytes())
+        self._entries[key] = TileEntry(offset, im.size, im.mode)
+        self.nbytes = self._file.tell()
+
+    def close(self) -> SharedTileHandle:
+        """書き込みを確定し、ワーカーに渡す目録を返す"""
+        if not self._file.closed:
+            self._file.close()
+        return SharedTileHandle(self.path, dict(self._entries))
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.remove()
+
+    def summary(self) -> str:
+        return f"Shared tiles: {len(self._entries)} tiles ({self.nbytes / (1024 * 1024):.1f}MB)"
+
+
+def attach(handle: SharedTileHandle) -> Dict[str, Image.Image]:
+    """共有タイルファイルをmmapし、キー → 読み取り専用画像 の辞書を返す（コピーなし）"""
+    if not handle.entries:
+        return {}
+    with open(handle.path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = memoryview(mm)
+    tiles = {}
+    for key, entry in handle.entries.items():
+        w, h = entry.size
+        nbytes = w * h * Image.getmodebands(entry.mode)
+        view = buf[entry.offset:entry.offset + nbytes]
+        tiles[key] = Image.frombuffer(entry.mode, entry.size, view, "raw", entry.mode, 0, 1)
+    return tiles
@@ -29,95 +29,30 @@ from index import (
     KNOCKOUT_THRESHOLD, KNOCKOUT_MIN_ALPHA, KNOCKOUT_SHRINK_MM,
     CUTLINE_PX, MARGIN_PX, SPACING_PX
 )
+import knockout
 
 # knockout処理のパターン定義
 KNOCKOUT_PATTERNS = ["steep_upper1", "steep_upper2", "steep_upper3"]
 
 
+# このスクリプトの "gradient" はαをそのまま使う（index.pyの gradient とは異なる）
+PATTERN_ALIASES = {"gradient": "linear"}
+
+
 def apply_knockout(alpha: Image.Image, pattern: str, threshold: int = KNOCKOUT_THRESHOLD) -> Image.Image:
     """
-    パターンに応じたknockout処理を適用
+    パターンに応じたknockout処理を適用（knockout.pyのLUTエンジンを使用）
 
     Args:
         alpha: キャラクター画像のアルファチャンネル
-        pattern: "binary", "gradient", "steep" のいずれか
+        pattern: "binary", "gradient", "steep", "steep_upper1"〜"steep_upper3" など
+                 knockout.available_styles() の任意のスタイル名
         threshold: 閾値（デフォルト: KNOCKOUT_THRESHOLD=20）
 
     Returns:
         処理済みのアルファチャンネル（白板用マスク）
     """
-    if pattern == "binary":
-        # パターン1: 完全2値化
-        # α > threshold → 255 (黒/不透明)
-        # α <= threshold → 0 (透明)
-        return alpha.point(lambda p: 0 if p < threshold else 255)
-
-    elif pattern == "gradient":
-        # パターン2: αの値に応じたグラデーション
-        # α > threshold → そのままのα値を使用
-        # α <= threshold → 0 (透明)
-        # 非透過(α=255)は完全黒、半透明(α=128)は中間グレー
-        return alpha.point(lambda p: 0 if p < threshold else p)
-
-    elif pattern == "steep":
-        # パターン3: 傾斜付きグラデーション
-        # α値がちょっとでもあれば、より強く黒に寄せる
-        # 累乗関数: output = ((α - threshold) / (255 - threshold)) ^ (1/steepness) * 255
-        steepness = 2.5  # この値が大きいほど、低αでも黒くなる
-
-        def steep_func(p):
-            if p < threshold:
-                return 0
-            normalized = (p - threshold) / (255 - threshold)
-            steeper = pow(normalized, 1.0 / steepness)
-            return int(min(255, steeper * 255))
-
-        return alpha.point(steep_func)
-
-    elif pattern == "steep_upper1":
-        # パターン4: steepより強調（steepness=3.5）
-        # α値が薄い場合でもより黒く出力
-        steepness = 3.5
-
-        def steep_func(p):
-            if p < threshold:
-                return 0
-            normalized = (p - threshold) / (255 - threshold)
-            steeper = pow(normalized, 1.0 / steepness)
-            return int(min(255, steeper * 255))
-
-        return alpha.point(steep_func)
-
-    elif pattern == "steep_upper2":
-        # パターン5: さらに強調（steepness=5.0）
-        # 半透明でもかなり黒く出力
-        steepness = 5.0
-
-        def steep_func(p):
-            if p < threshold:
-                return 0
-            normalized = (p - threshold) / (255 - threshold)
-            steeper = pow(normalized, 1.0 / steepness)
-            return int(min(255, steeper * 255))
-
-        return alpha.point(steep_func)
-
-    elif pattern == "steep_upper3":
-        # パターン6: 最大強調（steepness=7.0）
-        # 低α値でもほぼ黒に近い出力
-        steepness = 7.0
-
-        def steep_func(p):
-            if p < threshold:
-                return 0
-            normalized = (p - threshold) / (255 - threshold)
-            steeper = pow(normalized, 1.0 / steepness)
-            return int(min(255, steeper * 255))
-
-        return alpha.point(steep_func)
-
-    else:
-        raise ValueError(f"Unknown knockout pattern: {pattern}")
+    return knockout.apply_knockout(alpha, PATTERN_ALIASES.get(pattern, pattern), threshold)
 
 
 def grid_layout_for_test(
@@ -150,11 +85,11 @@ def grid_layout_for_test(
     return positions, rows, cols
 
 
-def load_test_data(json_path: str) -> List[Dict]:
+def load_test_data(json_path: str, patterns: List[str] = KNOCKOUT_PATTERNS) -> List[Dict]:
     """
-    test.jsonを読み込んで、3パターン分に展開
+    test.jsonを読み込んで、パターン分に展開
 
-    6件 × 3パターン = 18件のカードデータを生成
+    6件 × 3パターン = 18件のカードデータを生成（デフォルト）
     """
     with open(json_path, 'r') as f:
         data = json.load(f)
@@ -162,7 +97,7 @@ def load_test_data(json_path: str) -> List[Dict]:
     result = []
     for item in data:
         # 各アイテムを3パターン分に展開
-        for pattern in KNOCKOUT_PATTERNS:
+        for pattern in patterns:
             result.append({
                 "key": f"{item['orderId']}_{item['shouhinId']}",
                 "char": item["shouhinNaiyou"],
@@ -309,7 +244,7 @@ def generate_test_sheet(
             logo_knock = apply_knockout(logo_alpha, "binary")
             if shrink_px > 0:
                 logo_knock_smooth = logo_knock.filter(ImageFilter.GaussianBlur(radius=0.3))
-                logo_knock = logo_knock_smooth.filter(ImageFilter.MinFilter(3))
+                logo_knock = knockout.erode(logo_knock_smooth, shrink_px)
             layers["logo_knock"].paste(black, (x, y), logo_knock)
 
         # 背景knockout
@@ -324,10 +259,10 @@ def generate_test_sheet(
 
         if shrink_px > 0:
             knock_smooth = knock.filter(ImageFilter.GaussianBlur(radius=0.3))
-            knock = knock_smooth.filter(ImageFilter.MinFilter(3))
+            knock = knockout.erode(knock_smooth, shrink_px)
 
         # グラデーション系の場合はアルファ合成
-        if pattern in ["gradient", "steep", "steep_upper1", "steep_upper2", "steep_upper3"]:
+        if pattern == "gradient" or knockout.is_grayscale(pattern):
             knock_layer = Image.new("RGBA", CARD_PX, (0, 0, 0, 0))
             knock_layer.paste(Image.new("RGB", CARD_PX, (0, 0, 0)), (0, 0), knock)
             layers["char_knock"].alpha_composite(knock_layer, (x, y))
@@ -411,6 +346,11 @@ def main():
         default="280x580",
         help="シート寸法 (例: 280x580)"
     )
+    parser.add_argument(
+        "--patterns", "-p",
+        default=",".join(KNOCKOUT_PATTERNS),
+        help=f"比較するknockoutパターン（カンマ区切り）。選択肢: gradient, {', '.join(knockout.available_styles())}"
+    )
     parser.add_argument(
         "--output", "-o",
         default="techTest/output",
@@ -426,10 +366,16 @@ def main():
         print("シート寸法は 280x580 のように指定してください。")
         sys.exit(1)
 
-    # テストデータ読み込み（3パターン分に展開）
+    patterns = [p.strip() for p in args.patterns.split(",") if p.strip()]
+    for pattern in patterns:
+        if PATTERN_ALIASES.get(pattern, pattern) not in knockout.available_styles():
+            print(f"不明なknockoutパターン: {pattern}")
+            sys.exit(1)
+
+    # テストデータ読み込み（パターン分に展開）
     print(f"入力ファイル: {args.input}")
-    test_data = load_test_data(args.input)
-    print(f"展開後のテストデータ: {len(test_data)}件（元データ × 3パターン）")
+    test_data = load_test_data(args.input, patterns)
+    print(f"展開後のテストデータ: {len(test_data)}件（元データ × {len(patterns)}パターン）")
 
     # テストシート生成
     generate_test_sheet(
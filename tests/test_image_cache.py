@@ -0,0 +1,81 @@
+"""
+image_cache.DiskTileCache（カード単位の成果物のディスクキャッシュ）のテスト
+
+容量の数え方、mtimeの古いものからの削除（LRU）、TILE_CACHE_VERSION を上げたときに
+古いエントリを使わないことを確かめる。
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import image_cache
+from image_cache import DiskTileCache
+
+
+def noise_tile(seed, size=(32, 32)):
+    """圧縮がほとんど効かない（どれもほぼ同じファイルサイズになる）RGBA画像"""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 4), dtype=np.uint8), "RGBA")
+
+
+def set_mtime(cache, key, t):
+    os.utime(cache.path_for(key), (t, t))
+
+
+def test_store_counts_overwritten_entry_once(tmp_path):
+    cache = DiskTileCache(str(tmp_path))
+    cache.store("aa01", noise_tile(1))
+    cache.store("aa01", noise_tile(2))  # 同じキーの上書き（他プロセスと同時に作った場合など）
+    cache.store("aa01", noise_tile(3, size=(8, 8)))
+    assert cache._total_bytes == cache._scan_total() == os.path.getsize(cache.path_for("aa01"))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskTileCache(str(tmp_path))
+    for i, key in enumerate(["aa01", "bb02", "cc03"]):
+        cache.store(key, noise_tile(i))
+        set_mtime(cache, key, 1_000_000 + i)
+    cache.max_bytes = cache._scan_total() + 1
+
+    assert cache.load("aa01") is not None  # 読み込んだものは最近使ったことになる
+    cache.store("dd04", noise_tile(4))     # 上限超過 → 上限の9割まで古い順に削除
+
+    remaining = {key for key in ["aa01", "bb02", "cc03", "dd04"] if os.path.exists(cache.path_for(key))}
+    assert remaining == {"aa01", "dd04"}
+    assert cache.evictions == 2
+    assert cache._total_bytes == cache._scan_total() <= cache.max_bytes * image_cache.DISK_EVICT_RATIO
+
+
+def test_total_is_rescanned_on_startup(tmp_path):
+    first = DiskTileCache(str(tmp_path))
+    first.store("aa01", noise_tile(1))
+    first.store("bb02", noise_tile(2))
+    assert DiskTileCache(str(tmp_path))._total_bytes == first._total_bytes
+
+
+def test_entries_from_older_version_are_not_used(tmp_path, monkeypatch):
+    cache = DiskTileCache(str(tmp_path))
+    old = Image.new("L", (4, 4), 10)
+    new = Image.new("L", (4, 4), 200)
+
+    monkeypatch.setattr(image_cache, "TILE_CACHE_VERSION", image_cache.TILE_CACHE_VERSION - 1)
+    image_cache.cached_artifact(cache, "knockout", "src", {"shrink": 1}, lambda: old)
+    monkeypatch.undo()
+
+    created = []
+    def create():
+        created.append(1)
+        return new
+
+    got = image_cache.cached_artifact(cache, "knockout", "src", {"shrink": 1}, create)
+    assert created and got.getpixel((0, 0)) == 200
+    # 作り直したものは今のバージョンのキーで保存され、次からはそれが使われる
+    again = image_cache.cached_artifact(cache, "knockout", "src", {"shrink": 1}, create)
+    assert len(created) == 1 and again.getpixel((0, 0)) == 200
+    assert cache.hits == 1
@@ -0,0 +1,112 @@
+"""
+index.py のページ単位の読み込み（iter_loaded_pages の先読み）のテスト
+
+処理中のページと並行して読み込むのは最大 prefetch_pages ページまで（メモリは 1+prefetch_pages ページ分）。
+process_pages（ページ単位の処理）が途中で失敗したときの書き出しスレッドの後始末も確かめる。
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import index
+from layer_writer import LayerWriter
+
+
+class LoadTracker:
+    """load_images の代わり。読み込み中・読み込み済みで未処理のページ数を数える"""
+
+    def __init__(self, load_seconds=0.01):
+        self.load_seconds = load_seconds
+        self.lock = threading.Lock()
+        self.started = 0
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, items, cache=None):
+        with self.lock:
+            self.started += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.load_seconds)
+        with self.lock:
+            self.running -= 1
+        return list(items)
+
+
+def settle(tracker, expected, timeout=2.0):
+    """裏の読み込みが expected ページ目まで始まるのを待つ（それ以上は始まらないことも確かめられるよう少し待つ）"""
+    deadline = time.time() + timeout
+    while tracker.started < expected and time.time() < deadline:
+        time.sleep(0.005)
+    time.sleep(0.05)
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 2])
+def test_prefetch_window(monkeypatch, prefetch):
+    tracker = LoadTracker()
+    monkeypatch.setattr(index, "load_images", tracker)
+    page_items = [[{"key": f"p{i}"}] for i in range(6)]
+
+    consumed = 0
+    for cards in index.iter_loaded_pages(page_items, cache=None, prefetch_pages=prefetch):
+        assert cards == page_items[consumed]
+        consumed += 1
+        # このページを処理している間に読み込まれる（読み込み済み・読み込み中の）ページ数
+        ahead = min(prefetch, len(page_items) - consumed)
+        settle(tracker, consumed + ahead)
+        assert tracker.started - consumed == ahead
+    assert consumed == len(page_items)
+    assert tracker.started == len(page_items)
+    assert tracker.max_running == 1
+
+
+def test_prefetch_stops_when_consumer_stops(monkeypatch):
+    tracker = LoadTracker()
+    monkeypatch.setattr(index, "load_images", tracker)
+    pages = index.iter_loaded_pages([[{"key": f"p{i}"}] for i in range(6)], cache=None, prefetch_pages=1)
+    next(pages)
+    pages.close()  # 途中で失敗したときと同じく、残りのページは読み込まない
+    assert tracker.started == 2
+
+
+def test_failing_page_cancels_queued_writes(monkeypatch, tmp_path):
+    writers = []
+
+    def make_writer():
+        writers.append(LayerWriter(max_workers=1))
+        return writers[-1]
+
+    release = threading.Event()
+
+    def slow_convert(img):
+        def convert():
+            assert release.wait(5)
+            return img
+        return convert
+
+    def fake_sheet_layers(card_data, output_prefix, writer, **kwargs):
+        page = Path(output_prefix).parent.name
+        if page == "2":
+            threading.Timer(0.1, release.set).start()  # 取り消しの後で、書き出し中の1枚目を終わらせる
+            raise RuntimeError("page 2 failed")
+        img = index.Image.new("RGBA", (8, 8))
+        writer.save(img, f"{output_prefix}_0.png", dpi=(350, 350), convert=slow_convert(img))
+        for i in range(1, 4):
+            writer.save(img, f"{output_prefix}_{i}.png", dpi=(350, 350))
+
+    monkeypatch.setattr(index, "LayerWriter", make_writer)
+    monkeypatch.setattr(index, "load_images", LoadTracker(load_seconds=0))
+    monkeypatch.setattr(index, "make_sheet_layers", fake_sheet_layers)
+    items = [{"key": f"c{i}", "char": "char.png", "orderId": str(i), "amount": 1} for i in range(40)]
+    with pytest.raises(RuntimeError, match="page 2"):
+        index.process_pages(items, (280, 580), output_dir=str(tmp_path), pagination="fill")
+
+    assert (tmp_path / "1" / "sheet_0.png").exists()
+    assert not any((tmp_path / "1" / f"sheet_{i}.png").exists() for i in range(1, 4))
+    assert writers[0]._executor._shutdown
@@ -0,0 +1,31 @@
+"""
+index_parallel.py の共有タイル（--shared-tiles）の後始末のテスト
+
+共有タイルの書き出し中に失敗しても、一時ファイルが残らないことを確かめる。
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import index_parallel
+import shared_tiles
+
+
+def test_shared_tiles_removed_when_build_fails(monkeypatch, tmp_path):
+    tile_dir = tmp_path / "tiles"
+    tile_dir.mkdir()
+    monkeypatch.setattr(index_parallel, "SharedTileWriter", lambda: shared_tiles.SharedTileWriter(dir=str(tile_dir)))
+
+    def fail(page_items, cache, writer):
+        writer.add("bg", index_parallel.Image.new("RGBA", (4, 4)))
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index_parallel, "build_shared_tiles", fail)
+    items = [{"key": f"c{i}", "char": "char.png", "bg": "bg.png", "amount": 1} for i in range(2)]
+    with pytest.raises(OSError):
+        index_parallel.process_pages_parallel(items, (280, 580), output_dir=str(tmp_path / "out"), max_workers=1, shared_tiles=True)
+    assert list(tile_dir.iterdir()) == []
@@ -0,0 +1,92 @@
+"""
+job_input（--images-file のJSON配列・JSONLを少しずつ読む処理）のテスト
+
+チャンクの境界で項目が切れても、すべての項目を順に読めることを確かめる。
+"""
+
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import job_input
+from job_input import JobInputError, iter_items, load_items
+
+
+JOB = [
+    {"key": "ch1", "char": "c/1.png", "bg": None, "amount": 12345, "userName": "ユーザー"},
+    {"key": "ch2", "char": "c/2.png", "bg": "b/2.png", "amount": 1.5e2, "nested": {"a": [1, 2, {"b": "]"}]}},
+    {"key": "ch3", "char": "c/3.png", "amount": -7, "flag": True, "empty": {}},
+]
+
+
+@pytest.fixture(params=[1, 2, 3, 7, 64])
+def small_chunks(request, monkeypatch):
+    """読み込みのチャンクを小さくして、項目・数値・文字列がチャンクの境界で切れる場合を通す"""
+    monkeypatch.setattr(job_input, "CHUNK_CHARS", request.param)
+    return request.param
+
+
+def test_array_across_chunk_boundaries(tmp_path, small_chunks):
+    path = tmp_path / "job.json"
+    path.write_text(json.dumps(JOB, ensure_ascii=False, indent=2), encoding="utf-8")
+    assert load_items(str(path)) == JOB
+
+
+def test_compact_array_and_bom(tmp_path, small_chunks):
+    path = tmp_path / "job.json"
+    path.write_text(json.dumps(JOB, ensure_ascii=False, separators=(",", ":")), encoding="utf-8-sig")
+    assert load_items(str(path)) == JOB
+
+
+def test_jsonl_across_chunk_boundaries(tmp_path, small_chunks):
+    path = tmp_path / "job.jsonl"
+    lines = [json.dumps(item, ensure_ascii=False) for item in JOB]
+    path.write_text("\n" + lines[0] + "\r\n\n" + "\n".join(lines[1:]), encoding="utf-8")  # 空行・CRLF・末尾改行なし
+    assert load_items(str(path)) == JOB
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(JOB, ensure_ascii=False),
+    "\n".join(json.dumps(item, ensure_ascii=False) for item in JOB) + "\n",
+])
+def test_stdin(monkeypatch, small_chunks, text):
+    monkeypatch.setattr(sys, "stdin", io.StringIO(text))
+    assert list(iter_items("-")) == JOB
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ ]  ", "", "\n\n"])
+def test_empty_inputs(tmp_path, text):
+    path = tmp_path / "job.json"
+    path.write_text(text, encoding="utf-8")
+    assert load_items(str(path)) == []
+
+
+@pytest.mark.parametrize("text, message", [
+    ('[{"key": "a"}, {"key": "b"}', "item 2: 配列が閉じられていません"),
+    ('[{"key": "a"},', "item 1: 配列が閉じられていません"),
+    ('[{"key": "a"} {"key": "b"}]', "item 1: 区切り"),
+    ('[{"key": "a"}, [1]]', "item 1: 項目はオブジェクト"),
+    ('[{"key": "a"}] x', "余分なデータ"),
+    ('{"key": "a"}\n{"key": \n', "line 2:"),
+    ('{"key": "a"}\n3\n', "line 2: 項目はオブジェクト"),
+])
+def test_errors_report_position(tmp_path, small_chunks, text, message):
+    path = tmp_path / "job.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(JobInputError, match=message):
+        load_items(str(path))
+
+
+def test_items_are_streamed(tmp_path, monkeypatch):
+    """最初の項目はファイル全体を読む前に返る"""
+    monkeypatch.setattr(job_input, "CHUNK_CHARS", 16)
+    path = tmp_path / "job.json"
+    path.write_text(json.dumps([{"key": f"k{i}"} for i in range(1000)]), encoding="utf-8")
+    items = iter_items(str(path))
+    assert next(items) == {"key": "k0"}
+    items.close()
@@ -0,0 +1,166 @@
+"""
+knockout（白板マスク生成エンジン）のテスト
+
+LUTによる閾値処理が、置き換える前のスタイルごとの処理（Image.point のラムダ・NumPyの分岐）と
+同じ値になることを確かめる。複数カードのα面を積み重ねた一括処理（knockout_planes）は、
+1枚ずつ Pillow で処理したとき（GaussianBlur(0.3) → MinFilter）と画素単位で一致すること、
+収縮（erode_planes / erode）が画像の端を含めて MinFilter(2r+1) と一致することを確かめる。
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import knockout
+
+THRESHOLDS = [0, 1, 10, 20, 50, 128, 200, 254]
+RAMP = Image.fromarray(np.arange(256, dtype=np.uint8).reshape(16, 16))  # α値 0〜255 を1画素ずつ
+
+
+# ---- 置き換える前の処理（index.py / techTest/generate_knockout_test.py） -------------------
+
+def legacy_steep(steepness):
+    def make(threshold):
+        def steep_func(p):
+            if p < threshold:
+                return 0
+            normalized = (p - threshold) / (255 - threshold)
+            steeper = pow(normalized, 1.0 / steepness)
+            return int(min(255, steeper * 255))
+        return steep_func
+    return make
+
+
+LEGACY_POINT = {
+    "binary": lambda t: (lambda p: 0 if p < t else 255),
+    "gradient": lambda t: (lambda p: 0 if p < t else min(255, int(p * 1.2))),
+    "gradient_strong": lambda t: (lambda p: 0 if p < t else min(255, int(p * 1.5))),
+    "linear": lambda t: (lambda p: 0 if p < t else p),
+    "steep": legacy_steep(2.5),
+    "steep_upper1": legacy_steep(3.5),
+    "steep_upper2": legacy_steep(5.0),
+    "steep_upper3": legacy_steep(7.0),
+}
+
+
+def legacy_hybrid(alpha, threshold):
+    alpha_np = np.array(alpha)
+    core_mask = alpha_np > 200
+    edge_mask = (alpha_np > threshold) & (alpha_np <= 200)
+    result = np.zeros_like(alpha_np)
+    result[core_mask] = 255
+    result[edge_mask] = alpha_np[edge_mask]
+    return result
+
+
+def legacy_adaptive(alpha, threshold):
+    alpha_np = np.array(alpha)
+    with np.errstate(invalid="ignore"):
+        mean_alpha = np.mean(alpha_np[alpha_np > threshold]) if (alpha_np > threshold).any() else np.nan
+    if mean_alpha > 200:
+        return np.asarray(alpha.point(LEGACY_POINT["binary"](threshold)))
+    elif mean_alpha > 150:
+        return np.where(alpha_np > 200, 255, np.where(alpha_np > threshold, alpha_np, 0)).astype(np.uint8)
+    return np.asarray(alpha.point(LEGACY_POINT["gradient_strong"](threshold)))
+
+
+def test_every_style_has_a_reference():
+    assert set(knockout.available_styles()) == set(LEGACY_POINT) | {"hybrid", "adaptive"}
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+@pytest.mark.parametrize("style", sorted(LEGACY_POINT))
+def test_lut_matches_point_lambdas(style, threshold):
+    expected = np.asarray(RAMP.point(LEGACY_POINT[style](threshold)))
+    assert np.array_equal(knockout.lut(style, threshold), expected.ravel())
+    assert np.array_equal(np.asarray(knockout.apply_knockout(RAMP, style, threshold)), expected)
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_hybrid_lut_matches_numpy_branches(threshold):
+    expected = legacy_hybrid(RAMP, threshold)
+    assert np.array_equal(knockout.lut("hybrid", threshold), expected.ravel())
+    assert np.array_equal(np.asarray(knockout.apply_knockout(RAMP, "hybrid", threshold)), expected)
+
+
+@pytest.mark.parametrize("threshold", [10, 20, 50])
+@pytest.mark.parametrize("bulk", [0, 100, 180, 250])  # 平均αを binary / hybrid / gradient_strong の各分岐に振る
+def test_adaptive_matches_per_image_choice(threshold, bulk):
+    # 0〜255 の全値に、平均を決める大量の画素を足した画像（bulk=0 は閾値を超えるのがランプだけ）
+    pixels = np.concatenate([np.arange(256), np.full(4096 - 256, bulk)]).astype(np.uint8).reshape(64, 64)
+    alpha = Image.fromarray(pixels)
+    assert np.array_equal(np.asarray(knockout.apply_knockout(alpha, "adaptive", threshold)), legacy_adaptive(alpha, threshold))
+
+
+def test_adaptive_without_pixels_over_threshold():
+    alpha = Image.fromarray(np.full((8, 8), 5, np.uint8))
+    assert np.array_equal(np.asarray(knockout.apply_knockout(alpha, "adaptive", 20)), legacy_adaptive(alpha, 20))
+
+
+def test_unknown_style():
+    with pytest.raises(ValueError):
+        knockout.lut("nope", 20)
+
+
+# ---- knockout_planes（積み重ねたα面の一括処理）と1枚ずつのPillow処理の比較 -----------------
+
+def card_alpha(peak, seed, blur=3, size=(67, 53)):
+    """縁をぼかした楕円＋ノイズのα（peak で不透明度を変え、adaptive の分岐を振り分ける）"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    alpha = Image.new("L", size, 0)
+    ImageDraw.Draw(alpha).ellipse((w * 0.15, h * 0.1, w * 0.85, h * 0.9), fill=peak)
+    arr = np.asarray(alpha.filter(ImageFilter.GaussianBlur(radius=blur))).astype(np.int16)
+    arr = arr + rng.integers(-8, 9, size=arr.shape)
+    arr[0, :] = peak  # 画像の端まで不透明な行も作る
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+# adaptive ではそれぞれ binary / hybrid / gradient_strong / 閾値を超える画素なし、が選ばれる
+CARD_ALPHAS = [card_alpha(255, 1, blur=1), card_alpha(190, 2, blur=1), card_alpha(120, 3), card_alpha(0, 4)]
+
+
+def pillow_knockout(alpha, style, threshold, shrink_px):
+    """置き換える前の1枚ずつの処理（閾値処理 → GaussianBlur(0.3) → MinFilter）"""
+    if style in LEGACY_POINT:
+        out = alpha.point(LEGACY_POINT[style](threshold))
+    else:
+        out = Image.fromarray((legacy_hybrid if style == "hybrid" else legacy_adaptive)(alpha, threshold))
+    if shrink_px > 0:
+        out = out.filter(ImageFilter.GaussianBlur(radius=0.3))
+        out = out.filter(ImageFilter.MinFilter(2 * shrink_px + 1))
+    return np.asarray(out)
+
+
+@pytest.mark.parametrize("shrink_px", [0, 1, 3])
+@pytest.mark.parametrize("style", knockout.available_styles())
+def test_knockout_planes_matches_pillow_per_card(style, shrink_px):
+    planes = np.stack([np.asarray(a) for a in CARD_ALPHAS])
+    masks = knockout.knockout_planes(planes, style, 20, shrink_px)
+    assert masks.shape == planes.shape and masks.dtype == np.uint8
+    for alpha, mask in zip(CARD_ALPHAS, masks):
+        assert np.array_equal(mask, pillow_knockout(alpha, style, 20, shrink_px))
+
+
+# ---- 収縮（van Herk/Gil-Werman の最小値フィルタ）と MinFilter の比較 -----------------------
+
+@pytest.mark.parametrize("size", [(1, 1), (2, 9), (13, 7), (31, 24)])
+@pytest.mark.parametrize("radius", [0, 1, 2, 3, 5, 20])
+def test_erode_matches_min_filter(size, radius):
+    rng = np.random.default_rng(radius * 100 + size[0])
+    w, h = size
+    planes = rng.integers(0, 256, size=(3, h, w), dtype=np.uint8)
+    planes[1, 0, :] = 0      # 端の行・列の値が内側に正しく広がるか
+    planes[2, :, -1] = 255
+    if radius == 0:
+        expected = list(planes)  # MinFilter(1) は恒等変換（Pillow 12 では size=1 を渡すとプロセスが落ちる）
+    else:
+        expected = [np.asarray(Image.fromarray(p).filter(ImageFilter.MinFilter(2 * radius + 1))) for p in planes]
+    assert np.array_equal(knockout.erode_planes(planes, radius), np.stack(expected))
+    for plane, exp in zip(planes, expected):
+        assert np.array_equal(np.asarray(knockout.erode(Image.fromarray(plane), radius)), exp)
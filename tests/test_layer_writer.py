@@ -0,0 +1,156 @@
+"""
+layer_writer（レイヤーPNGの並列書き出し）のテスト
+
+失敗時に未着手の書き出しを取り消してスレッドプールを止めること、
+--png-strategy のどの値でも画素が変わらないこと、--crop-layers で切り抜いたレイヤーを
+マニフェストの位置に戻すと元のレイヤーと一致することを確かめる。
+"""
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from layer_writer import PNG_STRATEGIES, LayerWriter, new_layer, save_layers
+
+DPI = (350, 350)
+
+
+def noise_layer(seed, size=(61, 47)):
+    """透明部分・半透明部分・ノイズを含むRGBAレイヤー"""
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(0, 256, size=(size[1], size[0], 4), dtype=np.uint8)
+    arr[: size[1] // 3] = 0        # 透明な帯
+    arr[-4:, :, 3] = 255           # 不透明な帯
+    return Image.fromarray(arr, "RGBA")
+
+
+class Gate:
+    """最初の書き出しを止めておく変換関数（残りの書き出しをキューに積んだままにする）"""
+
+    def __init__(self, img):
+        self.img = img
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        assert self.release.wait(5)
+        return self.img
+
+    def release_later(self, seconds=0.1):
+        threading.Timer(seconds, self.release.set).start()
+
+
+def test_failure_cancels_queued_writes(tmp_path):
+    img = noise_layer(0)
+    gate = Gate(img)
+    paths = [tmp_path / f"sheet_{i}.png" for i in range(4)]
+    with pytest.raises(RuntimeError, match="page 2"):
+        with LayerWriter(max_workers=1) as writer:
+            futures = [writer.save(img, str(paths[0]), DPI, convert=gate)]
+            futures += [writer.save(img, str(p), DPI) for p in paths[1:]]
+            assert gate.started.wait(5)
+            gate.release_later()  # 書き出し中のものは取り消せないので、取り消しの後に終わらせる
+            raise RuntimeError("page 2 failed")
+    assert paths[0].exists()                       # 実行中だった書き出しは最後まで行う
+    assert not any(p.exists() for p in paths[1:])  # 未着手の書き出しは取り消す
+    assert all(f.cancelled() for f in futures[1:])
+    assert writer._executor._shutdown
+    with pytest.raises(RuntimeError):
+        writer.save(img, str(tmp_path / "after.png"), DPI)  # 止めたプールには積めない
+
+
+def test_close_waits_and_shuts_down(tmp_path):
+    paths = [tmp_path / f"sheet_{i}.png" for i in range(5)]
+    with LayerWriter(max_workers=2, max_pending=2) as writer:
+        for i, p in enumerate(paths):
+            writer.save(noise_layer(i), str(p), DPI)
+    assert all(p.exists() for p in paths)
+    assert writer._executor._shutdown
+
+
+def test_close_raises_write_errors(tmp_path):
+    writer = LayerWriter(max_workers=1)
+    writer.save(noise_layer(0), str(tmp_path / "missing_dir" / "sheet.png"), DPI)
+    with pytest.raises(OSError):
+        writer.close()
+    assert writer._executor._shutdown
+
+
+@pytest.mark.parametrize("compress_level", [None, 0, 1, 9])
+@pytest.mark.parametrize("strategy", sorted(PNG_STRATEGIES))
+def test_png_strategies_round_trip(tmp_path, strategy, compress_level):
+    layers = {"rgba": noise_layer(1), "l": noise_layer(2).getchannel("A"), "la": noise_layer(3).convert("LA")}
+    with LayerWriter(compress_level=compress_level, strategy=strategy) as writer:
+        for name, img in layers.items():
+            writer.save(img, str(tmp_path / f"{name}.png"), DPI)
+    for name, img in layers.items():
+        with Image.open(tmp_path / f"{name}.png") as f:
+            assert f.mode == img.mode
+            assert f.info["dpi"] == pytest.approx(DPI, abs=0.05)  # pHYs は1mあたりの画素数で丸められる
+            assert f.tobytes() == img.tobytes()
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        LayerWriter(strategy="zopfli")
+
+
+# ---- --crop-layers: 切り抜いたレイヤーをマニフェストの位置に戻すと元と一致する ----------------
+
+def sheet_layers(mask_format, size=(120, 90)):
+    """インクのあるレイヤー（RGBA・中間調のマスク・0/255のマスク）と空のレイヤー（glare）"""
+    layers = {name: new_layer(name, size, mask_format) for name in ["bg", "char", "char_knock", "cutline", "glare"]}
+    layers["bg"].paste(noise_layer(4, (50, 30)), (0, 0))                   # 左の端に接する（上の帯は透明）
+    layers["char"].paste(noise_layer(5, (33, 41)), (87, 49))               # 右下の端に接する
+    ramp = np.tile(np.arange(0, 250, 10, dtype=np.uint8), (12, 1))          # 中間調（bilevel にできない）
+    knock = Image.fromarray(np.dstack([np.zeros((12, 25, 3), np.uint8), ramp]), "RGBA")
+    layers["char_knock"].paste(knock if layers["char_knock"].mode == "RGBA" else knock.getchannel("A"), (30, 20))
+    cut = (0, 0, 0, 255) if layers["cutline"].mode == "RGBA" else 255
+    layers["cutline"].paste(cut, (10, 60, 110, 62))                          # 0/255だけ（bilevel では1bit）
+    return layers
+
+
+def read_back(path, entry):
+    """書き出したファイルをメモリ上の形式（RGBA または L＝インク濃度）に戻す"""
+    with Image.open(path) as f:
+        f.load()
+        if entry["mode"] == "RGBA":
+            return f.convert("RGBA")
+        if entry["mode"] == "LA":
+            return f.getchannel("A")
+        return ImageOps.invert(f.convert("L"))  # 白地に黒インク（値 = 255 - α）
+
+
+@pytest.mark.parametrize("mask_format", ["rgba", "la", "gray", "bilevel"])
+def test_cropped_layers_paste_back(tmp_path, mask_format):
+    layers = sheet_layers(mask_format)
+    prefix = str(tmp_path / "sheet")
+    (tmp_path / "sheet_glare.png").write_bytes(b"old")  # 以前の実行で書き出したファイル
+    with LayerWriter() as writer:
+        entries = save_layers(writer, layers, prefix, 350, mask_format=mask_format, crop=True)
+
+    with open(f"{prefix}_layers.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["cropped"] and manifest["size"] == [120, 90]
+    assert manifest["layers"] == entries and set(entries) == set(layers)
+    assert entries["glare"] == {"empty": True}
+    assert not (tmp_path / "sheet_glare.png").exists()
+    if mask_format == "bilevel":
+        assert entries["cutline"]["mode"] == "1" and entries["char_knock"]["mode"] == "L"
+
+    for name, original in layers.items():
+        entry = entries[name]
+        restored = Image.new(original.mode, original.size, 0)
+        if not entry.get("empty"):
+            crop = read_back(tmp_path / entry["file"], entry)
+            assert list(crop.size) == entry["size"] and crop.size != original.size
+            restored.paste(crop, tuple(entry["offset"]))
+        assert restored.tobytes() == original.tobytes(), name
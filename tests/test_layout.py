@@ -0,0 +1,87 @@
+"""
+layout.plan_pages（注文をページにまたがせないページ計画）のテスト
+
+間違えると注文が黙って別のページに分かれたり、ページの枚数を超えたりする。
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from layout import plan_pages
+
+
+def order_items(sizes):
+    """注文ごとのカード枚数から項目を作る（amountは1〜3枚に分ける）"""
+    items = []
+    for order_id, n in enumerate(sizes, start=1):
+        k = 0
+        while n > 0:
+            amount = min(n, 1 + k % 3)
+            items.append({"key": f"o{order_id}_{k}", "orderId": str(order_id), "amount": amount})
+            n -= amount
+            k += 1
+    return items
+
+
+def cards_by_order(pages):
+    """orderId → {ページ番号: 枚数}"""
+    result = {}
+    for page_no, page in enumerate(pages):
+        for info in page:
+            result.setdefault(info["orderId"], {}).setdefault(page_no, 0)
+            result[info["orderId"]][page_no] += info["amount"]
+    return result
+
+
+@pytest.mark.parametrize("capacity, sizes", [
+    (18, [5, 7, 3, 18, 1, 12, 6, 6, 4, 2]),
+    (6, [1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1]),
+    (4, [3, 3, 3, 1, 1, 1, 2, 2]),
+    (18, [17, 1, 16, 2, 9, 9, 9]),
+])
+def test_plan_pages_keeps_orders_together(capacity, sizes):
+    items = order_items(sizes)
+    pages = plan_pages(items, capacity)
+
+    assert all(sum(i["amount"] for i in page) <= capacity for page in pages)
+    placed = cards_by_order(pages)
+    for order_id, n in enumerate(sizes, start=1):
+        assert len(placed[str(order_id)]) == 1, f"order {order_id} split across pages"
+        assert sum(placed[str(order_id)].values()) == n
+    # 同じ注文のカードはページ内で隣り合う
+    for page in pages:
+        seen = []
+        for info in page:
+            if not seen or seen[-1] != info["orderId"]:
+                assert info["orderId"] not in seen
+                seen.append(info["orderId"])
+    # 項目は欠けず、amountも変わらない
+    assert sorted(i["key"] for page in pages for i in page) == sorted(i["key"] for i in items)
+
+
+@pytest.mark.parametrize("sizes", [
+    [8, 5, 5, 2],  # 次のページへ進むだけだと 8 / 5+5 / 2 の3ページ
+    [6, 7, 3, 4],  # 最初に入るページに置くと 6+3 / 7 / 4 の3ページ
+])
+def test_plan_pages_best_fit_uses_fewest_pages(sizes):
+    # 空きが一番少ないページに置くので、どちらも満杯の2ページになる
+    pages = plan_pages(order_items(sizes), 10)
+    assert sorted(sum(i["amount"] for i in page) for page in pages) == [10, 10]
+
+
+def test_plan_pages_splits_only_oversized_orders():
+    pages = plan_pages(order_items([3, 25, 4]), 10)
+    placed = cards_by_order(pages)
+    assert sorted(placed["2"].values()) == [5, 10, 10]  # 満杯2ページ＋端数
+    assert len(placed["1"]) == 1 and len(placed["3"]) == 1
+    assert all(sum(i["amount"] for i in page) <= 10 for page in pages)
+    assert sum(sum(i["amount"] for i in page) for page in pages) == 32
+
+
+def test_plan_pages_skips_empty_orders():
+    items = [{"key": "z", "orderId": "1", "amount": 0}, {"key": "a", "orderId": "2", "amount": 2}]
+    assert plan_pages(items, 4) == [[{"key": "a", "orderId": "2", "amount": 2}]]
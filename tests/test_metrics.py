@@ -0,0 +1,131 @@
+"""
+metrics（--metrics の計測）のテスト
+
+JSON / CSV / Prometheus の書き出し、bind() でスレッドプールにラベルを引き継ぐこと、
+実行が途中で失敗しても計測結果を書き出すことを確かめる。
+"""
+
+import csv
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import metrics
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    """このテストの間だけ計測を有効にする"""
+    monkeypatch.setattr(metrics, "_recorder", None)
+    return metrics.enable()
+
+
+def sample_records(recorder):
+    with metrics.labels(page=1):
+        for card in range(2):
+            with metrics.stage("decode", card=card, key=f"k{card}", file=f"c{card}.png"):
+                pass
+        with metrics.stage("composite"):
+            pass
+    with metrics.labels(page=2), metrics.stage("png_encode", file='sheet "2".png'):
+        pass
+    with metrics.stage("decode", file="logo.png"):  # pageラベルなし
+        pass
+    return list(recorder.records)
+
+
+def test_disabled_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(metrics, "_recorder", None)
+    with metrics.labels(page=1), metrics.stage("decode"):
+        pass
+    fn = lambda: 1
+    assert metrics.bind(fn) is fn
+    assert metrics.recorder() is None
+
+
+def test_write_json(recorder, tmp_path):
+    records = sample_records(recorder)
+    path = tmp_path / "m.json"
+    assert metrics.write_metrics(str(path), records, 1.5) == "json"
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["version"] == metrics.METRICS_VERSION and data["wall_seconds"] == 1.5
+    assert list(data["stages"]) == ["decode", "composite", "png_encode"]  # STAGES の順
+    assert data["stages"]["decode"]["calls"] == 3
+    assert set(data["pages"]) == {"1", "2"} and set(data["pages"]["1"]) == {"decode", "composite"}
+    assert len(data["records"]) == 5
+    assert data["records"][0]["page"] == 1 and data["records"][0]["card"] == 0
+
+
+def test_write_csv(recorder, tmp_path):
+    records = sample_records(recorder)
+    path = tmp_path / "m.csv"
+    assert metrics.write_metrics(str(path), records, 1.5) == "csv"
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert tuple(rows[0]) == metrics.CSV_FIELDS
+    assert [r["stage"] for r in rows] == [r["stage"] for r in records]
+    assert rows[0]["page"] == "1" and rows[0]["key"] == "k0" and rows[-1]["page"] == ""
+    assert all(float(r["seconds"]) >= 0 for r in rows)
+
+
+@pytest.mark.parametrize("suffix", [".prom", ".txt"])
+def test_write_prometheus(recorder, tmp_path, suffix):
+    records = sample_records(recorder)
+    path = tmp_path / f"m{suffix}"
+    assert metrics.write_metrics(str(path), records, 1.5) == "prometheus"
+    lines = path.read_text(encoding="utf-8").splitlines()
+    samples = {l.rsplit(" ", 1)[0]: l.rsplit(" ", 1)[1] for l in lines if not l.startswith("#")}
+    assert samples['sheet_stage_calls_total{stage="decode"}'] == "3"
+    assert 'sheet_page_stage_seconds{page="2",stage="png_encode"}' in samples
+    assert samples["sheet_wall_seconds"] == "1.500"
+    for name in ["sheet_stage_seconds_total", "sheet_stage_calls_total", "sheet_process_peak_rss_bytes"]:
+        assert f"# TYPE {name} " in "\n".join(lines)
+
+
+def test_write_format_override_and_unknown(recorder, tmp_path):
+    records = sample_records(recorder)
+    assert metrics.write_metrics(str(tmp_path / "m.out"), records, 1.0) == "json"  # 不明な拡張子はJSON
+    assert metrics.write_metrics(str(tmp_path / "m.json"), records, 1.0, fmt="csv") == "csv"
+    with pytest.raises(ValueError):
+        metrics.write_metrics(str(tmp_path / "m.json"), records, 1.0, fmt="xml")
+
+
+def test_bind_carries_labels_into_threads(recorder):
+    def work(card):
+        with metrics.stage("png_encode", card=card):
+            pass
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = []
+        for page in (1, 2):
+            with metrics.labels(page=page, key=f"p{page}"):
+                futures += [executor.submit(metrics.bind(work), card) for card in range(3)]
+        futures.append(executor.submit(metrics.bind(work, page=9), 0))  # 追加のラベル
+        futures.append(executor.submit(work, 0))                         # bind しなければラベルなし
+        for future in futures:
+            future.result()
+
+    got = sorted((r.get("page"), r.get("key"), r["card"]) for r in recorder.records if r.get("page"))
+    assert got == [(1, "p1", c) for c in range(3)] + [(2, "p2", c) for c in range(3)] + [(9, None, 0)]
+    assert sum(1 for r in recorder.records if "page" not in r) == 1
+    assert recorder.context() == {}  # 投入元のスレッドのラベルは元に戻る
+
+
+def test_cli_writes_metrics_when_run_fails(tmp_path):
+    images = json.dumps([{"key": "missing", "char": str(tmp_path / "missing.png"), "amount": 1}])
+    path = tmp_path / "m.json"
+    result = subprocess.run(
+        [sys.executable, str(ROOT / "index.py"), "--images", images, "--output-dir", str(tmp_path / "out"),
+         "--metrics", str(path)],
+        capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode != 0
+    assert json.loads(path.read_text(encoding="utf-8"))["version"] == metrics.METRICS_VERSION
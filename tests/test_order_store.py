@@ -0,0 +1,122 @@
+"""
+order_store（注文・画像の索引、SQLite）のテスト
+
+元のJSONが変わったかどうかの判定（mtime・サイズ → ハッシュ）と、索引の作り直しを確かめる。
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import order_store
+from order_store import OrderStore
+
+
+ORDERS = [
+    {"orderId": 1, "userName": "a", "receiveType": 0},
+    {"orderId": 2, "userName": "b", "receiveType": 1},
+    {"orderId": "3", "userName": "c", "receiveType": "0"},
+]
+IMAGES = [
+    {"key": "k1", "orderId": "1", "amount": 2},
+    {"key": "k2", "orderId": 2, "amount": 1},
+    {"key": "k3", "orderId": "3", "amount": 1},
+    {"key": "k4", "orderId": 1, "amount": 1},
+]
+
+
+# ---- order_store -------------------------------------------------------------
+
+def write_json(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.fixture
+def sources(tmp_path):
+    orders, images = tmp_path / "orders.json", tmp_path / "images.json"
+    write_json(orders, ORDERS)
+    write_json(images, IMAGES)
+    return str(orders), str(images), str(tmp_path / "index.sqlite")
+
+
+def bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_store_filters_in_source_order(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        assert store.sync(orders, images) == ["orders", "images"]
+        assert [o["orderId"] for o in store.orders(0)] == [1, "3"]
+        assert [i["key"] for i in store.images(0)] == ["k1", "k3", "k4"]
+        assert [i["key"] for i in store.images("1")] == ["k2"]
+        assert store.images(2) == []
+
+
+def test_store_skips_unchanged_sources(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        store.sync(orders, images)
+    with OrderStore(index) as store:
+        assert store.sync(orders, images) == []
+
+
+def test_store_touched_source_is_not_reloaded(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        store.sync(orders, images)
+        bump_mtime(orders)  # mtimeだけ変わる → ハッシュが同じなので読み直さない
+        assert store.sync(orders, images) == []
+        # 記録したmtimeも更新されているので、次はハッシュも計算しない
+        assert store._stale("orders", orders) is None
+
+
+def test_store_reloads_only_changed_source(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        store.sync(orders, images)
+        write_json(Path(orders), ORDERS + [{"orderId": 4, "userName": "d", "receiveType": 0}])
+        bump_mtime(orders)
+        assert store.sync(orders, images) == ["orders"]
+        assert [o["orderId"] for o in store.orders(0)] == [1, "3", 4]
+
+
+def test_store_detects_same_size_change(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        store.sync(orders, images)
+        st = os.stat(images)
+        changed = json.dumps(IMAGES).replace('"k2"', '"k9"')
+        Path(images).write_text(changed, encoding="utf-8")
+        os.utime(images, ns=(st.st_atime_ns, st.st_mtime_ns))  # サイズもmtimeも同じ
+        assert store.sync(orders, images) == []  # mtime・サイズが同じなら中身は見ない
+        bump_mtime(images)
+        assert store.sync(orders, images) == ["images"]
+        assert [i["key"] for i in store.images(1)] == ["k9"]
+
+
+def test_store_rebuilds_old_version(sources):
+    orders, images, index = sources
+    with OrderStore(index) as store:
+        store.sync(orders, images)
+    db = sqlite3.connect(index)
+    with db:
+        db.execute("UPDATE meta SET value = ? WHERE key = 'version'", (str(order_store.STORE_VERSION + 1),))
+    db.close()
+    with OrderStore(index) as store:
+        assert store.sync(orders, images) == ["orders", "images"]
+
+
+def test_store_rebuilds_corrupt_file(sources):
+    orders, images, index = sources
+    Path(index).write_bytes(b"not a sqlite database" * 100)
+    with OrderStore(index) as store:
+        assert store.sync(orders, images) == ["orders", "images"]
+        assert [i["key"] for i in store.images(0)] == ["k1", "k3", "k4"]